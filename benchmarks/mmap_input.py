@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Compare peak memory of regular and memory-mapped input files.
+
+Usage::
+
+    python benchmarks/mmap_input.py [input.psd ...]
+
+Without arguments, all the test fixtures are measured. Every measurement
+runs in a fresh process, which reports its peak resident set size after
+opening the document and after converting it.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+from glob import glob
+import json
+import os
+import subprocess
+import sys
+
+FIXTURES = sorted(glob(
+    os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', '*.psd')
+))
+
+
+def child(url, mmap):
+    import resource
+    from psd2svg import PSD2SVG
+
+    def peak():
+        # Kilobytes on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+    converter = PSD2SVG(mmap=mmap)
+    converter.reset()
+    converter._set_input(url)
+    opened = peak()
+    converter.convert(url)
+    print(json.dumps({'open': opened, 'convert': peak()}))
+
+
+def measure(url, mmap):
+    output = subprocess.check_output([
+        sys.executable, __file__, '--child', url, 'mmap' if mmap else 'file'])
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def main(inputs):
+    print('{:<32} {:>10} {:>10} {:>12} {:>12}'.format(
+        'file', 'open MB', 'mmap MB', 'convert MB', 'mmap MB'))
+    for url in inputs:
+        try:
+            before = measure(url, False)
+            after = measure(url, True)
+        except subprocess.CalledProcessError as e:
+            print('{:<32} skipped: {}'.format(os.path.basename(url), e))
+            continue
+        print('{:<32} {:>10.1f} {:>10.1f} {:>12.1f} {:>12.1f}'.format(
+            os.path.basename(url)[:32], before['open'], after['open'],
+            before['convert'], after['convert']))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], sys.argv[3] == 'mmap')
+    else:
+        main(sys.argv[1:] or FIXTURES)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Time path data generation of large vector masks.
+
+Usage::
+
+    python benchmarks/path_data.py [knots ...]
+
+Random closed and open subpaths with the given numbers of knots are
+converted with the former per-token generator and with the vectorized
+:py:meth:`~psd2svg.converter.shape.ShapeConverter._generate_path`, and the
+outputs are checked to be identical. The ``precision=3`` rows compare against
+the former output rounded by :py:func:`~psd2svg.utils.xml.round_numbers`.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+import random
+import sys
+import timeit
+from psd_tools.psd.vector import ClosedKnotLinked, ClosedPath, OpenPath
+from psd2svg.converter.shape import ShapeConverter
+from psd2svg.utils.xml import NUMBER_RE, format_number
+from svgwrite.utils import strlist
+
+
+class Converter(ShapeConverter):
+    width = 1920
+    height = 1080
+    precision = None
+    simplify_paths = False
+    path_tolerance = 0.0
+    relative_paths = False
+
+
+def legacy_path(converter, path_list, command='C'):
+    """The former generator, one token at a time."""
+    for path in path_list:
+        yield 'M'
+        yield path[0].anchor[1] * converter.width
+        yield path[0].anchor[0] * converter.height
+        yield command
+        points = (zip(path, path[1:] + path[0:1]) if path.is_closed()
+                  else zip(path, path[1:]))
+        for p1, p2 in points:
+            yield p1.leaving[1] * converter.width
+            yield p1.leaving[0] * converter.height
+            yield p2.preceding[1] * converter.width
+            yield p2.preceding[0] * converter.height
+            yield p2.anchor[1] * converter.width
+            yield p2.anchor[0] * converter.height
+        if path.is_closed():
+            yield 'Z'
+
+
+def random_path(cls, knots):
+    def point():
+        return (random.random(), random.random())
+    return cls(items=[
+        ClosedKnotLinked(point(), point(), point()) for _ in range(knots)])
+
+
+def legacy_rounded(converter, path_list, precision):
+    return NUMBER_RE.sub(
+        lambda match: format_number(float(match.group(0)), precision),
+        strlist(legacy_path(converter, path_list), ' '))
+
+
+def main(sizes):
+    random.seed(0)
+    print('{:>10} {:>10} {:>12} {:>12} {:>8}'.format(
+        'knots', 'precision', 'legacy ms', 'numpy ms', 'speedup'))
+    for size in sizes:
+        path_list = [random_path(ClosedPath, size), random_path(OpenPath, 8)]
+        for precision in (None, 3):
+            converter = Converter()
+            converter.precision = precision
+            if precision is None:
+                legacy = lambda: strlist(
+                    legacy_path(converter, path_list), ' ')
+            else:
+                legacy = lambda: legacy_rounded(
+                    converter, path_list, precision)
+            assert converter._generate_path(path_list) == legacy()
+            old = min(timeit.repeat(legacy, number=1, repeat=5))
+            new = min(timeit.repeat(
+                lambda: converter._generate_path(path_list),
+                number=1, repeat=5))
+            print('{:>10} {:>10} {:>12.2f} {:>12.2f} {:>7.1f}x'.format(
+                size, str(precision), old * 1e3, new * 1e3, old / new))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 100000])
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the native SVG serializer against the former minidom round trip.
+
+Usage::
+
+    python benchmarks/serializer.py [input.psd ...]
+
+Without arguments, all the test fixtures are measured. Each input is
+converted once, then both serializers are timed on the same drawing and
+their peak memory is measured with :py:mod:`tracemalloc`.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+from glob import glob
+import io
+import os
+import sys
+import timeit
+import tracemalloc
+import xml.dom.minidom as minidom
+from psd2svg import PSD2SVG
+from psd2svg.utils.xml import serialize
+
+FIXTURES = sorted(glob(
+    os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', '*.psd')
+))
+
+
+def minidom_svg(dwg):
+    with io.StringIO() as f:
+        dwg.write(f, pretty=False)
+        xml_string = f.getvalue().encode('utf-8')
+    return minidom.parseString(xml_string).toprettyxml(indent='  ')
+
+
+def native_svg(dwg):
+    return serialize(dwg.get_xml(), pretty=True)
+
+
+def measure(func, dwg, number=5):
+    seconds = min(timeit.repeat(lambda: func(dwg), number=1, repeat=number))
+    tracemalloc.start()
+    func(dwg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main(inputs):
+    converter = PSD2SVG()
+    print('{:<32} {:>12} {:>12} {:>12} {:>12}'.format(
+        'file', 'minidom ms', 'native ms', 'minidom MB', 'native MB'))
+    for url in inputs:
+        try:
+            converter.convert(url)
+        except Exception as e:
+            print('{:<32} skipped: {}'.format(os.path.basename(url), e))
+            continue
+        dwg = converter._dwg
+        assert minidom_svg(dwg) == native_svg(dwg)
+        old_time, old_peak = measure(minidom_svg, dwg)
+        new_time, new_peak = measure(native_svg, dwg)
+        print('{:<32} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}'.format(
+            os.path.basename(url)[:32], old_time * 1e3, new_time * 1e3,
+            old_peak / 2.0 ** 20, new_peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or FIXTURES)
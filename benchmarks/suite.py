@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Microbenchmarks of the converter hot paths.
+
+Usage::
+
+    python benchmarks/suite.py [-k NAME] [--save results.json]
+                               [--compare baseline.json] [--threshold 1.25]
+
+Every benchmark is timed over ``--repeat`` runs, and its peak memory is
+measured with :py:mod:`tracemalloc` in a separate run. ``--save`` writes the
+results as JSON, and ``--compare`` reports the benchmarks whose time or peak
+memory grew beyond ``--threshold`` times the baseline, exiting with status 1
+when any did. Baselines are only comparable on the same machine.
+
+End-to-end conversions run on a synthetic document and every test fixture.
+Fixtures that are Git LFS pointers are skipped, and any other benchmark that
+fails also exits with status 1.
+"""
+from __future__ import absolute_import, print_function, unicode_literals
+import argparse
+from collections import OrderedDict
+from glob import glob
+import io
+import json
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+import numpy as np
+from PIL import Image
+from psd_tools import PSDImage
+from psd_tools.psd.vector import ClosedKnotLinked, ClosedPath
+import svgwrite
+from psd2svg import PSD2SVG
+try:
+    from psd2svg.synthetic import generate
+except ImportError as e:
+    # Requires a recent psd-tools.
+    generate, generate_error = None, e
+
+FIXTURES = sorted(glob(
+    os.path.join(os.path.dirname(__file__), '..', 'tests', 'fixtures', '*.psd')
+))
+
+BENCHMARKS = OrderedDict()
+
+_LFS_POINTER = b'version https://git-lfs'
+
+
+class SkipBenchmark(Exception):
+    """Raised by a setup function when the benchmark cannot run here."""
+
+
+def benchmark(name):
+    """Register a setup function returning the callable to measure."""
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def _converter(**kwargs):
+    converter = PSD2SVG(**kwargs)
+    converter.reset()
+    converter._set_output(None)
+    converter._psd = PSDImage.new('RGB', (1920, 1080))
+    converter._dwg = svgwrite.Drawing(size=(1920, 1080))
+    return converter
+
+
+class _Value(object):
+    def __init__(self, value):
+        self.value = value
+
+
+class _Enum(object):
+    def __init__(self, enum):
+        self.enum = enum
+
+
+class _Color(dict):
+    classID = b'RGBC'
+
+
+def _color(red, green, blue):
+    return _Color([('Rd  ', _Value(red)), ('Grn ', _Value(green)),
+                   ('Bl  ', _Value(blue))])
+
+
+class _Effect(object):
+    size = 12.0
+    choke = 10.0
+    angle = 120.0
+    distance = 8.0
+    opacity = 75.0
+    blend_mode = b'mul '
+    color = True
+    value = {'Clr ': _Color([('Rd  ', 0.0), ('Grn ', 0.0), ('Bl  ', 0.0)])}
+
+
+@benchmark('encode')
+def encode():
+    """PNG encoding of a 512x512 RGBA bitmap into a data URI."""
+    converter = _converter()
+    pixels = np.random.RandomState(0).randint(
+        0, 256, (512, 512, 4), dtype=np.uint8)
+    pixels[:, :256] = (200, 100, 50, 255)
+    image = Image.fromarray(pixels, 'RGBA')
+    return lambda: converter._get_image_href(image)
+
+
+@benchmark('generate_path')
+def generate_path():
+    """Path data of a closed subpath with 10000 knots."""
+    converter = _converter()
+    rng = random.Random(0)
+    knots = [ClosedKnotLinked(*[(rng.random(), rng.random())
+                                for _ in range(3)])
+             for _ in range(10000)]
+    path_list = [ClosedPath(items=knots)]
+    return lambda: converter._generate_path(path_list)
+
+
+@benchmark('create_gradient')
+def create_gradient():
+    """Linear gradient of eight color and opacity stops."""
+    converter = _converter()
+    setting = {
+        'Type': _Enum(b'Lnr '),
+        'Angl': _Value(30.0),
+        'Grad': {
+            'Clrs': [{'Lctn': _Value(index * 512),
+                      'Clr ': _color(index * 30, 255 - index * 30, 128)}
+                     for index in range(8)],
+            'Trns': [{'Lctn': _Value(index * 512),
+                      'Opct': _Value(100.0 - index * 10)}
+                     for index in range(8)],
+        },
+    }
+    return lambda: converter.create_gradient(setting, (400, 300))
+
+
+@benchmark('effects')
+def effects():
+    """Drop shadow, outer glow and inner shadow filters of a layer."""
+    converter = _converter()
+    element = converter._dwg.rect(size=(100, 100))
+    effect = _Effect()
+
+    def run():
+        converter.create_drop_shadow(None, effect, element)
+        converter.create_outer_glow(None, effect, element)
+        converter.create_inner_shadow(None, effect, element, None)
+    return run
+
+
+@benchmark('serialize')
+def serialize():
+    """Serialization of a drawing with 200 groups of 10 elements."""
+    converter = _converter()
+    for index in range(200):
+        group = converter._dwg.add(converter._dwg.g(opacity=0.5))
+        group.set_desc(title='Layer {}'.format(index))
+        for offset in range(5):
+            group.add(converter._dwg.rect(
+                insert=(index, offset), size=(10.5, 20.25), fill='red'))
+            group.add(converter._dwg.path(
+                d='M 0 0 C 1.5 2.5 3.5 4.5 5 6 Z', fill='blue'))
+    return converter._get_svg
+
+
+@benchmark('convert:synthetic')
+def convert_synthetic():
+    """End-to-end conversion of 300 generated layers in nested groups."""
+    if generate is None:
+        raise SkipBenchmark(generate_error)
+    data = io.BytesIO()
+    generate(data, layers=300, depth=3, size=(4000, 3000),
+             max_layer_size=256)
+    converter = PSD2SVG()
+
+    def run():
+        data.seek(0)
+        converter.convert(data)
+    return run
+
+
+def _register_fixtures():
+    for url in FIXTURES:
+        name = 'convert:' + os.path.basename(url)
+
+        def setup(url=url):
+            with open(url, 'rb') as f:
+                if f.read(len(_LFS_POINTER)) == _LFS_POINTER:
+                    raise SkipBenchmark('Git LFS pointer')
+            converter = PSD2SVG()
+            return lambda: converter.convert(url)
+        setup.__doc__ = 'End-to-end conversion of {}.'.format(
+            os.path.basename(url))
+        BENCHMARKS[name] = setup
+
+
+_register_fixtures()
+
+
+def measure(func, repeat):
+    """Time and peak memory of the callable."""
+    func()  # Warm up caches and imports.
+    times = timeit.repeat(func, number=1, repeat=repeat)
+    tracemalloc.start()
+    try:
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return dict(min=min(times), median=float(np.median(times)),
+                peak_bytes=peak)
+
+
+def run(names, repeat):
+    """Results of the benchmarks, and the names of those that failed."""
+    results = OrderedDict()
+    failures = []
+    print('{:<36} {:>10} {:>10} {:>10}'.format(
+        'benchmark', 'min ms', 'median ms', 'peak MB'))
+    for name in names:
+        try:
+            result = measure(BENCHMARKS[name](), repeat)
+        except SkipBenchmark as e:
+            print('{:<36} skipped: {}'.format(name[:36], e))
+            continue
+        except Exception as e:
+            print('{:<36} failed: {!r}'.format(name[:36], e))
+            failures.append(name)
+            continue
+        results[name] = result
+        print('{:<36} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            name[:36], result['min'] * 1e3, result['median'] * 1e3,
+            result['peak_bytes'] / 2.0 ** 20))
+    return results, failures
+
+
+def compare(results, baseline, threshold):
+    """Messages of the results exceeding the baseline by the threshold."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for key in ('min', 'peak_bytes'):
+            if base[key] and result[key] > base[key] * threshold:
+                regressions.append('{}: {} {:.4g} -> {:.4g} ({:.2f}x)'.format(
+                    name, key, base[key], result[key],
+                    result[key] / base[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '-k', dest='keyword', default=None,
+        help='Only run benchmarks whose name contains KEYWORD.')
+    parser.add_argument(
+        '--repeat', type=int, default=5,
+        help='Number of timed runs of each benchmark, default 5.')
+    parser.add_argument('--save', metavar='FILE', help='Write results.')
+    parser.add_argument(
+        '--compare', metavar='FILE', help='Compare with baseline results.')
+    parser.add_argument(
+        '--threshold', type=float, default=1.25,
+        help='Ratio to the baseline reported as a regression, default 1.25.')
+    args = parser.parse_args(argv)
+
+    names = [name for name in BENCHMARKS
+             if not args.keyword or args.keyword in name]
+    results, failures = run(names, args.repeat)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(
+                python=platform.python_version(),
+                machine=platform.machine(),
+                results=results,
+            ), f, indent=2)
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for message in regressions:
+            print('REGRESSION ' + message)
+    if failures:
+        print('FAILED ' + ', '.join(failures))
+    return 1 if regressions or failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -54,6 +54,8 @@ setup(
     extras_require = {
         'hdfs': [
             'snakebite'],
+        'webhdfs': [
+            'hdfs'],
         'kerberos': [
             'python-krbV',
             'sasl'],
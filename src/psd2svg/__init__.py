@@ -1,49 +1,121 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
+import hashlib
 from logging import getLogger
 import os
-from tkinter import SE
 import svgwrite
 from psd_tools import PSDImage
+from psd2svg.batch import BatchResult, convert_batch, list_inputs
+from psd2svg.cache import DiskCache, LRUCache, get_result_cache
 from psd2svg.converter.adjustments import AdjustmentsConverter
 from psd2svg.converter.core import LayerConverter
 from psd2svg.converter.effects import EffectsConverter
+from psd2svg.converter.incremental import IncrementalConverter
 from psd2svg.converter.io import PSDReader, SVGWriter
 from psd2svg.converter.shape import ShapeConverter
 from psd2svg.converter.text import TextConverter
+from psd2svg.encoder import get_encoder
+from psd2svg.profiler import NULL_PROFILER, Profiler
+from psd2svg.utils.ids import IDNamespace
 from psd2svg.version import __version__
 
 
 logger = getLogger(__name__)
 
 
-def psd2svg(input, output=None, **kwargs):
-    converter = PSD2SVG(**kwargs)
+def psd2svg(input, output=None, jobs=1, max_memory=None, **kwargs):
+    """
+    Convert the given PSD to SVG.
 
-    if os.path.isdir(input):
-        try:
-            if output:            
-                os.makedirs(output)            
-        except:
-            pass                    
-        for filename in os.listdir(input):
-            if filename[-4:] == '.psd':
-                converter.convert(os.path.join(input, filename), os.path.join(output or '', filename[:-4] + '.svg'))
-        return
-    
+    When the input is a directory, every PSD file in it is converted with
+    :py:func:`~psd2svg.batch.convert_batch` using ``jobs`` worker processes,
+    and a list of :py:class:`~psd2svg.batch.BatchResult` is returned.
+    """
+    if (
+        not hasattr(input, 'read') and not hasattr(input, 'topil') and
+        os.path.isdir(input)
+    ):
+        return list(convert_batch(
+            list_inputs(input), output, jobs=jobs, max_memory=max_memory,
+            **kwargs))
+
+    converter = PSD2SVG(**kwargs)
     return converter.convert(input, output)
 
 
-class PSD2SVG(AdjustmentsConverter, EffectsConverter, LayerConverter,
-              PSDReader, ShapeConverter, SVGWriter, TextConverter):
+class PSD2SVG(AdjustmentsConverter, EffectsConverter, IncrementalConverter,
+              LayerConverter, PSDReader, ShapeConverter, SVGWriter,
+              TextConverter):
     """PSD to SVG converter
 
     input_url - url, file-like object, PSDImage, or any of its layer.
     output_url - url or file-like object to export svg. if None, return data.
     export_resource - use dataURI to embed bitmap (default True)
+    pretty - indent the output svg, otherwise write without whitespace.
+    encoder - name of the bitmap encoder or ImageEncoder (default png).
+    threads - number of threads decoding and encoding bitmaps (default 1).
+    scale - output size relative to the document. Bitmaps are resampled to
+        the output resolution when smaller than 1.
+    max_pixels_per_unit - upper limit of bitmap pixels per document pixel.
+    resample - resampling filter name, e.g. box, lanczos or nearest. The
+        default box averages the covered pixels, which compresses best.
+    precision - decimal places of numbers in attributes, or None to keep
+        full precision.
+    simplify_paths - write straight path segments as lines (default False).
+    path_tolerance - distance in pixels within which simplified path points
+        are considered on a straight line (default 0).
+    relative_paths - write path segments relative to the current point
+        (default False).
+    mmap - memory-map local input files, so layer data is read from disk
+        only when decoded (default False).
+    pattern_cache_size - number of decoded patterns kept across conversions.
+    pattern_cache_dir - directory to persist decoded patterns between
+        processes (default None).
+    fragment_cache_dir - directory of converted layers, enables incremental
+        conversion that reuses unchanged layers (default None).
+    fragment_cache_size - number of converted layers kept in memory.
+    result_cache_dir - directory of conversion results, reused for identical
+        input data and options (default None).
+    result_cache_max_bytes - size limit of the result cache directory.
+    profile - record wall and CPU time of stages and layers in
+        :py:attr:`timings` (default False).
+    timing_hooks - callables receiving ``(stage, layer, wall, cpu)`` of every
+        measured step, enables profiling.
     """
-    def __init__(self, resource_path=None, shapes_only=False, compact=False, padding=None, remove_color=False):
+    def __init__(self, resource_path=None, shapes_only=False, compact=False, padding=None, remove_color=False, pretty=True, encoder='png', threads=1,
+                 scale=1.0, max_pixels_per_unit=None, resample='box',
+                 pattern_cache_size=256, pattern_cache_dir=None, mmap=False,
+                 precision=None, simplify_paths=False, path_tolerance=0.0,
+                 relative_paths=False, fragment_cache_dir=None,
+                 fragment_cache_size=256, result_cache_dir=None,
+                 result_cache_max_bytes=1 << 30, profile=False,
+                 timing_hooks=None):
         self.resource_path = resource_path
+        self.scale = scale
+        self.max_pixels_per_unit = max_pixels_per_unit
+        self.resample = resample
+        self.mmap = mmap
+        self.precision = precision
+        self.simplify_paths = simplify_paths
+        self.path_tolerance = path_tolerance
+        self.relative_paths = relative_paths
+        self.threads = threads
+        self.pretty = pretty
+        self.encoder = (get_encoder(encoder) if isinstance(encoder, str)
+                        else encoder)
+        self._manifests = {}
+        self._pattern_cache = LRUCache(
+            pattern_cache_size,
+            backend=DiskCache(pattern_cache_dir) if pattern_cache_dir else None)
+        self._fragment_cache = LRUCache(
+            fragment_cache_size, backend=DiskCache(fragment_cache_dir)
+        ) if fragment_cache_dir else None
+        self._result_cache = get_result_cache(
+            result_cache_dir, result_cache_max_bytes
+        ) if result_cache_dir else None
+        self.profile = profile
+        self.timing_hooks = list(timing_hooks or [])
+        self._timings = None
         self.shapes_only = shapes_only
         self.compact = compact
         self.padding = padding
@@ -54,62 +126,151 @@ class PSD2SVG(AdjustmentsConverter, EffectsConverter, LayerConverter,
         self._psd = None
         self._white_filter = None
         self._identity_filter = None
-        svgwrite.utils.AutoID._set_value(0)
+        self._images = {}
+        self._resources = []
+        self._pending_resources = {}
+        self._defs = {}
+        self._executor = None
+        self._viewbox = None
+        self._ids = IDNamespace(short=self.compact)
+        self._fragment_keys = {}
+        self._layer_digests = {}
+        self._fragment_options = None
+        self._recorded_resources = []
+        self._profiler = (
+            Profiler(self.timing_hooks)
+            if self.profile or self.timing_hooks else NULL_PROFILER)
 
     def convert(self, layer, output=None):
-        """Convert the given PSD to SVG."""
+        """
+        Convert the given PSD to SVG.
+
+        Element ids are numbered per conversion, so separate converters may
+        run in parallel threads. A single converter converts one document at
+        a time.
+        """
         self.reset()
+        try:
+            with self._ids.activate():
+                return self._convert(layer, output)
+        finally:
+            if self._profiler is not NULL_PROFILER:
+                self._timings = self._profiler.as_dict()
+
+    @property
+    def timings(self):
+        """
+        Timings of the last conversion when profiling, see
+        :py:meth:`psd2svg.profiler.Profiler.as_dict`.
+        """
+        return self._timings
+
+    def _convert(self, layer, output):
+        if self._result_cache is not None and not hasattr(layer, 'topil'):
+            return self._convert_cached_result(layer, output)
         self._set_input(layer)
         self._set_output(output)
+        return self._save_svg(self._render())
 
+    def _convert_cached_result(self, layer, output):
+        """
+        Convert the input or reuse the result of identical input data.
+        """
+        with self._open_input(layer) as stream:
+            key = self._get_result_key(stream)
+            self._input = None if hasattr(layer, 'read') else layer
+            self._set_output(output)
+
+            def compute():
+                self._recorded_resources.append([])
+                try:
+                    self._load_stream(stream)
+                    return self._render(), self._recorded_resources[-1]
+                finally:
+                    self._recorded_resources.pop()
+
+            svg, resources = self._result_cache.get(key, compute)
+        for fmt, data in resources:
+            self._store_image(fmt, data)
+        return self._save_svg(svg)
+
+    def _get_result_key(self, stream):
+        """Digest of the input data and the options."""
+        digest = hashlib.sha1(self._get_options_key())
+        start = stream.tell()
+        for chunk in iter(lambda: stream.read(1 << 20), b''):
+            digest.update(chunk)
+        stream.seek(start)
+        return digest.hexdigest()
+
+    def _get_options_key(self):
+        """Options affecting the output, normalized to bytes."""
+        return repr((
+            __version__, self.shapes_only, self.compact,
+            tuple(self.padding) if self.padding else None,
+            self.remove_color, self.resource_path, self.pretty, self.encoder,
+            self.scale, self.max_pixels_per_unit, self.resample,
+            self.precision, self.simplify_paths, self.path_tolerance,
+            self.relative_paths,
+        )).encode('utf-8')
+
+    def _render(self):
+        """Convert the loaded input to svg markup."""
         layer = self._layer
         bbox = layer.viewbox if hasattr(layer, 'viewbox') else layer.bbox
         if bbox == (0, 0, 0, 0):
             bbox = self._psd.viewbox
 
+        self._viewbox = bbox
         if self.padding:
             viewbox = bbox
             bbox = (bbox[0] - self.padding[0], bbox[1] - self.padding[1], bbox[2] + self.padding[2], bbox[3] + self.padding[3])
+            # Only the intersection is visible after clipping.
+            self._viewbox = (max(bbox[0], viewbox[0]), max(bbox[1], viewbox[1]),
+                             min(bbox[2], viewbox[2]), min(bbox[3], viewbox[3]))
 
+        size = (bbox[2] - bbox[0], bbox[3] - bbox[1])
+        if self.scale != 1.0:
+            size = (size[0] * self.scale, size[1] * self.scale)
         self._dwg = svgwrite.Drawing(
-            size=(bbox[2] - bbox[0], bbox[3] - bbox[1]),
+            size=size,
             viewBox='%d %d %d %d' % (
                 bbox[0], bbox[1], bbox[2] - bbox[0], bbox[3] - bbox[1]
             ),
         )
 
-        container = self._dwg.g() if self.padding else self._dwg
+        with self._image_pool():
+            container = self._dwg.g() if self.padding else self._dwg
 
-        if layer.is_group():
-            self.create_group(layer, container)
-        else:
-            container.add(self.convert_layer(layer))
-            
-        if self.padding:
-            self._dwg.add(container)
-            
-            # clip element using original viewbox
-            clip_path = self._dwg.defs.add(self._dwg.clipPath())
-            clip_path.add(self._dwg.rect(
-                insert=(viewbox[0], viewbox[1]),
-                size=(viewbox[2] - viewbox[0],
-                        viewbox[3] - viewbox[1]),
-                ))
+            if layer.is_group():
+                self.create_group(layer, container)
+            else:
+                container.add(self.convert_layer(layer))
+
+            if self.padding:
+                self._dwg.add(container)
+
+                # clip element using original viewbox
+                clip_path = self._dwg.defs.add(self._dwg.clipPath())
+                clip_path.add(self._dwg.rect(
+                    insert=(viewbox[0], viewbox[1]),
+                    size=(viewbox[2] - viewbox[0],
+                            viewbox[3] - viewbox[1]),
+                    ))
 
-            container['clip-path'] = clip_path.get_funciri()
-                    
-        # Layerless PSDImage.
-        if (
-            isinstance(layer, PSDImage) and len(layer) == 0 and
-            layer.has_preview()
-        ):
-            self._dwg.add(self._dwg.image(
-                self._get_image_href(layer.topil()),
-                insert=(0, 0),
-                size=(layer.width, layer.height),
-                debug=False
-            ))
-        return self._save_svg()
+                container['clip-path'] = clip_path.get_funciri()
+
+            # Layerless PSDImage.
+            if (
+                isinstance(layer, PSDImage) and len(layer) == 0 and
+                layer.has_preview()
+            ):
+                self._dwg.add(self._get_image_element(
+                    layer.topil(),
+                    insert=(0, 0),
+                    size=(layer.width, layer.height),
+                ))
+            return self._get_svg()
 
     @property
     def width(self):
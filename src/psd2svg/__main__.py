@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
-from __future__ import absolute_import, unicode_literals
+from __future__ import absolute_import, print_function, unicode_literals
 import argparse
 import logging
 import os
+import sys
 from psd2svg import psd2svg
+from psd2svg.batch import convert_batch, list_inputs
+from psd2svg.encoder import ENCODERS, get_encoder
+
 
 def main():
+    if sys.argv[1:2] == ['serve']:
+        from psd2svg.server import main as serve
+        return serve(sys.argv[2:])
+
     parser = argparse.ArgumentParser(description='Convert PSD file to SVG')
     parser.add_argument(
         'input', metavar='INPUT', type=str, help='Input PSD file path or URL')
@@ -23,14 +31,113 @@ def main():
         '--loglevel', metavar='LEVEL', default='WARNING',
         help='Logging level, default WARNING')
     parser.add_argument('--shapes-only', action='store_true', help='Ignore layers and mask containing pixels.')
-    parser.add_argument('--compact', action='store_true', help='Optimize output svg size by storing only visible layers, skipping layer titles, etc.')
+    parser.add_argument('--compact', action='store_true', help='Optimize output svg size by storing only visible layers, skipping layer titles, default attributes, etc.')
     parser.add_argument('--padding', nargs=4, type=float, help='Values to add padding: left, top, right, bottom. Can be negative to clip the output.')
     parser.add_argument('--remove-color', action='store_true', help='Remove all colors, the shape will be rendered with current color.')
+    parser.add_argument('--compact-xml', action='store_true', help='Write svg without indentation and line breaks.')
+    parser.add_argument(
+        '--encoder', metavar='FORMAT', default='png', choices=ENCODERS,
+        help='Bitmap encoder, one of {}. auto picks the smallest result '
+             'within the quality threshold. default png.'.format(
+                 ', '.join(ENCODERS)))
+    parser.add_argument(
+        '--quality', metavar='Q', type=int, default=None,
+        help='Quality of lossy bitmap formats, 1 to 100. default 85.')
+    parser.add_argument(
+        '--compress-level', metavar='N', type=int, default=None,
+        help='PNG compression level, 0 to 9.')
+    parser.add_argument(
+        '--psnr-threshold', metavar='DB', type=float, default=None,
+        help='Minimum PSNR of lossy results accepted by the auto encoder. '
+             'default 40.')
+    parser.add_argument(
+        '--scale', metavar='S', type=float, default=1.0,
+        help='Output size relative to the document. Bitmaps are downsampled '
+             'when smaller than 1. default 1.')
+    parser.add_argument(
+        '--max-pixels-per-unit', metavar='P', type=float, default=None,
+        help='Maximum bitmap resolution in pixels per document pixel.')
+    parser.add_argument(
+        '--resample', metavar='FILTER', default='box',
+        choices=('nearest', 'box', 'bilinear', 'hamming', 'bicubic',
+                 'lanczos'),
+        help='Resampling filter of downsampled bitmaps. default box.')
+    parser.add_argument(
+        '--threads', metavar='N', type=int, default=1,
+        help='Number of threads decoding and encoding bitmaps within a '
+             'document, default 1.')
+    parser.add_argument(
+        '--precision', metavar='N', type=int, default=None,
+        help='Decimal places of coordinates and other numbers, default full '
+             'precision.')
+    parser.add_argument(
+        '--simplify-paths', action='store_true',
+        help='Write straight path segments as lines.')
+    parser.add_argument(
+        '--path-tolerance', metavar='D', type=float, default=0.0,
+        help='Drop path points within D pixels of a straight line when '
+             'simplifying paths, default 0.')
+    parser.add_argument(
+        '--relative-paths', action='store_true',
+        help='Write path segments relative to the current point.')
+    parser.add_argument(
+        '--mmap', action='store_true',
+        help='Memory-map local input files to reduce peak memory of large '
+             'documents.')
+    parser.add_argument(
+        '--pattern-cache-dir', metavar='DIR', default=None,
+        help='Directory to keep decoded patterns between runs.')
+    parser.add_argument(
+        '--fragment-cache-dir', metavar='DIR', default=None,
+        help='Directory to keep converted layers between runs. Only changed '
+             'layers are converted again.')
+    parser.add_argument(
+        '--result-cache-dir', metavar='DIR', default=None,
+        help='Directory to keep conversion results between runs. Identical '
+             'input data with the same options is not converted again.')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='Print wall and CPU time of the conversion stages and the '
+             'slowest layers of a single input.')
+    parser.add_argument(
+        '--profile-top', metavar='N', type=int, default=10,
+        help='Number of layers in the profile report, default 10.')
+    parser.add_argument(
+        '--profile-output', metavar='FILE', default=None,
+        help='Also write cProfile statistics of the conversion to FILE, '
+             'readable by pstats.')
+    parser.add_argument(
+        '--jobs', '-j', metavar='N', type=int, default=1,
+        help='Number of worker processes when INPUT is a directory. 0 uses '
+             'all the CPUs, default 1.')
+    parser.add_argument(
+        '--max-memory', metavar='MB', type=int, default=None,
+        help='Memory limit of each worker process in megabytes.')
+    parser.add_argument(
+        '--timeout', metavar='SECONDS', type=float, default=None,
+        help='Time limit of each file when INPUT is a directory.')
     args = parser.parse_args()
 
     logging.basicConfig(level=getattr(logging, args.loglevel.upper(),
                                       'WARNING'))
 
+    options = dict(
+        resource_path=args.resource_path, shapes_only=args.shapes_only,
+        compact=args.compact, padding=args.padding,
+        remove_color=args.remove_color, pretty=not args.compact_xml,
+        encoder=get_encoder(
+            args.encoder, quality=args.quality,
+            compress_level=args.compress_level,
+            threshold=args.psnr_threshold),
+        threads=args.threads, scale=args.scale,
+        max_pixels_per_unit=args.max_pixels_per_unit, resample=args.resample,
+        pattern_cache_dir=args.pattern_cache_dir,
+        fragment_cache_dir=args.fragment_cache_dir,
+        result_cache_dir=args.result_cache_dir, mmap=args.mmap,
+        precision=args.precision, simplify_paths=args.simplify_paths,
+        path_tolerance=args.path_tolerance,
+        relative_paths=args.relative_paths)
+
     prefix, ext = os.path.splitext(args.output)
     if ext.lower() in (".png", ".jpg", ".jpeg", ".gif" ".tiff"):
         from psd2svg.rasterizer import create_rasterizer
@@ -39,8 +146,43 @@ def main():
         psd2svg(args.input, svg_file, resource_path=args.resource_path)
         image = rasterizer.rasterize(svg_file)
         image.save(args.output)
+    elif os.path.isdir(args.input):
+        results = convert_batch(
+            list_inputs(args.input), args.output, jobs=args.jobs or None,
+            max_memory=args.max_memory * 1024 * 1024 if args.max_memory else None,
+            timeout=args.timeout, **options)
+        failed = 0
+        for result in results:
+            if result.ok:
+                print('OK {} -> {}'.format(result.input, result.output))
+            else:
+                failed += 1
+                print('FAILED {}'.format(result.input), file=sys.stderr)
+        if failed:
+            sys.exit(1)
+    elif args.profile or args.profile_output:
+        _profile(args, options)
     else:
-        psd2svg(args.input, args.output, resource_path=args.resource_path, shapes_only=args.shapes_only, compact=args.compact, padding=args.padding, remove_color=args.remove_color)
+        psd2svg(args.input, args.output, **options)
+
+
+def _profile(args, options):
+    import cProfile
+    from psd2svg import PSD2SVG
+    from psd2svg.profiler import format_report
+
+    converter = PSD2SVG(profile=True, **options)
+    profile = cProfile.Profile() if args.profile_output else None
+    if profile:
+        profile.enable()
+    try:
+        converter.convert(args.input, args.output)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile_output)
+    print(format_report(converter.timings, top=args.profile_top),
+          file=sys.stderr)
 
 
 if __name__ == '__main__':
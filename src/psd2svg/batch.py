@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+Batch conversion over a pool of worker processes.
+
+Each worker process builds a single :py:class:`~psd2svg.PSD2SVG` instance in
+its initializer and reuses it for every file it is handed, so module imports
+and converter setup are paid once per worker instead of once per file.
+
+Workers report which file they start, so a file whose worker exits, e.g.
+killed by the system when out of memory, or that runs beyond the timeout
+fails without stalling the rest of the batch.
+"""
+from __future__ import absolute_import, unicode_literals
+from collections import deque, namedtuple
+from logging import getLogger
+import multiprocessing
+import os
+import signal
+import time
+import traceback
+
+logger = getLogger(__name__)
+
+
+class BatchResult(namedtuple('BatchResult', ['input', 'output', 'error'])):
+    """
+    Outcome of a single file in a batch.
+
+    ``output`` is the saved url on success, ``error`` is the formatted
+    traceback on failure.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+_worker_converter = None
+_worker_started = None
+
+
+def list_inputs(dirname, ext='.psd'):
+    """List input files with the given extension in the directory."""
+    return [
+        os.path.join(dirname, filename)
+        for filename in sorted(os.listdir(dirname))
+        if filename.lower().endswith(ext)
+    ]
+
+
+def convert_batch(inputs, output=None, jobs=None, max_memory=None,
+                  maxtasksperchild=None, timeout=None, **kwargs):
+    """
+    Convert multiple PSD files, yielding results in order as they finish.
+
+    :param inputs: iterable of input urls.
+    :param output: output directory. Each output name is inferred from the
+        input name.
+    :param jobs: number of worker processes. ``None`` uses all the CPUs, and
+        ``1`` converts in the current process unless ``max_memory`` is set.
+    :param max_memory: per-worker address space limit in bytes. A file that
+        exceeds the limit fails with ``MemoryError`` without affecting others.
+    :param maxtasksperchild: number of files after which a worker process is
+        replaced, to return memory fragmented by large documents.
+    :param timeout: seconds after which the worker converting a file is
+        terminated and the file fails. ``None`` waits indefinitely.
+    :param kwargs: options passed to :py:class:`~psd2svg.PSD2SVG`.
+    :return: iterator of :py:class:`BatchResult`, in input order.
+    """
+    tasks = [
+        (url, os.path.join(output or '', _output_name(url)))
+        for url in inputs
+    ]
+    if output and not os.path.isdir(output):
+        os.makedirs(output)
+
+    if not tasks:
+        return
+    if (jobs == 1 or len(tasks) == 1) and not max_memory and not timeout:
+        from psd2svg import PSD2SVG
+        converter = PSD2SVG(**kwargs)
+        for task in tasks:
+            yield _convert_task(task, converter)
+        return
+
+    # The memory limit and the timeout need worker processes. Workers report
+    # started files through a queue without a feeder thread, so the message
+    # is not lost when the worker exits right after.
+    started = multiprocessing.SimpleQueue()
+    pool = multiprocessing.Pool(
+        processes=min(jobs or multiprocessing.cpu_count(), len(tasks)),
+        initializer=_init_worker,
+        initargs=(kwargs, max_memory, started),
+        maxtasksperchild=maxtasksperchild,
+    )
+    try:
+        for result in _collect(pool, tasks, started, timeout):
+            yield result
+    finally:
+        # Results of lost workers never arrive, so the pool is not closed.
+        pool.terminate()
+        pool.join()
+
+
+def _collect(pool, tasks, started, timeout, interval=0.1):
+    """Yield results of the tasks in order, failing lost or hung workers."""
+    results = [pool.apply_async(_run_task, (index, task))
+               for index, task in enumerate(tasks)]
+    pending = deque(range(len(tasks)))
+    # Started tasks without a result yet, by index.
+    running = {}
+    failed = {}
+    while pending:
+        index = pending[0]
+        if index in failed:
+            pending.popleft()
+            yield failed.pop(index)
+            continue
+        results[index].wait(interval)
+        if results[index].ready():
+            pending.popleft()
+            running.pop(index, None)
+            yield results[index].get()
+            continue
+
+        while not started.empty():
+            started_index, pid = started.get()
+            running[started_index] = (pid, time.time())
+        alive = set(child.pid for child in multiprocessing.active_children())
+        for other, (pid, start) in list(running.items()):
+            result = results[other]
+            if result.ready():
+                del running[other]
+                continue
+            if pid not in alive:
+                # The result of a finished worker may still be on its way.
+                result.wait(1.0)
+                if result.ready():
+                    continue
+                error = 'Worker process exited'
+            elif timeout and time.time() - start > timeout:
+                os.kill(pid, signal.SIGTERM)
+                error = 'Timed out after {} seconds'.format(timeout)
+            else:
+                continue
+            # The pool replaces the worker.
+            logger.error('Failed to convert {}: {}'.format(
+                tasks[other][0], error))
+            del running[other]
+            failed[other] = BatchResult(tasks[other][0], None, error)
+
+
+def _output_name(url):
+    return os.path.splitext(os.path.basename(url))[0] + '.svg'
+
+
+def _init_worker(kwargs, max_memory=None, started=None):
+    global _worker_converter, _worker_started
+    from psd2svg import PSD2SVG
+    if max_memory:
+        _set_memory_limit(max_memory)
+    _worker_converter = PSD2SVG(**kwargs)
+    _worker_started = started
+
+
+def _set_memory_limit(max_memory):
+    try:
+        import resource
+    except ImportError:
+        logger.warning('Memory limit is not supported on this platform')
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    if hard != resource.RLIM_INFINITY:
+        max_memory = min(max_memory, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory, hard))
+
+
+def _run_task(index, task):
+    _worker_started.put((index, os.getpid()))
+    return _convert_task(task, _worker_converter)
+
+
+def _convert_task(task, converter):
+    input_url, output_url = task
+    try:
+        logger.info('Converting {}'.format(input_url))
+        saved = converter.convert(input_url, output_url)
+        return BatchResult(input_url, saved, None)
+    except Exception:
+        error = traceback.format_exc()
+        logger.error('Failed to convert {}: {}'.format(input_url, error))
+        return BatchResult(input_url, None, error)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded caches shared by conversions.
+
+:py:class:`LRUCache` keeps recently used values in memory and can be backed
+by a :py:class:`DiskCache`, which persists pickled values between processes
+and evicts the least recently used files beyond a size limit.
+:py:class:`ResultCache` computes each missing value once, however many
+threads ask for it at the same time.
+"""
+from __future__ import absolute_import, unicode_literals
+from collections import OrderedDict
+import hashlib
+from logging import getLogger
+import os
+import pickle
+import tempfile
+import threading
+
+logger = getLogger(__name__)
+
+
+class LRUCache(object):
+    """
+    In-memory least recently used cache.
+
+    :param maxsize: maximum number of entries kept in memory.
+    :param backend: optional :py:class:`DiskCache` consulted on a miss and
+        written on every put.
+    :param max_bytes: optional limit of the total size of the values kept in
+        memory, as measured by ``sizeof``. Larger values are not kept.
+    :param sizeof: size of a value, default ``len``.
+    """
+    def __init__(self, maxsize=128, backend=None, max_bytes=None,
+                 sizeof=len):
+        self.maxsize = maxsize
+        self.backend = backend
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._items = OrderedDict()
+        self._sizes = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._items:
+                value = self._items.pop(key)
+                self._items[key] = value
+                return value
+        if self.backend is not None:
+            value = self.backend.get(key)
+            if value is not None:
+                self._put(key, value)
+                return value
+        return default
+
+    def put(self, key, value):
+        self._put(key, value)
+        if self.backend is not None:
+            self.backend.put(key, value)
+
+    def _put(self, key, value):
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            if key in self._items:
+                del self._items[key]
+                self._total -= self._sizes.pop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            self._items[key] = value
+            self._sizes[key] = size
+            self._total += size
+            while len(self._items) > self.maxsize or (
+                self.max_bytes is not None and self._total > self.max_bytes
+            ):
+                old_key, _ = self._items.popitem(last=False)
+                self._total -= self._sizes.pop(old_key)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._sizes.clear()
+            self._total = 0
+
+
+class DiskCache(object):
+    """
+    Pickled values in a local directory, evicted by least recent use.
+
+    Each value is stored in a file named by the digest of its key. Reading an
+    entry refreshes its modification time. Once the size of the directory,
+    tracked across writes, passes ``max_bytes``, the oldest files are evicted
+    until it fits in ``low_water`` of the limit. Writes are atomic, so
+    several processes may share the directory.
+    """
+    low_water = 0.9
+
+    def __init__(self, path, max_bytes=1 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        # Size of the directory, unknown until listed.
+        self._size = None
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def _filename(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, digest + '.pickle')
+
+    def get(self, key):
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception as e:
+            logger.warning('Broken cache entry {}: {}'.format(filename, e))
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        fd, temp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            os.rename(temp, self._filename(key))
+        except BaseException:
+            os.remove(temp)
+            raise
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            full = self._size is None or self._size > self.max_bytes
+        if full:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries beyond the size limit."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if not name.endswith('.pickle'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+        max_bytes = self.max_bytes
+        if total > max_bytes:
+            max_bytes = int(max_bytes * self.low_water)
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+        with self._lock:
+            self._size = total
+
+
+class ResultCache(object):
+    """
+    Values computed once per key and kept in a :py:class:`DiskCache`.
+
+    While a value is computed, other threads asking for the same key wait
+    for it instead of computing it again. Use :py:func:`get_result_cache` to
+    share the cache of a directory between converters.
+    """
+    def __init__(self, path, max_bytes=1 << 30):
+        self.disk = DiskCache(path, max_bytes=max_bytes)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def get(self, key, compute):
+        """Return the cached value of the key, or the result of compute()."""
+        value = self.disk.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self._pending[key] = [threading.Event(), None]
+        if not owner:
+            pending[0].wait()
+            if pending[1] is None:
+                # The computation failed, try again.
+                return self.get(key, compute)
+            return pending[1]
+
+        try:
+            # Stored by an owner that finished since the first lookup.
+            value = self.disk.get(key)
+            if value is None:
+                value = compute()
+                self.disk.put(key, value)
+            pending[1] = value
+            return value
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending[0].set()
+
+
+_result_caches = {}
+_result_caches_lock = threading.Lock()
+
+
+def get_result_cache(path, max_bytes=1 << 30):
+    """Shared :py:class:`ResultCache` of the directory."""
+    path = os.path.abspath(path)
+    with _result_caches_lock:
+        cache = _result_caches.get(path)
+        if cache is None:
+            cache = _result_caches[path] = ResultCache(path, max_bytes)
+        cache.disk.max_bytes = max_bytes
+        return cache
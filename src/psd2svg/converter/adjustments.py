@@ -116,7 +116,7 @@ class AdjustmentsConverter(object):
 
 
     def create_blackwhite(self, adjustment):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt.feColorMatrix(
             'SourceImage',
             type='matrix',
@@ -125,7 +125,7 @@ class AdjustmentsConverter(object):
                    '0.333 0.333 0.333 0 0 '
                    '0.333 0.333 0.333 0 0 '
                    '0 0 0 1 0 ')
-        container = self._dwg.g(filter=filt.get_funciri())
+        container = self._dwg.g(filter=self._intern_def(filt).get_funciri())
         return container
 
 
@@ -224,7 +224,7 @@ class AdjustmentsConverter(object):
                          operator='over')
 
     def _add_brightness(self, items, cged, layer):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'brightness'
         result = 'brightness'
         if cged:
@@ -254,10 +254,10 @@ class AdjustmentsConverter(object):
         transfer.feFuncB('linear', slope=1 + contrast,
                          intercept=-contrast * means)
         self._add_feimage_mask_if_exist(layer, filt, result)
-        return filt.get_funciri()
+        return self._intern_def(filt).get_funciri()
 
     def _add_exposure(self, items, layer):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'exposure'
         exposure = 2 ** (items.exposure / 2)   # [-20, 20]
         gamma = - np.log(items.gamma) + 1.0    # [9.99,0.01]
@@ -273,10 +273,10 @@ class AdjustmentsConverter(object):
                          offset=offset, exponent=gamma)
         transfer.feFuncA('identity')
         self._add_feimage_mask_if_exist(layer, filt, result)
-        return filt.get_funciri()
+        return self._intern_def(filt).get_funciri()
 
     def _add_levels(self, items, layer):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'levels'
         result = 'levels'
         transfer = filt.feComponentTransfer(result=result)
@@ -289,10 +289,10 @@ class AdjustmentsConverter(object):
         # TODO: Implement levels adjustment.
         #
         self._add_feimage_mask_if_exist(layer, filt, result)
-        return filt.get_funciri()
+        return self._intern_def(filt).get_funciri()
 
     def _add_huesaturation(self, items, layer):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'hue-saturation'
         result = 'hsl'
         hue = items.master[0]
@@ -314,10 +314,10 @@ class AdjustmentsConverter(object):
             transfer.feFuncG('linear', slope=1, intercept=lightness)
             transfer.feFuncB('linear', slope=1, intercept=lightness)
         self._add_feimage_mask_if_exist(layer, filt, result)
-        return filt.get_funciri()
+        return self._intern_def(filt).get_funciri()
 
     def _add_vibrance(self, items, layer):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'vibrance'
         items = dict(items.descriptor.items)
         vibrance = items.get(b'vibrance', None)
@@ -338,10 +338,10 @@ class AdjustmentsConverter(object):
             matrix = filt.feColorMatrix(type='saturate', values=1.0,
                                         result=result)
         self._add_feimage_mask_if_exist(layer, filt, result)
-        return filt.get_funciri()
+        return self._intern_def(filt).get_funciri()
 
     def _add_curves(self, items, layer):
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'curves'
         result = 'curves'
         transfer = filt.feComponentTransfer(result=result)
@@ -354,7 +354,7 @@ class AdjustmentsConverter(object):
         # TODO: Implement cuves adjustment.
         #
         self._add_feimage_mask_if_exist(layer, filt, result)
-        return filt.get_funciri()
+        return self._intern_def(filt).get_funciri()
 
 
 def _get_signed_int32(value):
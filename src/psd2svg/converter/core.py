@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
+import hashlib
 from logging import getLogger
 import svgwrite
+from svgwrite.etree import etree
 from psd_tools.api.layers import AdjustmentLayer, FillLayer, ShapeLayer
 from psd_tools.api.pil_io import convert_pattern_to_pil
 from psd_tools.constants import Tag
 from psd2svg.converter.constants import BLEND_MODE
+from psd2svg.converter.io import _get_image_digest
 from psd2svg.utils.xml import safe_utf8
 from psd2svg.utils.color import cmyk2rgb
 import numpy as np
@@ -27,6 +30,10 @@ class LayerConverter(object):
 
         :return: SVG element.
         """
+        with self._profiler.measure_layer(layer):
+            return self._convert_layer(layer)
+
+    def _convert_layer(self, layer):
         if self.compact and not layer.visible:
             return None
 
@@ -35,9 +42,12 @@ class LayerConverter(object):
 
         elif not self.shapes_only and layer.has_pixels():
             element = self.create_image(layer)
+            if not element:
+                return None
 
         elif isinstance(layer, ShapeLayer):
-            element = self.convert_shape(layer)
+            with self._profiler.measure('shape', layer):
+                element = self.convert_shape(layer)
             if not element:
                 return None
 
@@ -67,35 +77,81 @@ class LayerConverter(object):
             assert layer.is_group(), "Vector mask alone is only supported for group layers"
             element = self.convert_shape(layer, [element])   # pass group as initial elements
                         
-        element = self.add_effects(layer, element)
+        with self._profiler.measure('effects', layer):
+            element = self.add_effects(layer, element)
 
         # Clipping is in group, because the parent is not accessible...
         return element
 
+    def _iter_layer_images(self, layer, root=False):
+        """
+        Iterate over (layer, is_mask) of the bitmaps in conversion order.
+
+        This follows the conditions of :py:meth:`convert_layer` and
+        :py:meth:`create_mask`, and is used to decode bitmaps ahead of the
+        conversion. The root group is converted without its mask.
+        """
+        if (
+            self.compact and not layer.visible and
+            not (root and layer.is_group())
+        ):
+            return
+        if layer.is_group():
+            for child in layer:
+                if self._has_fragment(child):
+                    # Reused without decoding.
+                    continue
+                for item in self._iter_layer_images(child):
+                    yield item
+                for clip_layer in child.clip_layers:
+                    for item in self._iter_layer_images(clip_layer):
+                        yield item
+            if root:
+                return
+        elif self.shapes_only:
+            return
+        elif layer.has_pixels():
+            yield layer, False
+        elif not isinstance(layer, (ShapeLayer, FillLayer)):
+            # Adjustment and empty layers are skipped with their masks.
+            return
+        if (
+            not self.shapes_only and layer.has_mask() and
+            not layer.mask.disabled and
+            layer.mask.width != 0 and layer.mask.height != 0
+        ):
+            yield layer, True
+
     def create_group(self, group, container=None):
         """Create and fill in a new group element."""
         if not container:
             container = self._dwg.g()
         for layer in group:
-            element = self.convert_layer(layer)
-            if not element:
-                continue
-            container.add(element)
+            for element in self._convert_cached(layer, self._convert_child):
+                container.add(element)
+        return container
 
-            # Clipping layers are in the separate element.
-            if layer.clip_layers:
-                container.add(self.create_clipping(layer, element))
+    def _convert_child(self, layer):
+        """Convert the layer of a group and its clipping layers."""
+        element = self.convert_layer(layer)
+        if not element:
+            return []
 
-        return container
+        # Clipping layers are in the separate element.
+        if layer.clip_layers:
+            return [element, self.create_clipping(layer, element)]
+        return [element]
 
     def create_image(self, layer):
         """Create an image element."""
-        element = self._dwg.image(
-            self._get_image_href(layer.topil()),
-            insert=(layer.left, layer.top),
-            size=(layer.width, layer.height),
-            debug=False)  # To disable attribute validation.
-        return element
+        image, digest, bbox = self._get_layer_image(layer)
+        if image is None:
+            return None
+        return self._get_image_element(
+            image,
+            insert=(bbox[0], bbox[1]),
+            size=(bbox[2] - bbox[0], bbox[3] - bbox[1]),
+            digest=digest)
 
     def create_rect(self, layer):
         """Create a shape or adjustment element."""
@@ -129,10 +185,13 @@ class LayerConverter(object):
             insert=(viewbox[0], viewbox[1]),
             size=(viewbox[2] - viewbox[0], viewbox[3] - viewbox[1]),
             fill='rgb({0},{0},{0})'.format(layer.mask.background_color)))
-        mask_element.add(self._dwg.image(
-            self._get_image_href(layer.mask.topil()),
-            size=(layer.mask.width, layer.mask.height),
-            insert=(layer.mask.left, layer.mask.top)))
+        image, digest, bbox = self._get_layer_image(layer, mask=True)
+        if image is not None:
+            mask_element.add(self._get_image_element(
+                image,
+                size=(bbox[2] - bbox[0], bbox[3] - bbox[1]),
+                insert=(bbox[0], bbox[1]),
+                digest=digest))
         mask_element['color-interpolation'] = 'sRGB'
         return mask_element
 
@@ -249,14 +308,18 @@ class LayerConverter(object):
     def create_pattern(self, setting, insert=(0, 0)):
         """Create a pattern element."""
         pattern_id = setting['Ptrn']['Idnt'].value.strip('\x00')
-        pattern = self._psd._get_pattern(pattern_id)
         phase = (0, 0)  #setting.phase
         scale = 100.  #setting.scale.value  # TODO: Check unit
+        key = ('pattern', pattern_id, tuple(insert), phase, scale)
+        if key in self._defs:
+            return self._defs[key]
+
+        pattern = self._psd._get_pattern(pattern_id)
         if not pattern:
             logger.error('Pattern data not found')
             return self._dwg.defs.add(svgwrite.pattern.Pattern())
 
-        image = convert_pattern_to_pil(pattern)
+        image, digest, encoded = self._get_pattern_image(pattern_id, pattern)
         element = self._dwg.defs.add(svgwrite.pattern.Pattern(
             width=image.width,
             height=image.height,
@@ -265,13 +328,49 @@ class LayerConverter(object):
             patternTransform='translate({},{}) scale({})'.format(
                 insert[0] + phase[0], insert[1] + phase[1], scale / 100.0),
         ))
-        element.add(self._dwg.image(
-            self._get_image_href(image),
+        element.add(self._get_image_element(
+            image,
             insert=(0, 0),
             size=(image.width, image.height),
+            digest=digest,
+            encoded=encoded,
         ))
+        self._defs[key] = element
         return element
 
+    def _get_pattern_image(self, pattern_id, pattern):
+        """
+        Decoded and encoded pattern bitmap, cached across conversions.
+
+        :return: tuple of PIL image, pixel digest and encoded image.
+        """
+        key = '{}:{}:{}:{!r}'.format(
+            pattern_id, hashlib.md5(pattern.tobytes()).hexdigest(),
+            self._get_pixels_per_unit(), self.encoder)
+        entry = self._pattern_cache.get(key)
+        if entry is None:
+            image = convert_pattern_to_pil(pattern)
+            entry = (image, _get_image_digest(image),
+                     self._encode_image(image))
+            self._pattern_cache.put(key, entry)
+        return entry
+
+    def _intern_def(self, element):
+        """
+        Add the element to defs, or return an identical one already there.
+
+        Filters, gradients and the like are keyed by their serialized
+        content, so layers sharing a style refer to a single definition.
+        """
+        xml = element.get_xml()
+        xml.attrib.pop('id', None)
+        key = etree.tostring(xml)
+        interned = self._defs.get(key)
+        if interned is None:
+            interned = self._dwg.defs.add(element)
+            self._defs[key] = interned
+        return interned
+
     def create_gradient(self, setting, size):
         if setting['Type'].enum == b'Lnr ':
             theta = np.radians(-setting['Angl'].value)
@@ -286,11 +385,9 @@ class LayerConverter(object):
             start = [np.around(x, decimals=6) for x in start]
             end = [np.around(x, decimals=6) for x in end]
 
-            element = self._dwg.defs.add(svgwrite.gradients.LinearGradient(
-                start=start, end=end))
+            element = svgwrite.gradients.LinearGradient(start=start, end=end)
         elif setting['Type'].enum == b'Rdl ':
-            element = self._dwg.defs.add(svgwrite.gradients.RadialGradient(
-                center=None, r=.5))
+            element = svgwrite.gradients.RadialGradient(center=None, r=.5)
         else:
             logger.warning('Unsupported gradient type %s' % (setting['Type']))
             return None
@@ -298,7 +395,7 @@ class LayerConverter(object):
         gradient = setting.get('Grad')
         if not gradient.get('Clrs'):
             logger.warning("Unsupported gradient type %s".format(gradient))
-            return element
+            return self._intern_def(element)
 
         # Interpolate color and opacity for both points.
         cp = np.array([x['Lctn'].value / 4096.0 for x in gradient['Clrs']])
@@ -348,4 +445,4 @@ class LayerConverter(object):
             color = tuple(fc[:, index].astype(np.uint8).tolist())
             element.add_stop_color(offset=mp[index], opacity=fo[index],
                                    color='rgb{}'.format(color))
-        return element
+        return self._intern_def(element)
@@ -201,8 +201,7 @@ class EffectsConverter(object):
         radius = effect.distance
         dx = -radius * np.cos(np.radians(angle))
         dy = radius * np.sin(np.radians(angle))
-        filt = self._dwg.defs.add(self._dwg.filter(
-            x='-50%', y='-50%', size=('200%', '200%')))
+        filt = self._dwg.filter(x='-50%', y='-50%', size=('200%', '200%'))
         filt['class'] = 'drop-shadow'
 
         filt.feOffset('SourceAlpha', dx=dx, dy=dy, result='drshOffset')
@@ -217,6 +216,7 @@ class EffectsConverter(object):
         filt.feComposite('drshFlood', in2='drshBlurA', operator='in',
                          result='drshShadow')
 
+        filt = self._intern_def(filt)
         shadow = self._dwg.use(element.get_iri(), filter=filt.get_funciri())
         shadow['class'] = 'layer-effect dropshadow'
         self.add_blend_mode(shadow, effect.blend_mode)
@@ -226,8 +226,7 @@ class EffectsConverter(object):
         """Create an outer glow effect."""
         blur = effect.size
         spread = effect.choke / 100.0
-        filt = self._dwg.defs.add(self._dwg.filter(
-            x='-50%', y='-50%', size=('200%', '200%')))
+        filt = self._dwg.filter(x='-50%', y='-50%', size=('200%', '200%'))
         filt['class'] = 'outerglow'
 
         # Saturate alpha mask before glow if non-zero spread.
@@ -263,6 +262,7 @@ class EffectsConverter(object):
         filt.feComposite('orglShadow', in2='SourceAlpha', operator='out',
                          result='orglShadowA')
 
+        filt = self._intern_def(filt)
         glow = self._dwg.use(element.get_iri(), filter=filt.get_funciri())
         glow['class'] = 'layer-effect outer-glow'
         self.add_blend_mode(glow, effect.blend_mode)
@@ -276,7 +276,7 @@ class EffectsConverter(object):
         dx = -radius * np.cos(np.radians(angle))
         dy = radius * np.sin(np.radians(angle))
 
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'inner-shadow'
         flood = filt.feFlood(result='irshFlood')
         flood['flood-color'] = self.create_solid_color(effect.value['Clr '])
@@ -290,6 +290,7 @@ class EffectsConverter(object):
         filt.feComposite('irshBlur', in2='SourceAlpha', operator='in',
                          result='irshShadow')
 
+        filt = self._intern_def(filt)
         shadow = self._dwg.use(element.get_iri(), filter=filt.get_funciri())
         shadow['class'] = 'layer-effect inner-shadow'
         self.add_blend_mode(
@@ -302,7 +303,7 @@ class EffectsConverter(object):
         spread = effect.choke / 100.0
 
         # Real inner glow needs distance transform.
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'inner-glow'
         flood = filt.feFlood(result='irglFlood')
         # TODO: Gradient fill
@@ -326,6 +327,7 @@ class EffectsConverter(object):
         filt.feComposite('irglBlur', in2='irglAlpha', operator='in',
                          result='irglShadow')
 
+        filt = self._intern_def(filt)
         glow = self._dwg.use(element.get_iri(), filter=filt.get_funciri())
         glow['class'] = 'layer-effect inner-glow'
         self.add_blend_mode(
@@ -337,12 +339,7 @@ class EffectsConverter(object):
         # In SVG, bevel and emboss need to be split into two elements.
 
         # Shadow.
-        filt = self._dwg.defs.add(self._dwg.filter())
-        shadow = self._dwg.use(
-            element.get_iri(), filter=filt.get_funciri())
-        shadow['class'] = 'layer-effect bevel-emboss shadow'
-        shadow['opacity'] = effect.shadow_opacity / 100.0
-        self.add_blend_mode(shadow, effect.shadow_mode)
+        filt = self._dwg.filter()
         filt['class'] = 'bevel-emboss shadow'
         if effect.bevel_style == b'InrB':
             blur = filt.feGaussianBlur('SourceAlpha', result='blur',
@@ -386,13 +383,15 @@ class EffectsConverter(object):
                 effect.bevel_style
             ))
 
-        # Highlight.
-        filt = self._dwg.defs.add(self._dwg.filter())
-        highlight = self._dwg.use(
+        filt = self._intern_def(filt)
+        shadow = self._dwg.use(
             element.get_iri(), filter=filt.get_funciri())
-        highlight['class'] = 'layer-effect bevel-emboss highlight'
-        highlight['opacity'] = effect.highlight_opacity / 100.0
-        self.add_blend_mode(highlight, effect.highlight_mode)
+        shadow['class'] = 'layer-effect bevel-emboss shadow'
+        shadow['opacity'] = effect.shadow_opacity / 100.0
+        self.add_blend_mode(shadow, effect.shadow_mode)
+
+        # Highlight.
+        filt = self._dwg.filter()
         filt['class'] = 'bevel-emboss highlight'
         if effect.bevel_style == b'InrB':
             blur = filt.feGaussianBlur('SourceAlpha', result='blur',
@@ -428,6 +427,13 @@ class EffectsConverter(object):
                 effect.bevel_style
             ))
 
+        filt = self._intern_def(filt)
+        highlight = self._dwg.use(
+            element.get_iri(), filter=filt.get_funciri())
+        highlight['class'] = 'layer-effect bevel-emboss highlight'
+        highlight['opacity'] = effect.highlight_opacity / 100.0
+        self.add_blend_mode(highlight, effect.highlight_mode)
+
         container = self._dwg.g()
         container.add(shadow)
         container.add(highlight)
@@ -452,7 +458,7 @@ class EffectsConverter(object):
         dx = -radius * np.cos(np.radians(angle))
         dy = radius * np.sin(np.radians(angle))
 
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'satin'
         filt.feOffset('SourceAlpha', result='shape1', dx=dx, dy=dy)
         filt.feOffset('SourceAlpha', result='shape2', dx=-dx, dy=-dy)
@@ -483,6 +489,7 @@ class EffectsConverter(object):
             **{'color-interpolation-filters': 'sRGB'})
         filt.feComposite('blur', in2='SourceAlpha', operator='in')
 
+        filt = self._intern_def(filt)
         satin = self._dwg.use(
             element.get_iri(), filter=filt.get_funciri())
         satin['class'] = 'layer-effect satin'
@@ -496,7 +503,7 @@ class EffectsConverter(object):
         radius = int(effect.size)  # TODO: Check unit.
         style = effect.position
 
-        filt = self._dwg.defs.add(self._dwg.filter())
+        filt = self._dwg.filter()
         filt['class'] = 'stroke'
         flood = filt.feFlood(result='frfxFlood')
         # TODO: Implement gradient or pattern fill
@@ -541,6 +548,7 @@ class EffectsConverter(object):
                              result='frfxMorph')
             filt.feComposite('frfxFlood', in2='frfxMorph', operator='in')
 
+        filt = self._intern_def(filt)
         stroke = self._dwg.use(element.get_iri(), filter=filt.get_funciri())
         stroke['class'] = 'layer-effect stroke'
         self.add_blend_mode(stroke, effect.blend_mode)
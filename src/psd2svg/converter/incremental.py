@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import copy
+import hashlib
+from logging import getLogger
+from svgwrite.utils import AutoID
+from psd2svg.utils.ids import IDNamespace
+
+logger = getLogger(__name__)
+
+# Ids inside a recorded fragment start with this, followed by the key.
+_FRAGMENT_PREFIX = 'psd2svg-fragment-'
+
+
+class IncrementalConverter(object):
+    """
+    Reuse converted layers of previous conversions.
+
+    Each layer is converted together with its clipping layers into a
+    fragment, keyed by a digest of the layer records, channel data and the
+    conversion options. A fragment holds the serialized elements, the
+    definitions they refer to and the exported bitmaps, so unchanged layers
+    are inserted without decoding any pixels. Changed groups are converted
+    again, reusing their unchanged children.
+
+    Fragments do not share definitions or bitmaps with other layers, and
+    element ids are numbered in document order once the tree is complete, so
+    the output does not depend on which fragments were reused.
+    """
+
+    def _convert_cached(self, layer, convert):
+        """
+        Elements of the layer from the fragment cache, or ``convert(layer)``.
+        """
+        if self._fragment_cache is None:
+            return convert(layer)
+        key = self._get_fragment_key(layer)
+        fragment = self._fragment_cache.get(key)
+        if fragment is None:
+            fragment = self._record_fragment(layer, key, convert)
+            self._fragment_cache.put(key, fragment)
+        else:
+            logger.debug('Reusing {}'.format(layer))
+        return self._insert_fragment(key, fragment)
+
+    def _has_fragment(self, layer):
+        return (self._fragment_cache is not None and
+                self._fragment_cache.get(self._get_fragment_key(layer))
+                is not None)
+
+    def _get_fragment_key(self, layer):
+        key = self._fragment_keys.get(id(layer))
+        if key is None:
+            if self._fragment_options is None:
+                self._fragment_options = self._get_fragment_options()
+            digest = hashlib.sha1(self._fragment_options)
+            digest.update(self._get_layer_digest(layer))
+            for clip_layer in layer.clip_layers:
+                digest.update(self._get_layer_digest(clip_layer))
+            # Pixels out of the visible window are cropped.
+            digest.update(repr(self._get_crop_window(layer)).encode('ascii'))
+            key = digest.hexdigest()
+            self._fragment_keys[id(layer)] = key
+        return key
+
+    def _get_layer_digest(self, layer):
+        """Digest of the layer data, including children of groups."""
+        value = self._layer_digests.get(id(layer))
+        if value is None:
+            digest = hashlib.sha1(layer._record.tobytes())
+            if layer._channels is not None:
+                digest.update(layer._channels.tobytes())
+            if layer.is_group():
+                for child in layer:
+                    digest.update(self._get_layer_digest(child))
+                    for clip_layer in child.clip_layers:
+                        digest.update(self._get_layer_digest(clip_layer))
+            value = self._layer_digests[id(layer)] = digest.digest()
+        return value
+
+    def _get_fragment_options(self):
+        """Digest of the options and document data affecting any layer."""
+        digest = hashlib.sha1(self._get_options_key())
+        record = self._psd._record
+        digest.update(record.header.tobytes())
+        # Patterns of pattern fills are global.
+        tagged_blocks = record.layer_and_mask_information.tagged_blocks
+        if tagged_blocks is not None:
+            digest.update(tagged_blocks.tobytes())
+        return digest.digest()
+
+    def _record_fragment(self, layer, key, convert):
+        """Convert the layer apart from the rest of the document."""
+        defs = self._dwg.defs.elements
+        start = len(defs)
+        state = (self._defs, self._images, self._white_filter,
+                 self._identity_filter)
+        self._defs, self._images = {}, {}
+        self._white_filter = self._identity_filter = None
+        self._recorded_resources.append([])
+        try:
+            with IDNamespace(prefix=_FRAGMENT_PREFIX + key + '-').activate():
+                elements = [element.get_xml() for element in convert(layer)]
+                definitions = [element.get_xml() for element in defs[start:]]
+            for xml in elements + definitions:
+                self._resolve_image_hrefs(xml)
+        finally:
+            resources = self._recorded_resources.pop()
+            (self._defs, self._images, self._white_filter,
+             self._identity_filter) = state
+            # Inserted again from the fragment.
+            del defs[start:]
+        return elements, definitions, resources
+
+    def _insert_fragment(self, key, fragment):
+        """Add definitions and return elements with ids unique in the tree."""
+        elements, definitions, resources = fragment
+        for fmt, data in resources:
+            self._store_image(fmt, data)
+        prefix = _FRAGMENT_PREFIX + key + '-'
+        replacement = AutoID.next_id() + '-'
+        for xml in definitions:
+            self._dwg.defs.add(
+                _Fragment(_replace_prefix(xml, prefix, replacement)))
+        return [_Fragment(_replace_prefix(xml, prefix, replacement))
+                for xml in elements]
+
+    def _record_resource(self, fmt, data):
+        """Remember an exported bitmap in the result being recorded."""
+        if self._recorded_resources:
+            resources = self._recorded_resources[-1]
+            if (fmt, data) not in resources:
+                resources.append((fmt, data))
+
+
+class _Fragment(object):
+    """Serialized element in place of an svgwrite element."""
+    def __init__(self, xml):
+        self.xml = xml
+        self.elementname = xml.tag
+
+    def get_xml(self):
+        return self.xml
+
+
+def _replace_prefix(xml, prefix, replacement):
+    xml = copy.deepcopy(xml)
+    for node in xml.iter():
+        for name, value in node.attrib.items():
+            if prefix in value:
+                node.set(name, value.replace(prefix, replacement))
+    return xml
@@ -1,14 +1,20 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
+import asyncio
 import base64
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import hashlib
-import io
 from logging import getLogger
 import os
+from PIL import Image
 from psd_tools import PSDImage
 from psd_tools.api.layers import Layer
-from psd2svg.storage import get_storage
-import xml.dom.minidom as minidom
+from psd2svg.storage import ResourceManifest, get_storage, run_sync
+from psd2svg.utils.ids import IDNamespace
+from psd2svg.utils.xml import (
+    remove_default_attributes, renumber_ids, round_numbers, serialize)
 
 
 logger = getLogger(__name__)
@@ -25,16 +31,31 @@ class PSDReader(object):
             self._load_storage(input_data)
 
     def _load_storage(self, url):
+        with self._open_input(url) as f:
+            self._load_stream(f)
+        self._input = url
+
+    @contextmanager
+    def _open_input(self, url):
+        """Open the input url, or pass an input stream through."""
+        if hasattr(url, 'read'):
+            yield url
+            return
         storage = get_storage(os.path.dirname(url))
         filename = os.path.basename(url)
         logger.debug('Opening {}'.format(url))
-        with storage.open(filename) as f:
-            self._load_stream(f)
-        self._input = url
+        if self.mmap and hasattr(storage, 'open_mapped'):
+            # The map outlives the file, psd_tools keeps views of its data.
+            with storage.open_mapped(filename) as f:
+                yield f
+        else:
+            with storage.open(filename) as f:
+                yield f
 
     def _load_stream(self, stream):
         self._input = None
-        self._psd = PSDImage.open(stream)
+        with self._profiler.measure('parse'):
+            self._psd = PSDImage.open(stream)
         self._layer = self._psd
 
     def _load_psd(self, psd):
@@ -77,13 +98,25 @@ class SVGWriter(object):
             else:
                 raise ValueError('Invalid output: {}'.format(output_data))
 
-    def _save_svg(self):
+    def _save_svg(self, pretty_string):
         # Write to the output.
-        pretty_string = self._get_svg()
+        with self._profiler.measure('upload'):
+            self._flush_resources()
+        with self._profiler.measure('write'):
+            return self._write_svg(pretty_string)
+
+    def _write_svg(self, pretty_string):
         if self._output_file:
             url = self._output.url(self._output_file)
-            logger.info('Saving {}'.format(url))
-            self._output.put(self._output_file, pretty_string.encode('utf-8'))
+            data = pretty_string.encode('utf-8')
+            if (
+                self._output.digest(self._output_file) ==
+                hashlib.md5(data).hexdigest()
+            ):
+                logger.info('Unchanged {}'.format(url))
+            else:
+                logger.info('Saving {}'.format(url))
+                self._output.put(self._output_file, data)
             return url
         elif self._output:
             self._output.write(pretty_string)
@@ -91,30 +124,306 @@ class SVGWriter(object):
         else:
             return pretty_string
 
+    def _flush_resources(self):
+        """Upload new resources concurrently, before the svg refers to them."""
+        pending, self._pending_resources = self._pending_resources, {}
+        if not pending:
+            return
+        # Names are only listed once stored, so failed uploads are retried.
+        run_sync(_put_all(self._resource, pending.items(),
+                          self._get_resource_manifest()))
+
+    @property
+    def resources(self):
+        """Urls of the bitmaps referenced by the last conversion."""
+        return list(self._resources)
+
     def _get_svg(self):
-        with io.StringIO() as f:
-            # svgwrite's pretty option is not compatible with Python 2.7
-            # unicode. Here we manually encode utf-8.
-            self._dwg.write(f, pretty=False)
-            xml_string = f.getvalue().encode('utf-8')
-
-        xml_tree = minidom.parseString(xml_string)
-        return xml_tree.toprettyxml(indent='  ')
-
-    def _get_image_href(self, image, fmt='png', icc_profile=None):
-        if image.mode == 'CMYK':
-            image = image.convert('RGB')
-        with io.BytesIO() as output:
-            image.save(output, format=fmt, icc_profile=icc_profile)
-            encoded_image = output.getvalue()
+        with self._profiler.measure('serialize'):
+            return self._serialize_svg()
+
+    def _serialize_svg(self):
+        xml = self._dwg.get_xml()
+        self._resolve_image_hrefs(xml)
+        if self._fragment_cache is not None:
+            renumber_ids(xml, IDNamespace(short=self.compact))
+        if self.precision is not None:
+            round_numbers(xml, self.precision)
+        if self.compact:
+            remove_default_attributes(xml)
+        return serialize(xml, pretty=self.pretty)
+
+    @contextmanager
+    def _image_pool(self):
+        """
+        Decode and encode bitmaps on a thread pool during the conversion.
+
+        Layer and mask pixels are decoded ahead of the tree walk, and image
+        hrefs are placeholders until the encoded data is filled in by
+        :py:meth:`_get_svg`, so the output is identical to the serial path.
+        """
+        if not self.threads or self.threads <= 1:
+            self._executor = None
+            yield
+            return
+
+        executor = ThreadPoolExecutor(self.threads)
+        self._executor = executor
+        self._prefetcher = _ImagePrefetcher(
+            executor, self._load_layer_image,
+            self._iter_layer_images(self._layer, root=True),
+            window=2 * self.threads)
+        self._pending_hrefs = {}
+        try:
+            yield
+        finally:
+            self._prefetcher.close()
+            self._executor = None
+            self._prefetcher = None
+            self._pending_hrefs = {}
+            executor.shutdown()
+
+    def _get_layer_image(self, layer, mask=False):
+        """
+        Return decoded pixels of the layer or its mask.
+
+        :return: tuple of image, pixel digest and bbox of the image in the
+            document. The image is None when it is entirely out of view.
+        """
+        if self._executor is not None:
+            return self._prefetcher.get((id(layer), mask), layer, mask)
+        return self._load_layer_image(layer, mask)
+
+    def _load_layer_image(self, layer, mask=False):
+        """
+        Decode the layer or its mask, cropped to the visible window.
+
+        Pixels further than the reach of the effects outside of the output
+        viewbox can never be displayed, so they are not encoded.
+        """
+        source = layer.mask if mask else layer
+        bbox = source.bbox
+        window = self._get_crop_window(layer)
+        if window is not None:
+            cropped = (max(bbox[0], window[0]), max(bbox[1], window[1]),
+                       min(bbox[2], window[2]), min(bbox[3], window[3]))
+            if cropped[0] >= cropped[2] or cropped[1] >= cropped[3]:
+                logger.debug('Skipping out of view {}'.format(layer))
+                return None, None, cropped
+        with self._profiler.measure('decode', layer):
+            image = source.topil()
+            if window is not None and cropped != tuple(bbox):
+                image = image.crop((
+                    cropped[0] - bbox[0], cropped[1] - bbox[1],
+                    cropped[2] - bbox[0], cropped[3] - bbox[1]))
+                bbox = cropped
+            return image, _get_image_digest(image), tuple(bbox)
+
+    def _get_crop_window(self, layer):
+        """Region of the document that can affect the visible output."""
+        if self._viewbox is None:
+            return None
+        reach = 0
+        while layer is not None:
+            for effect in getattr(layer, 'effects', ()):
+                if effect.enabled:
+                    reach += (getattr(effect, 'distance', 0) +
+                              3 * getattr(effect, 'size', 0))
+            layer = layer.parent
+        reach = int(reach) + 1
+        return (self._viewbox[0] - reach, self._viewbox[1] - reach,
+                self._viewbox[2] + reach, self._viewbox[3] + reach)
+
+    def _get_image_element(self, image, insert, size=None, digest=None,
+                           encoded=None):
+        """
+        Create an image element, sharing identical bitmaps in the document.
+
+        The first occurrence of a bitmap is an ordinary ``<image>``. When the
+        same pixels appear again, the bitmap is moved to a single ``<image>``
+        in ``<defs>``, and every occurrence becomes a ``<use>`` translated
+        by ``x`` and ``y``. Attributes set on the occurrences, such as mask or
+        opacity, stay on the ``<use>`` elements.
+
+        ``encoded`` is a tuple of format and bytes already produced by the
+        encoder, in which case the image is not encoded again.
+        """
+        size = size or image.size
+        digest = (digest or _get_image_digest(image), tuple(size))
+        element, shared = self._images.get(digest, (None, False))
+        if element is None:
+            href = (self._store_image(*encoded) if encoded
+                    else self._get_image_href(image))
+            element = self._dwg.image(
+                href,
+                insert=insert,
+                size=size,
+                debug=False)  # To disable attribute validation.
+            if self._get_pixels_per_unit() < 1.0:
+                # Resampled pixels are stretched back to the document size.
+                element['preserveAspectRatio'] = 'none'
+            self._images[digest] = (element, False)
+            return element
+
+        if not shared:
+            # Second occurrence, move the bitmap to defs.
+            first = element
+            element = self._dwg.defs.add(self._dwg.image(
+                first.attribs['xlink:href'], insert=(0, 0), size=size,
+                debug=False))
+            if 'preserveAspectRatio' in first.attribs:
+                element['preserveAspectRatio'] = first.attribs.pop(
+                    'preserveAspectRatio')
+            self._images[digest] = (element, True)
+            _replace_with_use(first, element)
+        return self._dwg.use(element.get_iri(), insert=insert)
+
+    def _get_resource_manifest(self):
+        """Manifest of the resource storage, kept across conversions."""
+        url = self._resource.url()
+        if url not in self._manifests:
+            self._manifests[url] = ResourceManifest(self._resource)
+        return self._manifests[url]
+
+    def _get_image_href(self, image, icc_profile=None):
+        if self._executor is not None:
+            token = 'psd2svg:pending:{}'.format(len(self._pending_hrefs))
+            self._pending_hrefs[token] = self._executor.submit(
+                self._encode_image, image, icc_profile)
+            return token
+        return self._store_image(*self._encode_image(image, icc_profile))
+
+    def _resolve_image_hrefs(self, xml):
+        """Replace placeholder hrefs with the encoded images."""
+        if not self._executor or not self._pending_hrefs:
+            return
+        resolved = {}
+        for element in xml.iter():
+            href = element.get('xlink:href')
+            if href not in self._pending_hrefs:
+                continue
+            if href not in resolved:
+                resolved[href] = self._store_image(
+                    *self._pending_hrefs[href].result())
+            element.set('xlink:href', resolved[href])
+
+    def _encode_image(self, image, icc_profile=None):
+        with self._profiler.measure('encode'):
+            if image.mode == 'CMYK':
+                image = image.convert('RGB')
+            image = self._resample_image(image)
+            return self.encoder.encode(image, icc_profile)
+
+    def _get_pixels_per_unit(self):
+        """Resolution of embedded bitmaps, never above the source."""
+        ppu = self.scale
+        if self.max_pixels_per_unit:
+            ppu = min(ppu, self.max_pixels_per_unit)
+        return min(ppu, 1.0)
+
+    def _resample_image(self, image):
+        ppu = self._get_pixels_per_unit()
+        if ppu >= 1.0:
+            return image
+        if ppu >= 0.5 and image.getcolors(16) is not None:
+            # Flat art compresses better than a slightly smaller, blurred
+            # version of it.
+            return image
+        size = (max(1, int(round(image.width * ppu))),
+                max(1, int(round(image.height * ppu))))
+        resample = getattr(Image, self.resample.upper())
+        if image.mode == 'RGBA':
+            # Resample with premultiplied alpha to avoid dark fringes.
+            return image.convert('RGBa').resize(
+                size, resample).convert('RGBA')
+        return image.resize(size, resample)
+
+    def _store_image(self, fmt, encoded_image):
         if self._resource is not None:
             checksum = hashlib.md5(encoded_image).hexdigest()
             filename = checksum + '.' + fmt
-            # if not self._resource.exists(filename):
-            logger.info('Saving {}'.format(self._resource.url(filename)))
-            self._resource.put(filename, encoded_image)
+            manifest = self._get_resource_manifest()
+            url = self._resource.url(filename)
+            if filename not in manifest:
+                # Uploaded together by _flush_resources.
+                self._pending_resources[filename] = encoded_image
+            self._record_resource(fmt, encoded_image)
+            if url not in self._resources:
+                self._resources.append(url)
             href = os.path.join(self.resource_path, filename)
         else:
             href = ('data:image/{};base64,'.format(fmt) +
                     base64.b64encode(encoded_image).decode('utf-8'))
         return href
+
+
+async def _put_all(storage, items, manifest):
+    async def put(filename, data):
+        logger.info('Saving {}'.format(storage.url(filename)))
+        await storage.aput(filename, data)
+        manifest.add(filename)
+
+    await asyncio.gather(*[put(filename, data) for filename, data in items])
+
+
+def _get_image_digest(image):
+    """Digest of the pixel data, used to find identical bitmaps."""
+    digest = hashlib.md5(image.tobytes())
+    digest.update('{}{}'.format(image.mode, image.size).encode('ascii'))
+    return digest.hexdigest()
+
+
+def _replace_with_use(element, target):
+    """Turn an already placed image element into a use of the target."""
+    element.elementname = 'use'
+    element['xlink:href'] = target.get_iri()
+    del element.attribs['width']
+    del element.attribs['height']
+
+
+class _ImagePrefetcher(object):
+    """
+    Decode layer images on an executor ahead of the tree walk.
+
+    At most ``window`` decoded images are held ahead of the consumer. Images
+    requested out of the expected order are decoded in the calling thread,
+    and images queued before a requested one are dropped, as their layers
+    were passed without using them.
+    """
+    def __init__(self, executor, load, tasks, window):
+        self._executor = executor
+        self._load = load
+        self._tasks = iter(tasks)
+        self._window = window
+        self._futures = OrderedDict()
+        self._consumed = set()
+        self._fill()
+
+    def _fill(self):
+        while len(self._futures) < self._window:
+            for layer, mask in self._tasks:
+                key = (id(layer), mask)
+                if key not in self._consumed and key not in self._futures:
+                    self._futures[key] = self._executor.submit(
+                        self._load, layer, mask)
+                    break
+            else:
+                return
+
+    def close(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures = OrderedDict()
+
+    def get(self, key, layer, mask):
+        self._consumed.add(key)
+        if key in self._futures:
+            for stale in list(self._futures):
+                if stale == key:
+                    break
+                self._futures.pop(stale).cancel()
+        future = self._futures.pop(key, None)
+        self._fill()
+        if future is None:
+            return self._load(layer, mask)
+        return future.result()
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
+import itertools
 from logging import getLogger
+import numpy as np
+import re
 from psd_tools.constants import TaggedBlockID
 from psd2svg.converter.constants import BLEND_MODE
 
@@ -100,32 +103,29 @@ class ShapeConverter(object):
 
 
     def _generate_path(self, path_list, command='C'):
-        """Sequence generator for SVG path constructor."""
-
-        for path in path_list:
-            assert len(path)
-
-            # Initial point.
-            yield 'M'
-            yield path[0].anchor[1] * self.width
-            yield path[0].anchor[0] * self.height
-            yield command
-
-            # Closed path or open path
-            points = (zip(path, path[1:] + path[0:1]) if path.is_closed()
-                        else zip(path, path[1:]))
-
-            # Rest of the points.
-            for p1, p2 in points:
-                yield p1.leaving[1] * self.width
-                yield p1.leaving[0] * self.height
-                yield p2.preceding[1] * self.width
-                yield p2.preceding[0] * self.height
-                yield p2.anchor[1] * self.width
-                yield p2.anchor[0] * self.height
-
-            if path.is_closed():
-                yield 'Z'
+        """
+        Path data of the subpaths in document coordinates.
+
+        Knots of each subpath are scaled in a single array operation and
+        formatted together, which matters for paths of many thousand knots.
+        Numbers are rounded here already when ``precision`` is set.
+
+        With ``simplify_paths``, straight segments are written as lines and
+        points within ``path_tolerance`` of a straight line are dropped.
+        ``relative_paths`` writes segments relative to the current point.
+        """
+        scale = np.array([self.width, self.height], dtype=np.float64)
+        if not (self.simplify_paths or self.relative_paths):
+            return ' '.join(
+                _format_subpath(path, scale, command, self.precision)
+                for path in path_list)
+        return ' '.join(
+            _format_simplified(
+                _get_knots(path, scale), path.is_closed(), command,
+                precision=self.precision, straight=self.simplify_paths,
+                relative=self.relative_paths,
+                tolerance=self.path_tolerance or 0.0)
+            for path in path_list)
 
 
     def add_stroke_style(self, layer, element):
@@ -207,3 +207,148 @@ class ShapeConverter(object):
             element['fill'] = self.create_solid_color(effect)
 
         return element
+
+
+def _get_knots(path, scale):
+    """Knots as (preceding, anchor, leaving) rows of (x, y) points."""
+    assert len(path)
+    knots = np.fromiter(itertools.chain.from_iterable(
+        knot.preceding + knot.anchor + knot.leaving for knot in path),
+        dtype=np.float64, count=6 * len(path)).reshape(-1, 3, 2)
+    return knots[:, :, ::-1] * scale
+
+
+def _format_subpath(path, scale, command, precision=None):
+    knots = _get_knots(path, scale)
+    closed = path.is_closed()
+    tokens = ['M', _format_numbers(knots[0, 1], precision), command]
+
+    # Each segment goes from the leaving point of a knot to the preceding
+    # and anchor points of the next knot.
+    end = np.roll(knots, -1, axis=0) if closed else knots[1:]
+    if len(end):
+        segments = np.concatenate([
+            knots[:len(end), 2], end[:, 0], end[:, 1]], axis=1)
+        tokens.append(_format_numbers(segments, precision))
+    if closed:
+        tokens.append('Z')
+    return ' '.join(tokens)
+
+
+# Columns of (c1x, c1y, c2x, c2y, x, y) segment rows written per command.
+_CURVE, _LINE, _HORIZONTAL, _VERTICAL = range(4)
+_COLUMNS = ((0, 1, 2, 3, 4, 5), (4, 5), (4,), (5,))
+
+
+def _format_simplified(knots, closed, command, precision=None, straight=True,
+                       relative=False, tolerance=0.0):
+    """
+    Path data of a subpath with straight segments written as lines.
+
+    Coordinates are rounded first when ``precision`` is set, so relative
+    offsets add up to the rounded absolute positions.
+    """
+    if precision is not None:
+        knots = np.round(knots, precision)
+    origin = knots[0, 1]
+    end = np.roll(knots, -1, axis=0) if closed else knots[1:]
+    start = knots[:len(end), 1]
+    segments = np.concatenate([knots[:len(end), 2], end[:, 0], end[:, 1]],
+                              axis=1)
+
+    kinds = np.full(len(segments), _CURVE)
+    if straight and len(segments):
+        lines = ((_distance(segments[:, 0:2], start, segments[:, 4:6]) <=
+                  tolerance) &
+                 (_distance(segments[:, 2:4], start, segments[:, 4:6]) <=
+                  tolerance))
+        keep = _merge_collinear(start, segments[:, 4:6], lines, tolerance)
+        if closed and lines[-1]:
+            # Closing the path draws the last line.
+            keep[-1] = False
+        segments, kinds = segments[keep], kinds[keep]
+        kinds[lines[keep]] = _LINE
+
+    # Segments start at the end of the previous written segment.
+    current = np.concatenate([origin[None], segments[:, 4:6]])[:len(segments)]
+    if straight:
+        line = kinds == _LINE
+        kinds[line & (segments[:, 5] == current[:, 1])] = _HORIZONTAL
+        kinds[line & (segments[:, 4] == current[:, 0])] = _VERTICAL
+    if relative:
+        segments = segments - np.tile(current, 3)
+        if precision is not None:
+            segments = np.round(segments, precision)
+
+    numbers = _format_numbers(segments, precision).split(' ')
+    tokens = ['M', _format_numbers(origin, precision)]
+    letters = (command, 'L', 'H', 'V')
+    last = None
+    for index, kind in enumerate(kinds.tolist()):
+        letter = letters[kind].lower() if relative else letters[kind]
+        if letter != last:
+            # Repeated commands may be omitted.
+            tokens.append(letter)
+            last = letter
+        tokens.extend(numbers[6 * index + column]
+                      for column in _COLUMNS[kind])
+    if closed:
+        tokens.append('Z')
+    return ' '.join(tokens)
+
+
+def _distance(points, start, end):
+    """Distance of points from the line segments between start and end."""
+    delta = end - start
+    length = np.einsum('ij,ij->i', delta, delta)
+    t = np.einsum('ij,ij->i', points - start, delta) / np.where(
+        length > 0, length, 1.0)
+    t = t[:, None]
+    # Exactly the end points beyond the segment, free of rounding errors.
+    nearest = np.where(t <= 0.0, start, np.where(
+        t >= 1.0, end, start + t * delta))
+    return np.hypot(*(points - nearest).T)
+
+
+def _merge_collinear(start, end, lines, tolerance):
+    """
+    Mask of line ends to keep, dropping points between consecutive lines
+    that lie within ``tolerance`` of the merged line.
+    """
+    keep = np.ones(len(end), dtype=bool)
+    if not tolerance:
+        return keep
+    origin, skipped = None, []
+    for index in range(len(end) - 1):
+        if not (lines[index] and lines[index + 1]):
+            origin = None
+            continue
+        if origin is None:
+            origin, skipped = start[index], []
+        candidates = np.array(skipped + [end[index]])
+        count = len(candidates)
+        if _distance(candidates, np.tile(origin, (count, 1)),
+                     np.tile(end[index + 1], (count, 1))).max() <= tolerance:
+            keep[index] = False
+            skipped.append(end[index])
+        else:
+            origin, skipped = end[index], []
+    return keep
+
+
+_TRAILING_ZEROS = re.compile(r'(\.\d*?)0+(?= |$)')
+_EMPTY_FRACTION = re.compile(r'\.(?= |$)')
+_NEGATIVE_ZERO = re.compile(r'(?:^|(?<= ))-0(?= |$)')
+
+
+def _format_numbers(values, precision=None):
+    values = values.ravel().tolist()
+    if precision is None:
+        # Shortest repr, like the former token stream.
+        return ' '.join(map(repr, values))
+
+    # Same result as format_number() applied to each value.
+    text = ('%.{}f '.format(precision) * len(values) % tuple(values))[:-1]
+    if precision > 0:
+        text = _EMPTY_FRACTION.sub('', _TRAILING_ZEROS.sub(r'\1', text))
+    return _NEGATIVE_ZERO.sub('0', text)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Bitmap encoders used to embed or export layer images.
+
+An encoder turns a PIL image into ``(format, bytes)``. The default
+:py:class:`PNGEncoder` reproduces Pillow's PNG output, the others trade
+exactness or compatibility for size::
+
+    encoder = get_encoder('auto', quality=85, threshold=40.0)
+    fmt, data = encoder.encode(image)
+"""
+from __future__ import absolute_import, unicode_literals
+import io
+from logging import getLogger
+import numpy as np
+from PIL import Image
+
+logger = getLogger(__name__)
+
+
+ENCODERS = ('png', 'png8', 'webp', 'webp-lossy', 'jpeg', 'auto')
+
+
+def get_encoder(name='png', quality=None, compress_level=None,
+                threshold=None):
+    """
+    Create an encoder by name.
+
+    :param name: one of ``png``, ``png8``, ``webp``, ``webp-lossy``, ``jpeg``
+        or ``auto``.
+    :param quality: quality of lossy formats, 1 to 100.
+    :param compress_level: zlib compression level of PNG, 0 to 9.
+    :param threshold: minimum PSNR in dB a lossy result must reach to be
+        picked by the ``auto`` encoder.
+    """
+    quality = quality or 85
+    if name == 'png':
+        return PNGEncoder(compress_level=compress_level)
+    elif name == 'png8':
+        return PNGEncoder(compress_level=compress_level, max_colors=256)
+    elif name == 'webp':
+        return WebPEncoder(lossless=True)
+    elif name == 'webp-lossy':
+        return WebPEncoder(lossless=False, quality=quality)
+    elif name == 'jpeg':
+        return JPEGEncoder(quality=quality, compress_level=compress_level)
+    elif name == 'auto':
+        return AutoEncoder([
+            PNGEncoder(compress_level=compress_level, max_colors=256),
+            WebPEncoder(lossless=True),
+            WebPEncoder(lossless=False, quality=quality),
+            JPEGEncoder(quality=quality, compress_level=compress_level),
+        ], threshold=threshold or 40.0)
+    raise ValueError('Unknown encoder: {}'.format(name))
+
+
+class ImageEncoder(object):
+    """Base class of bitmap encoders."""
+    lossless = True
+
+    def __repr__(self):
+        # Also identifies the encoder settings in cache keys.
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={!r}'.format(key, value)
+            for key, value in sorted(vars(self).items())))
+
+    def encode(self, image, icc_profile=None):
+        """
+        Encode the image.
+
+        :return: tuple of format name and encoded bytes.
+        """
+        raise NotImplementedError
+
+    def _save(self, image, fmt, **kwargs):
+        with io.BytesIO() as output:
+            image.save(output, format=fmt, **kwargs)
+            return output.getvalue()
+
+
+class PNGEncoder(ImageEncoder):
+    """
+    PNG encoder.
+
+    When ``max_colors`` is given, RGB and RGBA images with at most that many
+    distinct colors are written as an exact palette image (PNG8).
+    """
+    def __init__(self, compress_level=None, max_colors=0):
+        self.compress_level = compress_level
+        self.max_colors = max_colors
+
+    def encode(self, image, icc_profile=None):
+        kwargs = dict(icc_profile=icc_profile)
+        if self.compress_level is not None:
+            kwargs['compress_level'] = self.compress_level
+        if self.max_colors and image.mode in ('RGB', 'RGBA'):
+            palette_image = _to_palette(image, self.max_colors)
+            if palette_image is not None:
+                image = palette_image
+        return 'png', self._save(image, 'png', **kwargs)
+
+
+class WebPEncoder(ImageEncoder):
+    """WebP encoder, lossless by default."""
+    def __init__(self, lossless=True, quality=85, method=4):
+        self.lossless = lossless
+        self.quality = quality
+        self.method = method
+
+    def encode(self, image, icc_profile=None):
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if _has_alpha(image) else 'RGB')
+        return 'webp', self._save(
+            image, 'webp', lossless=self.lossless, quality=self.quality,
+            method=self.method, icc_profile=icc_profile)
+
+
+class JPEGEncoder(ImageEncoder):
+    """
+    JPEG encoder for opaque images.
+
+    Images with transparent pixels cannot be represented and fall back to PNG.
+    """
+    lossless = False
+
+    def __init__(self, quality=85, compress_level=None):
+        self.quality = quality
+        self.fallback = PNGEncoder(compress_level=compress_level)
+
+    def encode(self, image, icc_profile=None):
+        if not is_opaque(image):
+            return self.fallback.encode(image, icc_profile)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        return 'jpeg', self._save(
+            image, 'jpeg', quality=self.quality, icc_profile=icc_profile)
+
+
+class AutoEncoder(ImageEncoder):
+    """
+    Pick the smallest result of the candidate encoders.
+
+    Results of lossy encoders are only accepted when their PSNR against the
+    original image is at least ``threshold`` dB. Lossless results are always
+    acceptable.
+    """
+    def __init__(self, encoders, threshold=40.0):
+        self.encoders = encoders
+        self.threshold = threshold
+
+    def encode(self, image, icc_profile=None):
+        best = None
+        for encoder in self.encoders:
+            fmt, data = encoder.encode(image, icc_profile)
+            if best is not None and len(data) >= len(best[1]):
+                continue
+            if not encoder.lossless and fmt != 'png':
+                decoded = Image.open(io.BytesIO(data))
+                if psnr(image, decoded) < self.threshold:
+                    continue
+            best = (fmt, data)
+        return best
+
+
+def is_opaque(image):
+    """True if the image has no transparent pixels."""
+    if not _has_alpha(image):
+        return True
+    return image.getchannel('A').getextrema()[0] == 255
+
+
+def psnr(image, other):
+    """Peak signal-to-noise ratio in dB between two images."""
+    mode = 'RGBA' if _has_alpha(image) else 'RGB'
+    x = np.asarray(image.convert(mode), dtype=np.float64)
+    y = np.asarray(other.convert(mode), dtype=np.float64)
+    mse = np.mean((x - y) ** 2)
+    if mse == 0:
+        return float('inf')
+    return 10.0 * np.log10(255.0 ** 2 / mse)
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+
+
+def _to_palette(image, max_colors):
+    """Convert to a palette image without loss, or None if too many colors."""
+    pixels = np.asarray(image)
+    channels = pixels.shape[2]
+    flat = pixels.reshape(-1, channels)
+    packed = np.zeros(flat.shape[0], dtype=np.uint32)
+    for index in range(channels):
+        packed = (packed << 8) | flat[:, index]
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > max_colors:
+        return None
+
+    palette = np.stack([
+        (colors >> (8 * (channels - 1 - index))) & 0xFF
+        for index in range(channels)
+    ], axis=1).astype(np.uint8)
+    result = Image.fromarray(
+        indices.reshape(pixels.shape[:2]).astype(np.uint8), 'P')
+    result.putpalette(palette.tobytes(), rawmode=image.mode)
+    return result
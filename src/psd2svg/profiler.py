@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Wall and CPU time of conversion stages and layers.
+
+A :py:class:`Profiler` is attached to the converter when ``profile`` is set
+or timing hooks are given::
+
+    converter = PSD2SVG(profile=True)
+    converter.convert('input.psd', 'output.svg')
+    print(converter.timings['stages']['decode'])
+    print(format_report(converter.timings, top=5))
+
+Stages are ``parse``, ``decode``, ``encode``, ``shape``, ``effects``,
+``serialize``, ``upload`` and ``write``. Hooks are called as
+``hook(stage, layer, wall, cpu)`` after every measured step, and with the
+stage ``layer`` after every layer, from the thread that ran it. ``layer`` is
+None for document stages. CPU time is the time of the running thread, so
+bitmaps decoded or encoded by worker threads are not counted twice.
+"""
+from __future__ import absolute_import, unicode_literals
+from contextlib import contextmanager
+from logging import getLogger
+import threading
+import time
+
+logger = getLogger(__name__)
+
+
+class Profiler(object):
+    """
+    Accumulated timings of a conversion.
+
+    Stages are totals over all calls. Layers record the time of
+    :py:meth:`~psd2svg.converter.core.LayerConverter.convert_layer`, in
+    total and excluding the child layers.
+    """
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.stages = {}
+        self.layers = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start = (time.time(), time.process_time())
+
+    @contextmanager
+    def measure(self, stage, layer=None):
+        """Measure the stage, optionally on behalf of the layer."""
+        wall, cpu = time.time(), _thread_time()
+        try:
+            yield
+        finally:
+            self._add_stage(stage, layer, time.time() - wall,
+                            _thread_time() - cpu)
+
+    @contextmanager
+    def measure_layer(self, layer):
+        """Measure the conversion of the layer and its children."""
+        stack = self._local.__dict__.setdefault('stack', [])
+        children = [0.0, 0.0]
+        stack.append(children)
+        wall, cpu = time.time(), _thread_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.time() - wall, _thread_time() - cpu
+            stack.pop()
+            if stack:
+                stack[-1][0] += wall
+                stack[-1][1] += cpu
+            with self._lock:
+                self.layers.append(dict(
+                    name=layer.name, kind=layer.kind, wall=wall, cpu=cpu,
+                    self_wall=wall - children[0],
+                    self_cpu=cpu - children[1]))
+            self._call_hooks('layer', layer, wall, cpu)
+
+    def _add_stage(self, stage, layer, wall, cpu):
+        with self._lock:
+            item = self.stages.setdefault(
+                stage, dict(calls=0, wall=0.0, cpu=0.0))
+            item['calls'] += 1
+            item['wall'] += wall
+            item['cpu'] += cpu
+        self._call_hooks(stage, layer, wall, cpu)
+
+    def _call_hooks(self, stage, layer, wall, cpu):
+        for hook in self.hooks:
+            try:
+                hook(stage, layer, wall, cpu)
+            except Exception:
+                logger.exception('Timing hook failed')
+
+    def as_dict(self):
+        """
+        Timings as a dict of ``total``, ``stages`` and ``layers``.
+
+        ``total`` is the time since the profiler started, with the CPU time
+        of the whole process. ``stages`` maps stage names to ``calls``,
+        ``wall`` and ``cpu`` seconds, and ``layers`` lists the layers in
+        order of completion.
+        """
+        with self._lock:
+            return dict(
+                total=dict(wall=time.time() - self._start[0],
+                           cpu=time.process_time() - self._start[1]),
+                stages={key: dict(value) for key, value in
+                        self.stages.items()},
+                layers=[dict(layer) for layer in self.layers])
+
+
+class _NullProfiler(object):
+    """Stand-in measuring nothing, used when profiling is off."""
+    def measure(self, stage, layer=None):
+        return _NULL_CONTEXT
+
+    def measure_layer(self, layer):
+        return _NULL_CONTEXT
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+NULL_PROFILER = _NullProfiler()
+
+
+def format_report(timings, top=10):
+    """Text report of the stages and the slowest layers of the timings."""
+    lines = ['{:<32} {:>6} {:>10} {:>10}'.format(
+        'stage', 'calls', 'wall ms', 'cpu ms')]
+    stages = sorted(timings['stages'].items(),
+                    key=lambda item: -item[1]['wall'])
+    for name, item in stages:
+        lines.append('{:<32} {:>6} {:>10.1f} {:>10.1f}'.format(
+            name, item['calls'], item['wall'] * 1e3, item['cpu'] * 1e3))
+    lines.append('{:<32} {:>6} {:>10.1f} {:>10.1f}'.format(
+        'total', '', timings['total']['wall'] * 1e3,
+        timings['total']['cpu'] * 1e3))
+    lines.append('')
+    lines.append('{:<32} {:>6} {:>10} {:>10}'.format(
+        'layer (excluding children)', 'kind', 'wall ms', 'cpu ms'))
+    layers = sorted(timings['layers'], key=lambda item: -item['self_wall'])
+    for item in layers[:top]:
+        lines.append('{:<32} {:>6} {:>10.1f} {:>10.1f}'.format(
+            _truncate(item['name'], 32), item['kind'][:6],
+            item['self_wall'] * 1e3, item['self_cpu'] * 1e3))
+    return '\n'.join(lines)
+
+
+def _truncate(text, width):
+    return text if len(text) <= width else text[:width - 3] + '...'
+
+
+def _thread_time():
+    # Not available on every platform.
+    try:
+        return time.thread_time()
+    except (AttributeError, OSError):
+        return time.process_time()
@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+"""
+Local conversion service backed by a pool of warm worker processes.
+
+Start the service with ``psd2svg serve`` and post PSD data to it::
+
+    psd2svg serve --port 8000 --workers 4
+    curl --data-binary @input.psd 'http://127.0.0.1:8000/convert?compact=1'
+
+Endpoints:
+
+``POST /convert``
+    Convert PSD bytes in the request body, or the file at the ``input`` url
+    when the body is empty. Converter options are given as query parameters.
+    The response is the SVG document, or a JSON manifest with ``output``,
+    ``svg`` and ``resources`` keys when ``output`` is given or
+    ``format=json``.
+``GET /health``
+    Liveness of the service.
+``GET /metrics``
+    Counters in the Prometheus text format.
+
+Each worker imports the conversion modules and builds a converter when the
+pool starts, and reuses converters across requests with the same options.
+At most ``workers + queue_size`` requests are accepted at a time, further
+requests are rejected with ``503`` until a slot is free. A request that times
+out frees its slot, and the pool is replaced in case its worker was lost or
+hangs. The old pool is terminated once its other requests have timed out.
+
+The service trusts its clients: ``input``, ``output`` and ``resource_path``
+may refer to any storage the service can access. Bind it to a local address
+or a Unix socket only.
+"""
+from __future__ import absolute_import, unicode_literals
+import argparse
+import io
+import json
+from logging import getLogger
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import traceback
+from future.standard_library import install_aliases
+
+install_aliases()
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+logger = getLogger(__name__)
+
+
+class ServiceBusy(Exception):
+    """Raised when the request queue is full."""
+
+
+def _parse_bool(value):
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError('Invalid boolean: {}'.format(value))
+
+
+def _parse_padding(value):
+    padding = [float(x) for x in value.split(',')]
+    if len(padding) != 4:
+        raise ValueError('Padding needs 4 values: {}'.format(value))
+    return padding
+
+
+_OPTIONS = {
+    'resource_path': str,
+    'shapes_only': _parse_bool,
+    'compact': _parse_bool,
+    'padding': _parse_padding,
+    'remove_color': _parse_bool,
+    'pretty': _parse_bool,
+    'threads': int,
+    'scale': float,
+    'max_pixels_per_unit': float,
+    'resample': str,
+    'mmap': _parse_bool,
+    'precision': int,
+    'simplify_paths': _parse_bool,
+    'path_tolerance': float,
+    'relative_paths': _parse_bool,
+}
+
+_ENCODER_OPTIONS = {
+    'quality': int,
+    'compress_level': int,
+    'psnr_threshold': float,
+}
+
+
+def parse_options(query):
+    """
+    Converter options from query parameters.
+
+    :param query: dict of option name to string value.
+    :return: dict of keyword arguments of :py:class:`~psd2svg.PSD2SVG`.
+    """
+    from psd2svg.encoder import get_encoder
+    options = {}
+    encoder_options = {}
+    for key, value in query.items():
+        if key in _OPTIONS:
+            options[key] = _OPTIONS[key](value)
+        elif key in _ENCODER_OPTIONS:
+            encoder_options[key] = _ENCODER_OPTIONS[key](value)
+        elif key != 'encoder':
+            raise ValueError('Unknown option: {}'.format(key))
+    if 'encoder' in query or encoder_options:
+        options['encoder'] = get_encoder(
+            query.get('encoder', 'png'),
+            quality=encoder_options.get('quality'),
+            compress_level=encoder_options.get('compress_level'),
+            threshold=encoder_options.get('psnr_threshold'))
+    return options
+
+
+_worker_converters = None
+
+
+def _init_worker(max_memory=None):
+    global _worker_converters
+    from psd2svg import PSD2SVG
+    from psd2svg.batch import _set_memory_limit
+    from psd2svg.cache import LRUCache
+    if max_memory:
+        _set_memory_limit(max_memory)
+    _worker_converters = LRUCache(8)
+    _worker_converters.put(repr([]), PSD2SVG())
+
+
+def _get_worker_converter(options):
+    from psd2svg import PSD2SVG
+    key = repr(sorted(options.items()))
+    converter = _worker_converters.get(key)
+    if converter is None:
+        converter = PSD2SVG(**options)
+        _worker_converters.put(key, converter)
+    return converter
+
+
+def _convert_task(input_data, output, options):
+    converter = _get_worker_converter(options)
+    if isinstance(input_data, bytes):
+        input_data = io.BytesIO(input_data)
+    result = converter.convert(input_data, output)
+    return {
+        'output': result if output else None,
+        'svg': None if output else result,
+        'resources': converter.resources,
+    }
+
+
+class ConversionService(object):
+    """
+    Pool of warm worker processes with a bounded request queue.
+
+    :param workers: number of worker processes. ``None`` uses all the CPUs.
+    :param queue_size: number of requests waiting for a worker beyond the
+        ones being converted.
+    :param timeout: seconds to wait for a conversion.
+    :param max_memory: per-worker address space limit in bytes.
+    :param maxtasksperchild: number of requests after which a worker process
+        is replaced.
+    """
+    def __init__(self, workers=None, queue_size=None, timeout=60.0,
+                 max_memory=None, maxtasksperchild=None):
+        self.workers = workers or multiprocessing.cpu_count()
+        self.queue_size = (self.workers if queue_size is None
+                           else queue_size)
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(
+            self.workers + self.queue_size)
+        self._lock = threading.Lock()
+        self._counters = {
+            'requests': 0, 'failures': 0, 'rejected': 0, 'timeouts': 0,
+            'pending': 0, 'seconds': 0.0, 'restarts': 0,
+        }
+        self._started = time.time()
+        self._max_memory = max_memory
+        self._maxtasksperchild = maxtasksperchild
+        self._pool = self._create_pool()
+        self._retired = []
+
+    def _create_pool(self):
+        return multiprocessing.Pool(
+            processes=self.workers,
+            initializer=_init_worker,
+            initargs=(self._max_memory,),
+            maxtasksperchild=self._maxtasksperchild,
+        )
+
+    def convert(self, input_data, output=None, options=None):
+        """
+        Convert in a worker process.
+
+        :param input_data: PSD bytes or input url.
+        :param output: output url, or None to return the SVG.
+        :raise ServiceBusy: when the queue is full.
+        :return: dict with ``output``, ``svg`` and ``resources`` keys.
+        """
+        if not self._slots.acquire(False):
+            self._count('rejected')
+            raise ServiceBusy('Too many requests')
+        self._count('pending')
+        start = time.time()
+        released = threading.Lock()
+
+        def release(*args):
+            # Called by the worker callbacks or on timeout, whichever first.
+            if released.acquire(False):
+                self._count('pending', -1)
+                self._slots.release()
+
+        with self._lock:
+            pool = self._pool
+        try:
+            async_result = pool.apply_async(
+                _convert_task, (input_data, output, options or {}),
+                callback=release, error_callback=release)
+        except BaseException:
+            release()
+            raise
+        try:
+            return async_result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self._count('timeouts')
+            # A lost or hung worker never calls back.
+            release()
+            self._recycle_pool(pool)
+            raise
+        except Exception:
+            self._count('failures')
+            raise
+        finally:
+            self._count('requests')
+            self._count('seconds', time.time() - start)
+
+    def _recycle_pool(self, pool):
+        """Replace the pool and terminate it after the timeout."""
+        with self._lock:
+            if pool is not self._pool:
+                return
+            self._pool = self._create_pool()
+            self._counters['restarts'] += 1
+            # Requests already in the pool time out within this period.
+            timer = threading.Timer(self.timeout, pool.terminate)
+            timer.daemon = True
+            self._retired.append((pool, timer))
+        logger.warning('Replacing the worker pool after a timeout')
+        pool.close()
+        timer.start()
+
+    def _count(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def health(self):
+        """Status of the service."""
+        return {
+            'status': 'ok',
+            'workers': self.workers,
+            'pending': self._counters['pending'],
+            'uptime': time.time() - self._started,
+        }
+
+    def metrics(self):
+        """Counters in the Prometheus text format."""
+        with self._lock:
+            counters = dict(self._counters)
+        lines = []
+        for name, kind, value in (
+            ('requests_total', 'counter', counters['requests']),
+            ('failures_total', 'counter', counters['failures']),
+            ('rejected_total', 'counter', counters['rejected']),
+            ('timeouts_total', 'counter', counters['timeouts']),
+            ('pool_restarts_total', 'counter', counters['restarts']),
+            ('conversion_seconds_total', 'counter', counters['seconds']),
+            ('pending_requests', 'gauge', counters['pending']),
+            ('workers', 'gauge', self.workers),
+            ('queue_capacity', 'gauge', self.workers + self.queue_size),
+        ):
+            lines.append('# TYPE psd2svg_{} {}'.format(name, kind))
+            lines.append('psd2svg_{} {}'.format(name, value))
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        self._terminate_retired()
+
+    def terminate(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._terminate_retired()
+
+    def _terminate_retired(self):
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for pool, timer in retired:
+            timer.cancel()
+            pool.terminate()
+            pool.join()
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """HTTP interface of :py:class:`ConversionService`."""
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._send_json(200, self.server.service.health())
+        elif path == '/metrics':
+            self._send(200, self.server.service.metrics().encode('utf-8'),
+                       'text/plain; version=0.0.4')
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > self.server.max_body:
+            self.close_connection = True
+            self._send_json(413, {'error': 'Request body too large'})
+            return
+        body = self.rfile.read(length) if length else None
+
+        query = {
+            key: values[-1] for key, values in parse_qs(url.query).items()}
+        input_url = query.pop('input', None)
+        output = query.pop('output', None)
+        as_json = query.pop('format', 'svg') == 'json' or bool(output)
+        if bool(body) == bool(input_url):
+            self._send_json(
+                400, {'error': 'Give either a request body or an input url'})
+            return
+        try:
+            options = parse_options(query)
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+
+        try:
+            result = self.server.service.convert(
+                body or input_url, output, options)
+        except ServiceBusy as e:
+            self._send_json(503, {'error': str(e)}, {'Retry-After': '1'})
+        except multiprocessing.TimeoutError:
+            self._send_json(504, {'error': 'Conversion timed out'})
+        except Exception as e:
+            logger.error('Failed to convert: {}'.format(
+                traceback.format_exc()))
+            self._send_json(500, {'error': '{}: {}'.format(
+                e.__class__.__name__, e)})
+        else:
+            if as_json:
+                self._send_json(200, result)
+            else:
+                self._send(200, result['svg'].encode('utf-8'),
+                           'image/svg+xml; charset=utf-8')
+
+    def _send_json(self, status, value, headers=None):
+        self._send(status, json.dumps(value).encode('utf-8'),
+                   'application/json', headers)
+
+    def _send(self, status, data, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logger.info('%s - %s' % (self.address_string(), format % args))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service, host='127.0.0.1', port=8000, socket_path=None,
+                  max_body=1 << 30):
+    """
+    Create an HTTP server of the service on a TCP port or a Unix socket.
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(
+            socket_path, ConversionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ConversionRequestHandler)
+    server.service = service
+    server.max_body = max_body
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='psd2svg serve', description='Run a local conversion service')
+    parser.add_argument(
+        '--host', default='127.0.0.1', help='Address to bind, default '
+        '127.0.0.1.')
+    parser.add_argument(
+        '--port', type=int, default=8000, help='Port to bind, default 8000.')
+    parser.add_argument(
+        '--socket', metavar='PATH', default=None,
+        help='Listen on a Unix socket instead of a TCP port.')
+    parser.add_argument(
+        '--workers', metavar='N', type=int, default=None,
+        help='Number of worker processes, default the number of CPUs.')
+    parser.add_argument(
+        '--queue-size', metavar='N', type=int, default=None,
+        help='Number of requests waiting for a worker before new ones are '
+             'rejected, default the number of workers.')
+    parser.add_argument(
+        '--timeout', metavar='SECONDS', type=float, default=60.0,
+        help='Conversion timeout in seconds, default 60.')
+    parser.add_argument(
+        '--max-body', metavar='MB', type=int, default=1024,
+        help='Maximum request body size in megabytes, default 1024.')
+    parser.add_argument(
+        '--max-memory', metavar='MB', type=int, default=None,
+        help='Memory limit of each worker process in megabytes.')
+    parser.add_argument(
+        '--max-tasks-per-worker', metavar='N', type=int, default=None,
+        help='Replace a worker process after this many requests.')
+    parser.add_argument(
+        '--loglevel', metavar='LEVEL', default='INFO',
+        help='Logging level, default INFO')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=getattr(logging, args.loglevel.upper(),
+                                      'INFO'))
+
+    service = ConversionService(
+        workers=args.workers, queue_size=args.queue_size,
+        timeout=args.timeout,
+        max_memory=args.max_memory and args.max_memory * 1024 * 1024,
+        maxtasksperchild=args.max_tasks_per_worker)
+    server = create_server(
+        service, args.host, args.port, args.socket,
+        max_body=args.max_body * 1024 * 1024)
+    logger.info('Serving on {}'.format(
+        args.socket or '{}:{}'.format(*server.server_address[:2])))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.terminate()
@@ -1,32 +1,72 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+import functools
+import hashlib
+import io
 from logging import getLogger
+import mmap
 import os
-from tempfile import TemporaryFile
 import mimetypes
+import threading
 from future.standard_library import install_aliases
 
 install_aliases()
 
-from urllib.parse import urlparse, urljoin
-from urllib.request import urlopen, Request
+from http.client import HTTPConnection, HTTPException, HTTPSConnection
+from urllib.parse import quote, urlencode, urlparse, urljoin
 from urllib.error import HTTPError
+from urllib.request import (
+    ProxyHandler, Request, build_opener, getproxies, proxy_bypass)
+
+from psd2svg.cache import LRUCache
 
 
 logger = getLogger(__name__)
 
 
-def get_storage(dirname, **kwargs):
+def get_storage(dirname, max_concurrency=None, **kwargs):
+    """
+    Create a storage for the url.
+
+    :param max_concurrency: limit of in-flight requests of the async methods.
+    """
     result = urlparse(dirname)
     if result.scheme == 's3':
-        return S3Storage(result.netloc, result.path, **kwargs)
+        storage = S3Storage(result.netloc, result.path, **kwargs)
     elif result.scheme == 'hdfs':
-        return HdfsStorage(result.netloc, result.path, **kwargs)
+        storage = HdfsStorage(result.netloc, result.path, **kwargs)
+    elif result.scheme == 'webhdfs':
+        storage = HdfsStorage(
+            result.netloc, result.path, scheme='webhdfs',
+            client=WebHdfsClient('http://' + result.netloc, **kwargs))
     elif result.scheme in ('http', 'https'):
-        return UrlStorage(dirname, **kwargs)
+        storage = UrlStorage(dirname, **kwargs)
     else:
-        return FileSystemStorage(dirname, **kwargs)
+        storage = FileSystemStorage(dirname, **kwargs)
+    if max_concurrency:
+        storage.max_concurrency = max_concurrency
+    return storage
+
+
+def run_sync(coroutine):
+    """Run the coroutine to completion from blocking code."""
+    def run():
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coroutine)
+        finally:
+            loop.close()
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run()
+    # An event loop is already running in this thread.
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(run).result()
 
 
 def _get_mime(filename):
@@ -35,6 +75,17 @@ def _get_mime(filename):
 
 
 class _BaseStorage(object):
+    """
+    Base class of storages.
+
+    The ``a``-prefixed coroutines are the async variants of the blocking
+    methods. They run the blocking calls on a thread pool owned by the
+    storage, so at most ``max_concurrency`` requests are in flight.
+    """
+    max_concurrency = 8
+    _executor = None
+    _executor_lock = threading.Lock()
+
     def open(self, key):
         raise NotImplementedError
 
@@ -56,6 +107,68 @@ class _BaseStorage(object):
     def url(self, path=''):
         raise NotImplementedError
 
+    def digest(self, key):
+        """Return md5 hex digest of the stored value, or None if missing."""
+        if not self.exists(key):
+            return None
+        return hashlib.md5(self.get(key)).hexdigest()
+
+    def _run_async(self, func, *args, **kwargs):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_concurrency)
+        return asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    async def aget(self, key, **kwargs):
+        return await self._run_async(self.get, key, **kwargs)
+
+    async def aput(self, key, value, **kwargs):
+        return await self._run_async(self.put, key, value, **kwargs)
+
+    async def aexists(self, key):
+        return await self._run_async(self.exists, key)
+
+    async def alist(self):
+        return await self._run_async(lambda: list(self.list()))
+
+
+class ResourceManifest(object):
+    """
+    Index of keys already present in a storage.
+
+    The index is built from a single listing of the storage on first use and
+    then kept up to date by :py:meth:`add`, so checking for a resource does
+    not cost a request per key. Resource names are content digests, which
+    makes the storage itself the persistent record of what was uploaded.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+        self._keys = None
+
+    def refresh(self):
+        """Re-list the storage."""
+        try:
+            self._keys = set(self.storage.list())
+        except (NotImplementedError, OSError) as e:
+            logger.debug('Cannot list {}: {}'.format(self.storage.url(), e))
+            self._keys = set()
+
+    def add(self, key):
+        if self._keys is None:
+            self.refresh()
+        self._keys.add(key)
+
+    def discard(self, key):
+        if self._keys is not None:
+            self._keys.discard(key)
+
+    def __contains__(self, key):
+        if self._keys is None:
+            self.refresh()
+        return key in self._keys
+
 
 class FileSystemStorage(_BaseStorage):
     def __init__(self, path):
@@ -66,7 +179,12 @@ class FileSystemStorage(_BaseStorage):
     def _ensure_dir(self, dirname):
         if not os.path.exists(dirname):
             logger.debug('Creating {}'.format(dirname))
-            os.makedirs(dirname)
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Created by a concurrent upload.
+                if not os.path.isdir(dirname):
+                    raise
 
     @contextmanager
     def open(self, filename, mode='rb'):
@@ -76,6 +194,16 @@ class FileSystemStorage(_BaseStorage):
         with open(path, mode) as f:
             yield f
 
+    def open_mapped(self, filename):
+        """
+        Open the file as a read-only :py:class:`MappedFile`.
+
+        The mapping stays valid after the file object is closed, as long as
+        data read from it is referenced.
+        """
+        with open(os.path.join(self.basedir, filename), 'rb') as f:
+            return MappedFile(f)
+
     def get(self, filename, mode='rb'):
         with self.open(filename, mode=mode) as f:
             return f.read()
@@ -98,28 +226,148 @@ class FileSystemStorage(_BaseStorage):
         return os.path.abspath(os.path.join(self.basedir, path))
 
 
+class MappedFile(io.RawIOBase):
+    """
+    Seekable read-only file over a memory map of a local file.
+
+    Reads of at least ``threshold`` bytes return ``memoryview`` slices of
+    the map instead of copies, so large sections such as channel data are
+    paged in from the file only when they are decoded.
+    """
+    def __init__(self, f, threshold=64 * 1024):
+        self.threshold = threshold
+        self._pos = 0
+        try:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            self._map = b''
+        self._view = memoryview(self._map)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = len(self._map) + offset
+        else:
+            raise ValueError('Invalid whence: {}'.format(whence))
+        return self._pos
+
+    def read(self, size=-1):
+        start = min(self._pos, len(self._map))
+        if size is None or size < 0:
+            end = len(self._map)
+        else:
+            end = min(len(self._map), start + size)
+        self._pos = end
+        if end - start >= self.threshold:
+            return self._view[start:end]
+        return self._map[start:end]
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        # Views handed out keep the map alive until they are released.
+        self._view.release()
+        super(MappedFile, self).close()
+
+
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def _get_s3_client(max_pool_connections=10):
+    """
+    Return a boto3 S3 client shared across storages.
+
+    Clients are thread-safe, so storages reuse one client and its connection
+    pool instead of opening connections per instance.
+    """
+    with _s3_clients_lock:
+        client = _s3_clients.get(max_pool_connections)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+            client = boto3.session.Session().client('s3', config=Config(
+                max_pool_connections=max_pool_connections))
+            _s3_clients[max_pool_connections] = client
+        return client
+
+
 class S3Storage(_BaseStorage):
-    def __init__(self, bucket, key_prefix='', **kwargs):
-        import boto3
-        self.bucket = boto3.resource('s3').Bucket(bucket)
+    """
+    Storage in a S3 bucket.
+
+    Reads download into memory, or into the file-like ``buffer`` given to
+    :py:meth:`open`, with ``max_concurrency`` parallel ranged requests. Writes
+    upload ``part_size`` parts while the data is written, and hold at most
+    ``max_concurrency`` parts in memory at a time.
+    """
+    def __init__(self, bucket, key_prefix='', part_size=8 * 1024 * 1024,
+                 **kwargs):
+        self.bucket_name = bucket
         self.key_prefix = key_prefix.lstrip('/')
+        self.part_size = max(part_size, 5 * 1024 * 1024)  # S3 minimum.
 
         self.options = dict(ACL='public-read')
         self.options.update(kwargs)
 
+    @property
+    def client(self):
+        return _get_s3_client(max(10, self.max_concurrency))
+
+    def _transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+        return TransferConfig(
+            multipart_threshold=self.part_size,
+            multipart_chunksize=self.part_size,
+            max_concurrency=self.max_concurrency,
+        )
+
+    def _put_options(self, key, kwargs):
+        options = dict(self.options)
+        options.update(kwargs)
+        options.setdefault('ContentDisposition', 'inline; filename="{}"'.format(
+            os.path.basename(key)))
+        content_type = _get_mime(key)
+        if content_type:
+            options.setdefault('ContentType', content_type)
+        return options
+
     @contextmanager
-    def open(self, key, mode='rb', **kwargs):
+    def open(self, key, mode='rb', buffer=None, **kwargs):
         key = os.path.join(self.key_prefix, key)
         if mode.startswith('r'):
-            with TemporaryFile() as f:
-                self.bucket.download_fileobj(key, f, **kwargs)
-                f.seek(0)
-                yield f
+            f = io.BytesIO() if buffer is None else buffer
+            self.client.download_fileobj(
+                self.bucket_name, key, f, ExtraArgs=kwargs or None,
+                Config=self._transfer_config())
+            f.seek(0)
+            yield f
         elif mode.startswith('w'):
-            with TemporaryFile() as f:
-                yield f
-                f.seek(0)
-                self.bucket.upload_fileobj(f, key, **kwargs)
+            writer = _S3MultipartWriter(
+                self.client, self.bucket_name, key, self.part_size,
+                self.max_concurrency, self._put_options(key, kwargs))
+            try:
+                yield writer
+            except BaseException:
+                writer.abort()
+                raise
+            writer.close()
         else:
             raise ValueError('Unsupported mode {}'.format(mode))
 
@@ -128,115 +376,565 @@ class S3Storage(_BaseStorage):
             return f.read()
 
     def exists(self, key):
-        import botocore
-        key = os.path.join(self.key_prefix, key)
-        exists = True
-        try:
-            self.bucket.Object(key).load()
-        except botocore.exceptions.ClientError as e:
-            if e.response['Error']['Code'] == '404':
-                exists = False
-            else:
-                raise
-        return exists
+        return self._head_object(key) is not None
+
+    def digest(self, key):
+        response = self._head_object(key)
+        if response is None:
+            return None
+        # ETag of a single part upload is the md5 of the content.
+        return response['ETag'].strip('"')
 
     def put(self, key, value, **kwargs):
         key = os.path.join(self.key_prefix, key)
-        options = dict(self.options)
-        options.update(kwargs)
-        self.bucket.Object(key).put(
-            Body=value, ContentType=_get_mime(key),
-            ContentDisposition='inline; filename="{}"'.format(
-                os.path.basename(key)),
-            **options)
+        self.client.put_object(
+            Bucket=self.bucket_name, Key=key, Body=value,
+            **self._put_options(key, kwargs))
 
     def delete(self, key, **kwargs):
         key = os.path.join(self.key_prefix, key)
-        self.bucket.Object(key).delete(**kwargs)
+        self.client.delete_object(Bucket=self.bucket_name, Key=key, **kwargs)
 
     def list(self):
-        for obj in self.bucket.objects.filter(Prefix=self.key_prefix):
-            yield obj.key.replace(self.key_prefix, "").lstrip('/')
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(
+            Bucket=self.bucket_name, Prefix=self.key_prefix
+        ):
+            for obj in page.get('Contents', []):
+                yield obj['Key'].replace(self.key_prefix, "").lstrip('/')
 
     def url(self, path=''):
-        return ('s3://' + self.bucket.name + '/' +
+        return ('s3://' + self.bucket_name + '/' +
                 os.path.normpath(os.path.join(self.key_prefix, path)))
 
+    async def aget(self, key, **kwargs):
+        # A single request, the transfer manager would add its own threads.
+        return await self._run_async(self._get_object, key, **kwargs)
+
+    def _get_object(self, key, **kwargs):
+        response = self.client.get_object(
+            Bucket=self.bucket_name, Key=os.path.join(self.key_prefix, key),
+            **kwargs)
+        return response['Body'].read()
+
+    def _head_object(self, key):
+        import botocore
+        try:
+            return self.client.head_object(
+                Bucket=self.bucket_name,
+                Key=os.path.join(self.key_prefix, key))
+        except botocore.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+
+class _S3MultipartWriter(io.RawIOBase):
+    """
+    File-like object uploading parts of a multipart upload as they fill.
+
+    Data smaller than a single part is sent with one ``PutObject`` on close.
+    """
+    def __init__(self, client, bucket, key, part_size, max_concurrency,
+                 options):
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._part_size = part_size
+        self._options = options
+        self._buffer = bytearray()
+        self._upload_id = None
+        self._parts = []
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._max_concurrency = max(1, max_concurrency)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer.extend(data)
+        while len(self._buffer) >= self._part_size:
+            part = bytes(self._buffer[:self._part_size])
+            del self._buffer[:self._part_size]
+            self._upload_part(part)
+        return len(data)
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            response = self._client.create_multipart_upload(
+                Bucket=self._bucket, Key=self._key, **self._options)
+            self._upload_id = response['UploadId']
+            self._executor = ThreadPoolExecutor(self._max_concurrency)
+        part_number = len(self._parts) + 1
+        # Blocks the writer while max_concurrency parts are in flight.
+        self._slots.acquire()
+        future = self._executor.submit(
+            self._client.upload_part, Bucket=self._bucket, Key=self._key,
+            UploadId=self._upload_id, PartNumber=part_number, Body=data)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._parts.append(future)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self._client.put_object(
+                    Bucket=self._bucket, Key=self._key,
+                    Body=bytes(self._buffer), **self._options)
+            else:
+                if self._buffer:
+                    self._upload_part(bytes(self._buffer))
+                parts = [
+                    dict(ETag=future.result()['ETag'], PartNumber=index + 1)
+                    for index, future in enumerate(self._parts)
+                ]
+                self._client.complete_multipart_upload(
+                    Bucket=self._bucket, Key=self._key,
+                    UploadId=self._upload_id,
+                    MultipartUpload=dict(Parts=parts))
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            if self._executor is not None:
+                self._executor.shutdown()
+            super(_S3MultipartWriter, self).close()
+
+    def abort(self):
+        """Discard the parts uploaded so far."""
+        if self._upload_id is not None:
+            upload_id, self._upload_id = self._upload_id, None
+            if self._executor is not None:
+                self._executor.shutdown()
+            self._client.abort_multipart_upload(
+                Bucket=self._bucket, Key=self._key, UploadId=upload_id)
+        self._buffer = bytearray()
+        if not self.closed:
+            super(_S3MultipartWriter, self).close()
+
 
 class HdfsStorage(_BaseStorage):
-    def __init__(self, namenode, path, use_trash=False, effective_user=None,
+    """
+    Storage in HDFS.
+
+    The storage talks to HDFS through a client with ``read``, ``write``,
+    ``exists``, ``list`` and ``delete`` methods, see
+    :py:class:`SnakebiteClient` and :py:class:`WebHdfsClient`. Reads are
+    streamed in ``chunk_size`` chunks into memory or into the file-like
+    ``buffer`` given to :py:meth:`open`, and writes are streamed to HDFS.
+    """
+    chunk_size = 1024 * 1024
+
+    def __init__(self, namenode, path, client=None, scheme='hdfs', **kwargs):
+        self.namenode = namenode
+        self.path = path.rstrip('/')
+        self.scheme = scheme
+        self._client = client or SnakebiteClient(namenode, **kwargs)
+
+    def _path(self, filename):
+        return '{0}/{1}'.format(self.path, filename)
+
+    @contextmanager
+    def open(self, filename, mode='rb', buffer=None):
+        path = self._path(filename)
+        if mode.startswith('r'):
+            f = io.BytesIO() if buffer is None else buffer
+            for chunk in self._client.read(path, self.chunk_size):
+                f.write(chunk)
+            f.seek(0)
+            yield f
+        elif mode.startswith('w'):
+            with self._client.write(path) as f:
+                yield f
+        else:
+            raise ValueError('Unsupported mode {}'.format(mode))
+
+    def get(self, filename, **kwargs):
+        with self.open(filename, **kwargs) as f:
+            return f.read()
+
+    def put(self, filename, value):
+        with self.open(filename, mode='wb') as f:
+            f.write(value)
+
+    def exists(self, filename):
+        return self._client.exists(self._path(filename))
+
+    def delete(self, filename):
+        self._client.delete(self._path(filename))
+
+    def list(self):
+        try:
+            return list(self._client.list(self.path))
+        except Exception:
+            # Clients raise errors of their own for a missing directory.
+            if self._client.exists(self.path):
+                raise
+            return []
+
+    def url(self, path=''):
+        return '{}://{}{}'.format(
+            self.scheme, self.namenode, self._path(path) if path else self.path)
+
+
+class SnakebiteClient(object):
+    """
+    HDFS client over the namenode RPC protocol with snakebite.
+
+    Snakebite cannot write file contents, so files are written through the
+    WebHDFS REST API of the same namenode on ``webhdfs_port``. The RPC
+    connection is opened on the first other request.
+    """
+    def __init__(self, namenode, use_trash=False, effective_user=None,
                  use_sasl=True, hdfs_namenode_principal='hdfs',
-                 use_datanode_hostname=False):
-        from snakebite.client import HAClient
-        from snakebite.namenode import Namenode
-        self.path = path
-        namenodes = [Namenode(namenode)]
-        self._client = HAClient(
-            namenodes,
+                 use_datanode_hostname=False, webhdfs_port=9870):
+        self.namenode = namenode
+        self.effective_user = effective_user
+        self.webhdfs_url = 'http://{}:{}'.format(
+            namenode.partition(':')[0], webhdfs_port)
+        self._options = dict(
             use_trash=use_trash,
             effective_user=effective_user,
             use_sasl=use_sasl,
             hdfs_namenode_principal=hdfs_namenode_principal,
             use_datanode_hostname=use_datanode_hostname
         )
+        self._rpc_client = None
+
+    @property
+    def _client(self):
+        if self._rpc_client is None:
+            from snakebite.client import HAClient
+            from snakebite.namenode import Namenode
+            host, _, port = self.namenode.partition(':')
+            namenodes = [
+                Namenode(host, int(port)) if port else Namenode(host)]
+            self._rpc_client = HAClient(namenodes, **self._options)
+        return self._rpc_client
+
+    def read(self, path, chunk_size):
+        # Snakebite yields chunks of its own size.
+        for chunk in next(self._client.cat([path])):
+            yield chunk
+
+    def write(self, path):
+        return _webhdfs_create(self.webhdfs_url, path, self.effective_user)
 
-    @contextmanager
-    def open(self, filename, mode='rb', **kwargs):
-        path = '{0}/{1}'.format(self.path, filename)
-        if mode.startswith('r'):
-            stream = self._hdfs_file_stream(path)
-            try:
-                yield stream
-            finally:
-                stream.close()
-        elif mode.startswith('w'):
-            raise NotImplementedError
-        else:
-            raise ValueError('Unsupported mode {}'.format(mode))
+    def exists(self, path):
+        return self._client.test(path, exists=True)
 
-    def _hdfs_file_stream(self, path):
+    def list(self, path):
+        for entry in self._client.ls([path]):
+            yield os.path.basename(entry['path'])
+
+    def delete(self, path):
+        list(self._client.delete([path]))
+
+
+class WebHdfsClient(object):
+    """HDFS client over the WebHDFS REST API with the hdfs package."""
+    def __init__(self, url, user=None, **kwargs):
+        from hdfs import InsecureClient
+        self._client = InsecureClient(url, user=user, **kwargs)
+
+    def read(self, path, chunk_size):
+        with self._client.read(path, chunk_size=chunk_size) as reader:
+            for chunk in reader:
+                yield chunk
+
+    def write(self, path):
+        return self._client.write(path, overwrite=True)
+
+    def exists(self, path):
+        return self._client.status(path, strict=False) is not None
+
+    def list(self, path):
+        return self._client.list(path)
+
+    def delete(self, path):
+        self._client.delete(path)
+
+
+def _webhdfs_create(base_url, path, user=None, timeout=60):
+    """
+    Create a file with the WebHDFS REST API.
+
+    The namenode redirects the request to a datanode, and the returned
+    writer streams the content there.
+    """
+    query = [('op', 'CREATE'), ('overwrite', 'true')]
+    if user:
+        query.append(('user.name', user))
+    url = '{}/webhdfs/v1{}?{}'.format(
+        base_url.rstrip('/'), quote(path), urlencode(query))
+    parsed = urlparse(url)
+    connection = _connection_class(parsed.scheme)(
+        parsed.netloc, timeout=timeout)
+    try:
+        connection.request('PUT', parsed.path + '?' + parsed.query)
+        response = connection.getresponse()
+        response.read()
+    finally:
+        connection.close()
+    location = response.getheader('Location')
+    if response.status != 307 or not location:
+        raise HTTPError(url, response.status, response.reason,
+                        response.headers, None)
+    return _WebHdfsWriter(urljoin(url, location), timeout=timeout)
+
+
+class _WebHdfsWriter(io.RawIOBase):
+    """
+    File-like upload to a WebHDFS datanode with chunked transfer encoding.
+
+    Leaving the writer with an exception aborts the upload.
+    """
+    def __init__(self, url, timeout=60):
+        super(_WebHdfsWriter, self).__init__()
+        self._url = url
+        parsed = urlparse(url)
+        self._connection = _connection_class(parsed.scheme)(
+            parsed.netloc, timeout=timeout)
+        self._connection.putrequest(
+            'PUT', parsed.path + ('?' + parsed.query if parsed.query else ''))
+        self._connection.putheader('Content-Type', 'application/octet-stream')
+        self._connection.putheader('Transfer-Encoding', 'chunked')
+        self._connection.endheaders()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if data:
+            self._connection.send(
+                '{:x}\r\n'.format(len(data)).encode('ascii') + bytes(data) +
+                b'\r\n')
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
         try:
-            from cStringIO import StringIO
-        except:
-            from StringIO import StringIO
-        generator = self._client.cat([path]).next()
-        buf = StringIO()
-        for i in generator:
-            buf.write(i)
-        buf.seek(0)
-        return buf
+            self._connection.send(b'0\r\n\r\n')
+            response = self._connection.getresponse()
+            response.read()
+        finally:
+            self._connection.close()
+            super(_WebHdfsWriter, self).close()
+        if response.status >= 400:
+            raise HTTPError(self._url, response.status, response.reason,
+                            response.headers, None)
+
+    def abort(self):
+        self._connection.close()
+        if not self.closed:
+            super(_WebHdfsWriter, self).close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _connection_class(scheme):
+    return HTTPSConnection if scheme == 'https' else HTTPConnection
+
+
+class _ConnectionPool(object):
+    """Idle keep-alive HTTP connections, shared by url storages."""
+    def __init__(self, maxsize=8, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def get(self, scheme, netloc):
+        """Return an idle connection or a new one, and if it was reused."""
+        with self._lock:
+            connections = self._idle.get((scheme, netloc))
+            if connections:
+                return connections.pop(), True
+        return _connection_class(scheme)(netloc, timeout=self.timeout), False
+
+    def put(self, scheme, netloc, connection):
+        with self._lock:
+            connections = self._idle.setdefault((scheme, netloc), [])
+            if len(connections) < self.maxsize:
+                connections.append(connection)
+                return
+        connection.close()
 
-    def get(self, path, **kwargs):
-        with self._hdfs_file_stream(path) as f:
-            return f.getvalue()
+
+_url_connections = _ConnectionPool()
+# Bodies of responses kept by storages caching them, in every process.
+_url_responses = LRUCache(
+    64, max_bytes=64 * 1024 * 1024, sizeof=lambda value: len(value[1]))
 
 
 class UrlStorage(_BaseStorage):
-    def __init__(self, base_url, **kwargs):
+    """
+    Read-only storage over HTTP.
+
+    Requests reuse keep-alive connections shared by all url storages, and
+    responses are read in chunks. With ``cache_responses``, responses with an
+    ``ETag`` or ``Last-Modified`` header are kept in a memory cache of 64 MB
+    shared by the storages of the process, and fetching them again sends a
+    conditional request that the server may answer with
+    ``304 Not Modified``. Requests time out after ``timeout`` seconds, and
+    go through urllib when a proxy is configured for the url.
+    """
+    chunk_size = 64 * 1024
+    max_redirects = 5
+
+    def __init__(self, base_url, cache_responses=False, timeout=None,
+                 **kwargs):
         self.base_url = base_url
+        self.cache_responses = cache_responses
+        self.timeout = timeout or _url_connections.timeout
 
     @contextmanager
-    def open(self, path, **kwargs):
-        url = os.path.join(self.base_url, path)
-        with TemporaryFile() as f:
-            with urlopen(url, **kwargs) as response:
-                f.write(response.read())
-            f.seek(0)
-            yield f
+    def open(self, path, buffer=None, headers=None, timeout=None):
+        f = io.BytesIO() if buffer is None else buffer
+        self._fetch(os.path.join(self.base_url, path), f, headers, timeout)
+        f.seek(0)
+        yield f
 
     def get(self, path, **kwargs):
         with self.open(path, **kwargs) as f:
             return f.read()
 
-    def exists(self, path):
-        url = os.path.join(self.base_url, path)
-        request = Request(url, method='HEAD')
-        exists = True
-        try:
-            urlopen(request)
-        except HTTPError:
-            exists = False
-        return exists
+    def exists(self, path, timeout=None):
+        response = self._request(
+            'HEAD', os.path.join(self.base_url, path), timeout=timeout)
+        response.read()
+        return response.status < 400
 
     def url(self, path=''):
         return urljoin(self.base_url, path)
+
+    def _fetch(self, url, f, headers=None, timeout=None):
+        """Write the content at the url to f, revalidating a cached response."""
+        headers = dict(headers or {})
+        cached = _url_responses.get(url) if self.cache_responses else None
+        if cached is not None:
+            validators, data = cached
+            headers.update(validators)
+        response = self._request('GET', url, headers, timeout)
+        if cached is not None and response.status == 304:
+            logger.debug('Not modified {}'.format(url))
+            response.read()
+            f.write(data)
+            return
+        if response.status >= 400:
+            response.read()
+            raise HTTPError(url, response.status, response.reason,
+                            response.headers, None)
+
+        validators = {}
+        if response.headers.get('ETag'):
+            validators['If-None-Match'] = response.headers['ETag']
+        if response.headers.get('Last-Modified'):
+            validators['If-Modified-Since'] = response.headers[
+                'Last-Modified']
+        length = int(response.headers.get('Content-Length') or -1)
+        cacheable = self.cache_responses and validators and (
+            0 <= length <= _url_responses.max_bytes)
+        chunks = [] if cacheable else None
+        while True:
+            chunk = response.read(self.chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+        if chunks is not None:
+            _url_responses.put(url, (validators, b''.join(chunks)))
+
+    def _request(self, method, url, headers=None, timeout=None):
+        """
+        Send a request over a pooled connection, following redirects.
+
+        The connection returns to the pool once the body has been read.
+        """
+        timeout = timeout or self.timeout
+        for _ in range(self.max_redirects + 1):
+            parsed = urlparse(url)
+            proxy = _get_proxy(parsed)
+            if proxy:
+                return _open_url(method, url, headers or {}, timeout, proxy)
+            response = self._send(parsed, method, headers or {}, timeout)
+            location = response.getheader('Location')
+            if response.status not in (301, 302, 303, 307, 308) or (
+                not location
+            ):
+                return response
+            response.read()
+            url = urljoin(url, location)
+        raise HTTPError(url, response.status, 'Too many redirects',
+                        response.headers, None)
+
+    def _send(self, parsed, method, headers, timeout):
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        reused = True
+        while reused:
+            connection, reused = _url_connections.get(
+                parsed.scheme, parsed.netloc)
+            connection.timeout = timeout
+            if connection.sock is not None:
+                connection.sock.settimeout(timeout)
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+            except (HTTPException, OSError):
+                connection.close()
+                if not reused:
+                    raise
+                # The server closed the idle connection, retry on a new one.
+                continue
+            _release_on_eof(response, lambda connection=connection: (
+                _url_connections.put(parsed.scheme, parsed.netloc, connection)
+            ))
+            return response
+
+
+def _get_proxy(parsed):
+    """Proxy url configured in the environment for the url, or None."""
+    proxy = getproxies().get(parsed.scheme)
+    if proxy and not proxy_bypass(parsed.hostname or ''):
+        return proxy
+    return None
+
+
+def _open_url(method, url, headers, timeout, proxy):
+    """Send a request through the proxy with urllib."""
+    opener = build_opener(ProxyHandler({urlparse(url).scheme: proxy}))
+    try:
+        return opener.open(Request(url, headers=headers, method=method),
+                           timeout=timeout)
+    except HTTPError as e:
+        # Error responses are handled like those of pooled connections.
+        return e
+
+
+def _release_on_eof(response, release):
+    """Call release once the response body has been read to the end."""
+    if response.will_close:
+        return
+    if response.isclosed():
+        release()
+        return
+    read = response.read
+
+    def read_and_release(*args):
+        data = read(*args)
+        if response.isclosed():
+            release()
+        return data
+
+    response.read = read_and_release
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic PSD documents for scale and stress testing.
+
+:py:func:`generate` writes a document of random pixel, shape and type
+layers, nested in groups, some of them with masks and layer effects::
+
+    from psd2svg.synthetic import generate
+    generate('large.psb', layers=5000, depth=4, size=(40000, 40000))
+
+The same arguments and seed always produce the same file. Documents wider or
+taller than 30000 pixels are written in the large document format (PSB).
+Layers are at most ``max_layer_size`` pixels across wherever they sit on the
+canvas, so the memory needed depends on the number of layers rather than the
+canvas size.
+
+The module also runs as a script::
+
+    python -m psd2svg.synthetic large.psb --layers 5000 --size 40000x40000
+
+Creating layers requires psd-tools 1.9 or later, importing the module with
+an older version raises :py:exc:`ImportError`.
+"""
+from __future__ import absolute_import, unicode_literals
+from logging import getLogger
+import random
+import struct
+import numpy as np
+from PIL import Image, ImageDraw
+from psd_tools import PSDImage
+from psd_tools.api.layers import Group, PixelLayer
+from psd_tools.constants import Compression, Tag
+from psd_tools.psd.descriptor import (
+    Bool, Descriptor, DescriptorBlock, DescriptorBlock2, Double, Enumerated,
+    RawData, String, UnitFloat)
+from psd_tools.psd.image_data import ImageData
+from psd_tools.psd.tagged_blocks import TaggedBlock, TypeToolObjectSetting
+from psd_tools.psd.vector import (
+    ClosedKnotLinked, ClosedPath, InitialFillRule, Path, PathFillRule)
+from psd_tools.terminology import Unit
+
+if not hasattr(PixelLayer, 'frompil'):
+    raise ImportError('psd2svg.synthetic requires psd-tools 1.9 or later')
+
+logger = getLogger(__name__)
+
+# Bezier handle length of a quarter ellipse, relative to the radius.
+_KAPPA = 0.5523
+
+_WORDS = ('lorem', 'ipsum', 'dolor', 'sit', 'amet', 'consectetur',
+          'adipiscing', 'elit', 'sed', 'do', 'eiusmod', 'tempor')
+
+_EFFECTS = ('DrSh', 'OrGl', 'IrSh', 'SoFi')
+
+_ENGINE_DATA = """<<
+/EngineDict <<
+/Editor << /Text {text} >>
+/ParagraphRun <<
+/RunArray [ << /ParagraphSheet << /DefaultStyleSheet 0
+/Properties << /Justification 0 >> >>
+/Adjustments << /Axis [ 1.0 0.0 1.0 ] /XY [ 0.0 0.0 ] >> >> ]
+/RunLengthArray [ {length} ] /IsJoinable 1 >>
+/StyleRun <<
+/RunArray [ << /StyleSheet << /StyleSheetData << /Font 0
+/FontSize {font_size:.1f} /FillColor << /Type 1
+/Values [ 1.0 {red:.4f} {green:.4f} {blue:.4f} ] >> >> >> >> ]
+/RunLengthArray [ {length} ] /IsJoinable 2 >>
+/Rendered << /Version 1 /Shapes << /WritingDirection 0
+/Children [ << /ShapeType 0 /Procession 0
+/Lines << /WritingDirection 0 /Children [ ] >>
+/Cookie << /Photoshop << /ShapeType 0 /PointBase [ 0.0 0.0 ]
+/Base << /ShapeType 0 /TransformPoint0 [ 1.0 0.0 ]
+/TransformPoint1 [ 0.0 1.0 ] /TransformPoint2 [ 0.0 0.0 ] >> >> >> >> ]
+>> >>
+>>
+/ResourceDict << /FontSet {fontset} >>
+/DocumentResources << /FontSet {fontset} >>
+>>"""
+
+
+def generate(output, layers=100, depth=3, size=(2048, 2048), pixel=0.6,
+             shape=0.3, text=0.1, masks=0.2, effects=0.2, max_layer_size=512,
+             seed=0):
+    """
+    Write a synthetic PSD document.
+
+    :param output: output path or binary file object.
+    :param layers: number of layers, excluding groups.
+    :param depth: maximum nesting depth of groups, ``0`` for no groups.
+    :param size: canvas size as ``(width, height)``.
+    :param pixel: relative share of pixel layers.
+    :param shape: relative share of shape layers.
+    :param text: relative share of type layers.
+    :param masks: share of layers with a pixel mask.
+    :param effects: share of layers with one to three layer effects.
+    :param max_layer_size: maximum width and height of a layer.
+    :param seed: seed of the random generator.
+    :return: number of groups in the document.
+    """
+    rng = random.Random(seed)
+    psd = _new_document(size)
+    kinds = rng.choices(
+        ('pixel', 'shape', 'text'), weights=(pixel, shape, text), k=layers)
+    stack = [_Container(psd)]
+    groups = 0
+    for index, kind in enumerate(kinds):
+        # Groups are opened twice as often as closed, to reach the depth.
+        draw = rng.random()
+        if draw < 0.1 and len(stack) <= depth:
+            groups += 1
+            group = Group.new(stack[-1], name='Group {}'.format(groups))
+            stack.append(_Container(group))
+        elif draw > 0.95 and len(stack) > 1:
+            stack.pop()
+        layer = _ADD_LAYER[kind](stack[-1], rng, index, size, max_layer_size)
+        if rng.random() < masks:
+            _add_mask(layer)
+        if rng.random() < effects:
+            _add_effects(layer, rng)
+    psd._update_record()
+    save(psd, output)
+    logger.debug('Generated {} layers in {} groups'.format(layers, groups))
+    return groups
+
+
+def save(psd, output):
+    """
+    Write the document without compositing its layers.
+
+    :py:meth:`PSDImage.save` composites every layer into the preview of an
+    edited document, which is slower than the conversion of a large one.
+    """
+    if hasattr(output, 'write'):
+        psd._record.write(output)
+    else:
+        with open(output, 'wb') as f:
+            psd._record.write(f)
+
+
+class _Container(object):
+    """
+    Parent of new layers deferring the update of the document.
+
+    Adding a layer to a group updates the layer records of the whole
+    document, which takes quadratic time over thousands of layers.
+    """
+    def __init__(self, group):
+        self._group = group
+        self._psd = group._psd
+
+    def append(self, layer):
+        layer._parent = self._group
+        self._group._layers.append(layer)
+
+
+def _new_document(size, color=(255, 255, 255, 255)):
+    # PSDImage.new() holds the raw composite of the whole canvas in memory.
+    psd = PSDImage.new('RGBA', (1, 1), color=color)
+    header = PSDImage._make_header('RGBA', size)
+    psd._record.header = header
+    psd._record.image_data = _solid_image_data(header, color)
+    return psd
+
+
+def _solid_image_data(header, color):
+    """RLE image data filling the canvas with the color."""
+    fmt = '>H' if header.version == 1 else '>I'
+    counts, rows = [], []
+    for value in color[:header.channels]:
+        row = _rle_row(value, header.width)
+        counts.append(struct.pack(fmt, len(row)) * header.height)
+        rows.append(row * header.height)
+    return ImageData(compression=Compression.RLE,
+                     data=b''.join(counts) + b''.join(rows))
+
+
+def _rle_row(value, width):
+    """PackBits encoding of a row of the same byte."""
+    runs = []
+    while width > 0:
+        length = min(width, 128)
+        # A run of one byte is written as a literal.
+        runs.append(bytearray([(257 - length) & 0xff if length > 1 else 0,
+                               value]))
+        width -= length
+    return bytes(b''.join(runs))
+
+
+def _get_bbox(rng, size, max_layer_size):
+    width = rng.randint(8, min(max_layer_size, size[0]))
+    height = rng.randint(8, min(max_layer_size, size[1]))
+    left = rng.randint(0, size[0] - width)
+    top = rng.randint(0, size[1] - height)
+    return left, top, width, height
+
+
+def _get_color(rng):
+    return tuple(rng.randint(0, 255) for _ in range(3))
+
+
+def _add_pixel_layer(parent, rng, index, size, max_layer_size):
+    left, top, width, height = _get_bbox(rng, size, max_layer_size)
+    start, end = np.array(_get_color(rng)), np.array(_get_color(rng))
+    ramp = np.linspace(0.0, 1.0, width)[:, np.newaxis]
+    row = (start + (end - start) * ramp).astype(np.uint8)
+    pixels = np.empty((height, width, 4), dtype=np.uint8)
+    pixels[:, :, :3] = row
+    alpha = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(alpha).ellipse((0, 0, width - 1, height - 1), fill=255)
+    pixels[:, :, 3] = np.asarray(alpha)
+    return PixelLayer.frompil(
+        Image.fromarray(pixels, 'RGBA'), parent, 'Pixel {}'.format(index),
+        top, left)
+
+
+def _add_shape_layer(parent, rng, index, size, max_layer_size):
+    left, top, width, height = _get_bbox(rng, size, max_layer_size)
+    color = _get_color(rng)
+    image = Image.new('RGBA', (width, height), color + (0,))
+    draw = ImageDraw.Draw(image)
+    right, bottom = left + width, top + height
+    if rng.random() < 0.5:
+        draw.rectangle((0, 0, width - 1, height - 1), fill=color + (255,))
+        points = [(left, top), (right, top), (right, bottom), (left, bottom)]
+        knots = [_knot(point, point, point, size) for point in points]
+    else:
+        draw.ellipse((0, 0, width - 1, height - 1), fill=color + (255,))
+        knots = _ellipse_knots(left, top, right, bottom, size)
+    layer = PixelLayer.frompil(image, parent, 'Shape {}'.format(index), top,
+                               left)
+    record = layer._record
+    record.flags.pixel_data_irrelevant = True
+    record.tagged_blocks.set_data(
+        Tag.VECTOR_MASK_SETTING1,
+        path=Path([PathFillRule(), InitialFillRule(value=0),
+                   ClosedPath(items=knots)]))
+    fill = DescriptorBlock()
+    fill[b'Clr '] = _color_descriptor(color)
+    _set_block(layer, Tag.SOLID_COLOR_SHEET_SETTING, fill)
+    return layer
+
+
+def _knot(preceding, anchor, leaving, size):
+    # Path points are (y, x) relative to the canvas.
+    def point(xy):
+        return float(xy[1]) / size[1], float(xy[0]) / size[0]
+    return ClosedKnotLinked(preceding=point(preceding), anchor=point(anchor),
+                            leaving=point(leaving))
+
+
+def _ellipse_knots(left, top, right, bottom, size):
+    cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+    rx, ry = (right - left) / 2.0 * _KAPPA, (bottom - top) / 2.0 * _KAPPA
+    return [
+        _knot((cx - rx, top), (cx, top), (cx + rx, top), size),
+        _knot((right, cy - ry), (right, cy), (right, cy + ry), size),
+        _knot((cx + rx, bottom), (cx, bottom), (cx - rx, bottom), size),
+        _knot((left, cy + ry), (left, cy), (left, cy - ry), size),
+    ]
+
+
+def _add_type_layer(parent, rng, index, size, max_layer_size):
+    left, top, width, height = _get_bbox(rng, size, max_layer_size)
+    color = _get_color(rng)
+    text = ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4)))
+    font_size = max(8, min(height, 72))
+    image = Image.new('RGBA', (width, height), color + (0,))
+    ImageDraw.Draw(image).text((0, 0), text, fill=color + (255,))
+    layer = PixelLayer.frompil(image, parent, text, top, left)
+    engine_data = _ENGINE_DATA.format(
+        text=_engine_string(text + '\r'), length=len(text) + 1,
+        font_size=font_size, red=color[0] / 255.0, green=color[1] / 255.0,
+        blue=color[2] / 255.0,
+        fontset='[ << /Name {} /Script 0 /FontType 1 /Synthetic 0 >> ]'.format(
+            _engine_string('ArialMT')))
+    text_data = DescriptorBlock(classID=b'TxLr')
+    text_data[b'Txt '] = String(text)
+    text_data[b'EngineData'] = RawData(engine_data.encode('latin-1'))
+    _set_block(layer, Tag.TYPE_TOOL_OBJECT_SETTING, TypeToolObjectSetting(
+        version=1, transform=(1.0, 0.0, 0.0, 1.0, float(left),
+                              float(top + font_size)),
+        text_version=50, text_data=text_data, warp_version=1,
+        warp=DescriptorBlock(classID=b'warp')))
+    return layer
+
+
+def _engine_string(text):
+    """Engine data literal of the text, as UTF-16 with a byte order mark."""
+    data = ('\ufeff' + text).encode('utf-16-be')
+    for char in (b'\\', b'(', b')'):
+        data = data.replace(char, b'\\' + char)
+    return '(' + data.decode('latin-1') + ')'
+
+
+def _add_mask(layer):
+    width, height = layer.width, layer.height
+    image = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(image).rectangle(
+        (width // 8, height // 8, width - 1 - width // 8,
+         height - 1 - height // 8), fill=255)
+    layer.create_mask(image)
+
+
+def _add_effects(layer, rng):
+    info = DescriptorBlock2()
+    info[b'Scl '] = UnitFloat(100.0, Unit.Percent)
+    info[b'masterFXSwitch'] = Bool(True)
+    for name in rng.sample(_EFFECTS, rng.randint(1, 3)):
+        effect = Descriptor(classID=name.encode('ascii'))
+        effect[b'enab'] = Bool(True)
+        effect[b'present'] = Bool(True)
+        effect[b'showInDialog'] = Bool(True)
+        effect[b'Md  '] = Enumerated(
+            b'BlnM', b'Nrml' if name == 'SoFi' else b'Mltp')
+        effect[b'Clr '] = _color_descriptor(_get_color(rng))
+        effect[b'Opct'] = UnitFloat(float(rng.randint(25, 100)), Unit.Percent)
+        if name != 'SoFi':
+            effect[b'Ckmt'] = UnitFloat(float(rng.randint(0, 20)), Unit.Pixels)
+            effect[b'blur'] = UnitFloat(float(rng.randint(1, 20)), Unit.Pixels)
+        if name in ('DrSh', 'IrSh'):
+            effect[b'uglg'] = Bool(False)
+            effect[b'lagl'] = UnitFloat(float(rng.randint(0, 359)),
+                                        Unit.Angle)
+            effect[b'Dstn'] = UnitFloat(float(rng.randint(0, 20)),
+                                        Unit.Pixels)
+        elif name == 'OrGl':
+            effect[b'GlwT'] = Enumerated(b'BETE', b'SfBL')
+        info[name.encode('ascii')] = effect
+    _set_block(layer, Tag.OBJECT_BASED_EFFECTS_LAYER_INFO, info)
+
+
+def _color_descriptor(color):
+    descriptor = Descriptor(classID=b'RGBC')
+    for key, value in zip((b'Rd  ', b'Grn ', b'Bl  '), color):
+        descriptor[key] = Double(float(value))
+    return descriptor
+
+
+def _set_block(layer, key, data):
+    layer._record.tagged_blocks[key] = TaggedBlock(key=key, data=data)
+
+
+_ADD_LAYER = {
+    'pixel': _add_pixel_layer,
+    'shape': _add_shape_layer,
+    'text': _add_type_layer,
+}
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Write a synthetic PSD document.')
+    parser.add_argument('output', metavar='PATH', help='Output file.')
+    parser.add_argument('--layers', type=int, default=100,
+                        help='Number of layers, default 100.')
+    parser.add_argument('--depth', type=int, default=3,
+                        help='Maximum nesting depth of groups, default 3.')
+    parser.add_argument('--size', metavar='WxH', default='2048x2048',
+                        help='Canvas size, default 2048x2048.')
+    parser.add_argument('--shares', metavar='P:S:T', default='6:3:1',
+                        help='Relative shares of pixel, shape and type '
+                        'layers, default 6:3:1.')
+    parser.add_argument('--masks', type=float, default=0.2,
+                        help='Share of layers with masks, default 0.2.')
+    parser.add_argument('--effects', type=float, default=0.2,
+                        help='Share of layers with effects, default 0.2.')
+    parser.add_argument('--max-layer-size', type=int, default=512,
+                        help='Maximum layer width and height, default 512.')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed, default 0.')
+    args = parser.parse_args(argv)
+    size = tuple(int(value) for value in args.size.split('x'))
+    pixel, shape, text = (float(value) for value in args.shares.split(':'))
+    generate(args.output, layers=args.layers, depth=args.depth, size=size,
+             pixel=pixel, shape=shape, text=text, masks=args.masks,
+             effects=args.effects, max_layer_size=args.max_layer_size,
+             seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Element ids local to a conversion.
+
+svgwrite numbers elements from a single process-wide counter. The counter is
+redirected to the :py:class:`IDNamespace` activated in the current thread,
+so concurrent conversions neither share nor disturb their id sequences.
+"""
+from __future__ import absolute_import, unicode_literals
+from contextlib import contextmanager
+import itertools
+from logging import getLogger
+import string
+import threading
+from svgwrite.utils import AutoID
+
+logger = getLogger(__name__)
+
+_local = threading.local()
+_global_next_id = AutoID.next_id
+
+
+class IDNamespace(object):
+    """
+    Sequence of element ids, ``id0``, ``id1``, ... by default.
+
+    Short ids are the shortest valid names instead, ``a`` to ``Z`` followed
+    by ``ab`` and so on.
+    """
+    def __init__(self, start=0, prefix='id', short=False):
+        self.prefix = prefix
+        self.short = short
+        self._counter = itertools.count(start)
+
+    def next_id(self):
+        if self.short:
+            return _short_id(next(self._counter))
+        return '{}{}'.format(self.prefix, next(self._counter))
+
+    @contextmanager
+    def activate(self):
+        """Assign ids of elements created in this thread from the namespace."""
+        previous = getattr(_local, 'namespace', None)
+        _local.namespace = self
+        try:
+            yield self
+        finally:
+            _local.namespace = previous
+
+
+_ID_START = string.ascii_letters
+_ID_CHARS = string.ascii_letters + string.digits
+
+
+def _short_id(value):
+    # Names cannot start with a digit.
+    name = _ID_START[value % len(_ID_START)]
+    value //= len(_ID_START)
+    while value:
+        name += _ID_CHARS[value % len(_ID_CHARS)]
+        value //= len(_ID_CHARS)
+    return name
+
+
+def _next_id(cls, value=None):
+    namespace = getattr(_local, 'namespace', None)
+    if namespace is None:
+        return _global_next_id(value)
+    return namespace.next_id()
+
+
+AutoID.next_id = classmethod(_next_id)
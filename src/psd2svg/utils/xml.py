@@ -3,6 +3,7 @@ from __future__ import absolute_import, unicode_literals
 
 from logging import getLogger
 import re
+from svgwrite.etree import CDATA_TAG
 
 logger = getLogger(__name__)
 
@@ -13,3 +14,222 @@ ILLEGAL_XML_RE = re.compile(
 
 def safe_utf8(text):
     return ILLEGAL_XML_RE.sub(' ', text)
+
+
+def _escape(data):
+    return data.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '"', '&quot;').replace('>', '&gt;')
+
+
+def _escape_text(data):
+    # XML parsers normalize line breaks in character data.
+    return _escape(data.replace('\r\n', '\n').replace('\r', '\n'))
+
+
+def serialize(element, pretty=True, indent='  '):
+    """
+    Serialize an ElementTree element to an XML document string.
+
+    The output is identical to re-parsing the tree with
+    :py:mod:`xml.dom.minidom` and calling ``toprettyxml(indent=indent)``, or
+    ``toxml()`` when ``pretty`` is False, but is written in a single pass
+    without intermediate copies of the document.
+
+    :param element: root `xml.etree.ElementTree.Element`.
+    :param pretty: indent elements on separate lines.
+    :param indent: indentation unit used when ``pretty`` is True.
+    :rtype: str
+    """
+    newl = '\n' if pretty else ''
+    chunks = ['<?xml version="1.0" ?>', newl]
+    _serialize_element(chunks.append, element, '', indent if pretty else '',
+                       newl)
+    return ''.join(chunks)
+
+
+def _serialize_element(write, element, current, indent, newl):
+    tag = element.tag
+    write(current)
+    write('<')
+    write(tag)
+
+    # Namespace declarations come first, as DOM builders report them before
+    # the other attributes.
+    attrib = element.attrib
+    names = [name for name in attrib
+             if name == 'xmlns' or name.startswith('xmlns:')]
+    if names:
+        names.extend(name for name in attrib if name not in names)
+    else:
+        names = attrib
+    for name in names:
+        write(' ')
+        write(name)
+        write('="')
+        write(_escape(attrib[name]))
+        write('"')
+
+    children = []
+    if element.text:
+        children.append(element.text)
+    for child in element:
+        children.append(child)
+        if child.tail:
+            children.append(child.tail)
+
+    if not children:
+        write('/>')
+        write(newl)
+        return
+
+    write('>')
+    if len(children) == 1 and not _is_element(children[0]):
+        _serialize_data(write, children[0], '', '')
+    else:
+        write(newl)
+        child_indent = current + indent
+        for child in children:
+            if _is_element(child):
+                _serialize_element(write, child, child_indent, indent, newl)
+            else:
+                _serialize_data(write, child, child_indent, newl)
+        write(current)
+    write('</')
+    write(tag)
+    write('>')
+    write(newl)
+
+
+def _is_element(node):
+    return not isinstance(node, str) and node.tag != CDATA_TAG
+
+
+def _serialize_data(write, node, current, newl):
+    if isinstance(node, str):
+        write(_escape_text(current + node + newl))
+    else:
+        # CDATA sections are written verbatim without indentation.
+        write('<![CDATA[')
+        write(node.text or '')
+        write(']]>')
+
+
+NUMBER_RE = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+# Attributes whose values are numbers, lists of numbers or transforms.
+NUMERIC_ATTRIBUTES = frozenset([
+    'amplitude', 'azimuth', 'baseFrequency', 'cx', 'cy', 'd',
+    'diffuseConstant', 'dx', 'dy', 'elevation', 'exponent', 'fill-opacity',
+    'flood-opacity', 'font-size', 'fr', 'fx', 'fy', 'gradientTransform',
+    'height', 'intercept', 'k1', 'k2', 'k3', 'k4', 'letter-spacing',
+    'offset', 'opacity', 'patternTransform', 'points', 'r', 'radius', 'rx',
+    'ry', 'scale', 'slope', 'specularConstant', 'specularExponent',
+    'stdDeviation', 'stop-opacity', 'stroke-dasharray', 'stroke-dashoffset',
+    'stroke-miterlimit', 'stroke-opacity', 'stroke-width', 'surfaceScale',
+    'tableValues', 'transform', 'values', 'viewBox', 'width', 'x', 'x1',
+    'x2', 'y', 'y1', 'y2',
+])
+
+_REGION_DEFAULTS = {
+    'x': '-10%', 'y': '-10%', 'width': '120%', 'height': '120%',
+}
+
+# Initial values of attributes that are not inherited, by element.
+DEFAULT_ATTRIBUTES = {
+    'clipPath': {'clipPathUnits': 'userSpaceOnUse'},
+    'feBlend': {'mode': 'normal'},
+    'feComposite': {'operator': 'over'},
+    'feFlood': {'flood-opacity': '1'},
+    'feOffset': {'dx': '0', 'dy': '0'},
+    'filter': dict(_REGION_DEFAULTS, filterUnits='objectBoundingBox'),
+    'image': {'x': '0', 'y': '0', 'preserveAspectRatio': 'xMidYMid meet'},
+    'linearGradient': {
+        'x1': '0%', 'y1': '0%', 'x2': '100%', 'y2': '0%',
+        'gradientUnits': 'objectBoundingBox', 'spreadMethod': 'pad',
+    },
+    'mask': dict(_REGION_DEFAULTS, maskUnits='objectBoundingBox'),
+    'pattern': {'x': '0', 'y': '0'},
+    'radialGradient': {
+        'cx': '50%', 'cy': '50%', 'r': '50%',
+        'gradientUnits': 'objectBoundingBox', 'spreadMethod': 'pad',
+    },
+    'rect': {'x': '0', 'y': '0'},
+    'stop': {'offset': '0', 'stop-opacity': '1'},
+    'use': {'x': '0', 'y': '0'},
+}
+
+_GLOBAL_DEFAULTS = {'opacity': '1'}
+
+
+def format_number(value, precision):
+    """Format the number with at most ``precision`` decimal places."""
+    text = '{:.{}f}'.format(value, precision)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text in ('-0', ''):
+        text = '0'
+    return text
+
+
+def round_numbers(element, precision):
+    """
+    Round numbers in numeric attributes of the tree to ``precision`` decimal
+    places, in place.
+    """
+    def replace(match):
+        return format_number(float(match.group(0)), precision)
+
+    for node in element.iter():
+        for key, value in node.attrib.items():
+            if key in NUMERIC_ATTRIBUTES:
+                node.set(key, NUMBER_RE.sub(replace, value))
+
+
+_REFERENCE_RE = re.compile(r'(url\(#|^#)([^)]+)')
+
+
+def renumber_ids(element, namespace):
+    """
+    Replace element ids of the tree with ids from the namespace in document
+    order, and update references to them, in place.
+    """
+    ids = {}
+    for node in element.iter():
+        value = node.get('id')
+        if value is not None:
+            ids[value] = namespace.next_id()
+            node.set('id', ids[value])
+
+    def replace(match):
+        return match.group(1) + ids.get(match.group(2), match.group(2))
+
+    for node in element.iter():
+        for key, value in node.attrib.items():
+            if '#' in value and key != 'id':
+                node.set(key, _REFERENCE_RE.sub(replace, value))
+
+
+def remove_default_attributes(element):
+    """Remove attributes set to their initial value from the tree, in place."""
+    for node in element.iter():
+        if not isinstance(node.tag, str):
+            continue
+        defaults = DEFAULT_ATTRIBUTES.get(node.tag, {})
+        for key in list(node.attrib):
+            default = defaults.get(key, _GLOBAL_DEFAULTS.get(key))
+            if default is not None and _equals(node.attrib[key], default):
+                del node.attrib[key]
+
+
+def _equals(value, default):
+    if value == default:
+        return True
+    # Compare numbers with the same unit, e.g. 0.0 and 0, or 1.0 and 1.
+    unit = default.lstrip('-+.0123456789')
+    if not value.endswith(unit):
+        return False
+    try:
+        return (float(value[:len(value) - len(unit)]) ==
+                float(default[:len(default) - len(unit)]))
+    except ValueError:
+        return False
@@ -0,0 +1,67 @@
+from __future__ import absolute_import, unicode_literals
+
+import multiprocessing
+import os
+import time
+import pytest
+from PIL import Image
+from psd_tools import PSDImage
+from psd2svg import psd2svg
+from psd2svg.batch import convert_batch, list_inputs
+
+
+@pytest.fixture
+def input_dir(tmpdir):
+    for index in range(3):
+        psd = PSDImage.frompil(Image.new('RGBA', (8, 8), (index, 0, 0, 255)))
+        psd.save(str(tmpdir.join('image{}.psd'.format(index))))
+    tmpdir.join('broken.psd').write_binary(b'not a psd')
+    return str(tmpdir)
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_convert_batch(tmpdir, input_dir, jobs):
+    output = str(tmpdir.join('output'))
+    results = list(convert_batch(list_inputs(input_dir), output, jobs=jobs))
+    assert len(results) == 4
+    failed = [result for result in results if not result.ok]
+    assert [os.path.basename(r.input) for r in failed] == ['broken.psd']
+    for result in results:
+        if result.ok:
+            assert os.path.exists(result.output)
+
+
+def test_psd2svg_directory(tmpdir, input_dir):
+    output = str(tmpdir.join('output'))
+    results = psd2svg(input_dir, output, jobs=2)
+    assert sorted(os.listdir(output)) == [
+        'image0.svg', 'image1.svg', 'image2.svg']
+    assert sum(result.ok for result in results) == 3
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='Workers must inherit the patched converter')
+def test_convert_batch_lost_worker(tmpdir, input_dir, monkeypatch):
+    from psd2svg import PSD2SVG
+    convert = PSD2SVG.convert
+
+    def patched(self, input_url, output_url=None):
+        if 'image0' in input_url:
+            os._exit(1)
+        if 'image1' in input_url:
+            time.sleep(60)
+        return convert(self, input_url, output_url)
+
+    monkeypatch.setattr(PSD2SVG, 'convert', patched)
+    output = str(tmpdir.join('output'))
+    start = time.time()
+    results = list(convert_batch(list_inputs(input_dir), output, jobs=2,
+                                 timeout=2.0))
+    assert time.time() - start < 30
+    assert [r.input for r in results] == list_inputs(input_dir)
+    errors = dict((os.path.basename(r.input), r.error) for r in results)
+    assert len(errors) == 4
+    assert errors['image0.psd'] == 'Worker process exited'
+    assert errors['image1.psd'].startswith('Timed out')
+    assert errors['image2.psd'] is None
+    assert 'Traceback' in errors['broken.psd']
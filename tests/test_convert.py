@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 
 from builtins import str
 import os
+import re
 import pytest
 import io
 from glob import glob
@@ -40,3 +41,488 @@ def test_input_layer(tmpdir, psd_file):
 def test_output_io(tmpdir, psd_file):
     with io.StringIO() as f:
         assert f == psd2svg(psd_file, f)
+
+
+def test_shared_bitmaps():
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    psd = PSDImage.new('RGB', (30, 30))
+    for left, top, color in [(5, 5, 'red'), (15, 15, 'red'), (1, 1, 'blue')]:
+        psd.append(PixelLayer.frompil(
+            Image.new('RGBA', (10, 10), color), psd, color, left, top))
+    svg = psd2svg(psd)
+    hrefs = re.findall(r'data:image/png;base64,[^"]+', svg)
+    assert len(hrefs) == len(set(hrefs))
+    assert svg.count('<use class="psd-layer pixel"') == 2
+
+
+def test_resource_reexport(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd2svg import PSD2SVG
+    from psd2svg.storage import FileSystemStorage
+    psd = PSDImage.frompil(Image.new('RGBA', (10, 10), 'red'))
+    converter = PSD2SVG(resource_path='resources/')
+    output = str(tmpdir.join('output.svg'))
+    converter.convert(psd, output)
+    assert len(tmpdir.join('resources').listdir()) == 1
+
+    puts = []
+    monkeypatch.setattr(FileSystemStorage, 'put',
+                        lambda self, *args, **kwargs: puts.append(args))
+    converter.convert(psd, output)
+    PSD2SVG(resource_path='resources/').convert(psd, output)
+    assert puts == []
+
+
+def test_resource_flush(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    from psd2svg.storage import FileSystemStorage
+    psd = PSDImage.new('RGB', (40, 40))
+    for index in range(4):
+        image = Image.new('RGBA', (10, 10), (index * 50, 0, 0, 255))
+        psd.append(PixelLayer.frompil(image, psd, str(index), index, index))
+    converter = PSD2SVG(resource_path=str(tmpdir.join('resources')))
+
+    async def fail(self, key, value, **kwargs):
+        raise IOError('Upload failed')
+
+    with monkeypatch.context() as m:
+        m.setattr(FileSystemStorage, 'aput', fail)
+        with pytest.raises(IOError):
+            converter.convert(psd)
+    converter.convert(psd)
+    assert len(converter.resources) >= 4
+    assert sorted(converter.resources) == sorted(
+        str(path) for path in tmpdir.join('resources').listdir())
+
+
+def test_resource_render_failure(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    psd = PSDImage.new('RGB', (40, 40))
+    for index in range(4):
+        image = Image.new('RGBA', (10, 10), (0, index * 50, 0, 255))
+        psd.append(PixelLayer.frompil(image, psd, str(index), index, index))
+    converter = PSD2SVG(resource_path=str(tmpdir.join('resources')))
+
+    def fail(self):
+        raise RuntimeError('Rendering failed')
+
+    with monkeypatch.context() as m:
+        m.setattr(PSD2SVG, '_get_svg', fail)
+        with pytest.raises(RuntimeError):
+            converter.convert(psd)
+    converter.convert(psd)
+    assert len(converter.resources) >= 4
+    assert sorted(converter.resources) == sorted(
+        str(path) for path in tmpdir.join('resources').listdir())
+
+
+def test_mmap(tmpdir):
+    from PIL import Image
+    from psd2svg import PSD2SVG
+    psd = PSDImage.frompil(Image.new('RGBA', (300, 300), (255, 0, 0, 128)))
+    input_url = str(tmpdir.join('input.psd'))
+    psd.save(input_url)
+    assert (PSD2SVG(mmap=True).convert(input_url) ==
+            PSD2SVG().convert(input_url))
+
+
+def test_compact_attributes():
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    psd = PSDImage.new('RGB', (40, 40))
+    psd.append(PixelLayer.frompil(
+        Image.new('RGBA', (10, 10), 'red'), psd, 'red', 3, 3))
+    svg = PSD2SVG(compact=True, precision=1).convert(psd)
+    assert re.findall(r' id="(\w+)"', svg) == ['a']
+    assert 'mask="url(#a)"' in svg
+    assert len(svg) < len(PSD2SVG().convert(psd))
+
+
+def test_threads():
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    psd = PSDImage.new('RGB', (40, 40))
+    for index in range(8):
+        image = Image.new('RGBA', (10, 10), (index % 3 * 100, index, 0, 255))
+        psd.append(PixelLayer.frompil(
+            image, psd, str(index), index * 4, index * 3))
+    assert (PSD2SVG(threads=4).convert(psd) ==
+            PSD2SVG(threads=1).convert(psd))
+
+
+def test_threads_prefetch():
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from psd_tools.api.layers import Group, PixelLayer
+    from psd2svg import PSD2SVG
+    from psd2svg.converter.io import _ImagePrefetcher
+    psd = PSDImage.new('RGB', (40, 40))
+    group = Group.new(psd, 'group')
+    layer = PixelLayer.frompil(
+        Image.new('RGBA', (10, 10), 'red'), group, 'red', 3, 3)
+    group.create_mask(Image.new('L', (20, 20), 255))
+    converter = PSD2SVG()
+    converter.reset()
+    assert list(converter._iter_layer_images(psd, root=True)) == [
+        (layer, False), (layer, True), (group, True)]
+    assert (PSD2SVG(threads=2).convert(psd) ==
+            PSD2SVG(threads=1).convert(psd))
+
+    layers = [object() for _ in range(4)]
+    with ThreadPoolExecutor(2) as executor:
+        prefetcher = _ImagePrefetcher(
+            executor, lambda layer, mask: layer,
+            [(item, False) for item in layers], window=2)
+        assert prefetcher.get(
+            (id(layers[1]), False), layers[1], False) is layers[1]
+        # The image of a passed layer is dropped for the next ones.
+        assert list(prefetcher._futures) == [
+            (id(layers[2]), False), (id(layers[3]), False)]
+
+
+def test_concurrent_converters(tmpdir):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    inputs = []
+    for index in range(8):
+        psd = PSDImage.new('RGB', (40, 30))
+        for offset in range(index % 3 + 1):
+            image = Image.new('RGBA', (10 + index, 10),
+                              (index * 30, offset * 80, 0, 255))
+            psd.append(PixelLayer.frompil(
+                image, psd, 'layer{}'.format(offset), offset * 5, index))
+        inputs.append(str(tmpdir.join('input{}.psd'.format(index))))
+        psd.save(inputs[-1])
+    expected = [PSD2SVG().convert(psd_file) for psd_file in inputs]
+    local = threading.local()
+
+    def convert(psd_file):
+        if not hasattr(local, 'converter'):
+            local.converter = PSD2SVG()
+        return local.converter.convert(psd_file)
+
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(convert, inputs * 4))
+    assert results == expected * 4
+
+
+def test_crop_to_viewbox():
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    psd = PSDImage.new('RGB', (100, 100))
+    psd.append(PixelLayer.frompil(
+        Image.new('RGBA', (100, 100), 'red'), psd, 'full', 0, 0))
+    psd.append(PixelLayer.frompil(
+        Image.new('RGBA', (10, 10), 'blue'), psd, 'hidden', 90, 90))
+    svg = PSD2SVG(padding=(-10, -10, -60, -60)).convert(psd)
+    assert '<title>hidden</title>' not in svg
+    assert 'height="32" mask="url(#id0)" width="32" x="9"' in svg
+
+
+def test_scale():
+    import base64
+    from PIL import Image
+    from psd2svg import PSD2SVG
+    psd = PSDImage.frompil(Image.new('RGBA', (40, 20), 'red'))
+    svg = PSD2SVG(scale=0.25).convert(psd)
+    assert 'height="5.0"' in svg and 'width="10.0"' in svg
+    data = re.search(r'data:image/png;base64,([^"]+)', svg).group(1)
+    assert Image.open(io.BytesIO(base64.b64decode(data))).size == (10, 5)
+
+
+def test_scale_size():
+    import base64
+    import numpy as np
+    from PIL import Image
+    from psd2svg import PSD2SVG
+    rng = np.random.RandomState(0)
+    y, x = np.mgrid[0:128, 0:128]
+    pixels = np.stack([x, y, x + y], -1) + rng.randint(0, 24, (128, 128, 3))
+    psd = PSDImage.frompil(Image.fromarray(pixels.astype('uint8')))
+    assert len(PSD2SVG(scale=0.5).convert(psd)) < len(
+        PSD2SVG().convert(psd)) / 2
+
+    # Flat art slightly downsampled keeps the original bitmap.
+    blocks = np.kron(rng.randint(0, 2, (16, 16)), np.ones((8, 8))) * 255
+    psd = PSDImage.frompil(Image.fromarray(blocks.astype('uint8')).convert(
+        'RGB'))
+    svg = PSD2SVG(scale=0.9).convert(psd)
+    data = re.search(r'data:image/png;base64,([^"]+)', svg).group(1)
+    assert Image.open(io.BytesIO(base64.b64decode(data))).size == (128, 128)
+
+
+def test_intern_def():
+    import svgwrite
+    from psd2svg import PSD2SVG
+    converter = PSD2SVG()
+    converter.reset()
+    converter._dwg = svgwrite.Drawing()
+
+    def create_filter(blur):
+        filt = converter._dwg.filter()
+        filt.feGaussianBlur('SourceAlpha', stdDeviation=blur)
+        return converter._intern_def(filt)
+
+    first = create_filter(2.0)
+    assert create_filter(2.0) is first
+    assert create_filter(3.0) is not first
+    assert len(converter._dwg.defs.elements) == 2
+
+
+def test_pattern_cache(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd2svg import PSD2SVG
+
+    class FakePattern(object):
+        def __init__(self, data):
+            self.data = data
+
+        def tobytes(self):
+            return self.data
+
+    cache_dir = str(tmpdir.join('patterns'))
+    converter = PSD2SVG(pattern_cache_size=2, pattern_cache_dir=cache_dir)
+    converter.reset()
+    calls = []
+
+    def convert(pattern):
+        calls.append(pattern.data)
+        return Image.new('RGBA', (4, 4), (len(calls), 0, 0, 255))
+
+    monkeypatch.setattr(
+        'psd2svg.converter.core.convert_pattern_to_pil', convert)
+    first = converter._get_pattern_image('a', FakePattern(b'1'))
+    assert converter._get_pattern_image('a', FakePattern(b'1')) is first
+    converter._get_pattern_image('a', FakePattern(b'2'))
+    converter._get_pattern_image('b', FakePattern(b'1'))
+    assert len(converter._pattern_cache) == 2
+    assert calls == [b'1', b'2', b'1']
+
+    # Another process reads the bitmap back from disk.
+    other = PSD2SVG(pattern_cache_dir=cache_dir)
+    other.reset()
+    image, digest, encoded = other._get_pattern_image('a', FakePattern(b'1'))
+    assert (digest, encoded) == first[1:]
+    assert calls == [b'1', b'2', b'1']
+
+
+def test_lru_cache():
+    from psd2svg.cache import LRUCache
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'a' in cache and 'c' in cache and 'b' not in cache
+
+    cache = LRUCache(10, max_bytes=8)
+    cache.put('a', b'1234')
+    cache.put('b', b'1234')
+    cache.put('c', b'12')
+    assert 'a' not in cache and 'b' in cache and 'c' in cache
+    cache.put('d', b'123456789')
+    assert 'd' not in cache and len(cache) == 2
+
+
+def test_disk_cache(tmpdir, monkeypatch):
+    import os
+    from psd2svg import cache as cache_module
+    listed = []
+    original = os.listdir
+
+    def listdir(path):
+        listed.append(path)
+        return original(path)
+
+    monkeypatch.setattr(os, 'listdir', listdir)
+    cache = cache_module.DiskCache(str(tmpdir), max_bytes=10000)
+    for index in range(8):
+        cache.put(str(index), b'x' * 1000)
+    # Listed once to learn the size, then tracked.
+    assert len(listed) == 1
+    # Evicted down to 90% of the limit once past it.
+    cache.put('8', b'x' * 1000)
+    cache.put('9', b'x' * 1000)
+    assert len(listed) == 2
+    assert len(tmpdir.listdir()) == 8
+    assert cache.get('9') == b'x' * 1000 and cache.get('0') is None
+
+
+def test_path_data():
+    from psd_tools.psd.vector import ClosedKnotLinked, ClosedPath, OpenPath
+    from psd2svg import PSD2SVG
+    converter = PSD2SVG(precision=2)
+    converter._psd = PSDImage.new('RGB', (200, 100))
+    knots = [
+        ClosedKnotLinked((0.1, 0.2), (0.3, 0.4), (0.5, 0.6)),
+        ClosedKnotLinked((0.0, 0.125), (0.25, 1.0), (-0.00001, 0.3333)),
+    ]
+    path_list = [ClosedPath(items=knots), OpenPath(items=knots[:1])]
+    assert converter._generate_path(path_list) == (
+        'M 80 30 C 120 50 25 0 200 25 66.66 0 40 10 80 30 Z M 80 30 C')
+    converter.precision = None
+    assert converter._generate_path(path_list[1:]) == 'M 80.0 30.0 C'
+
+
+def test_simplify_paths():
+    from psd_tools.psd.vector import ClosedKnotLinked, ClosedPath, OpenPath
+    from psd2svg import PSD2SVG
+
+    def knot(y, x):
+        return ClosedKnotLinked((y, x), (y, x), (y, x))
+
+    converter = PSD2SVG(simplify_paths=True)
+    converter._psd = PSDImage.new('RGB', (100, 100))
+    rectangle = ClosedPath(items=[
+        knot(0.1, 0.1), knot(0.1, 0.9), knot(0.9, 0.9), knot(0.9, 0.1)])
+    curve = OpenPath(items=[
+        knot(0.5, 0.5), knot(0.5, 0.501), knot(0.7, 0.7),
+        ClosedKnotLinked((0.8, 0.7), (0.9, 0.8), (0.9, 0.9))])
+    assert converter._generate_path([rectangle]) == (
+        'M 10.0 10.0 H 90.0 V 90.0 H 10.0 Z')
+    assert converter._generate_path([curve]) == (
+        'M 50.0 50.0 H 50.1 L 70.0 70.0 C 70.0 70.0 70.0 80.0 80.0 90.0')
+
+    converter.path_tolerance = 1.0
+    converter.relative_paths = True
+    converter.precision = 1
+    assert converter._generate_path([curve]) == (
+        'M 50 50 l 20 20 c 0 0 0 10 10 20')
+    converter.simplify_paths = False
+    assert converter._generate_path([rectangle]) == (
+        'M 10 10 c 0 0 80 0 80 0 0 0 0 80 0 80 0 0 -80 0 -80 0 0 0 0 -80 '
+        '0 -80 Z')
+
+
+def test_fragment_cache(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+
+    def create_psd(color):
+        psd = PSDImage.new('RGB', (40, 40))
+        for index in range(3):
+            psd.append(PixelLayer.frompil(
+                Image.new('RGBA', (10, 10), (index * 100, 0, 0, 255)),
+                psd, str(index), index * 10, index * 10))
+        psd.append(PixelLayer.frompil(
+            Image.new('RGBA', (10, 10), color), psd, 'edit', 30, 0))
+        return psd
+
+    loaded = []
+    load_layer_image = PSD2SVG._load_layer_image
+    monkeypatch.setattr(
+        PSD2SVG, '_load_layer_image',
+        lambda self, layer, mask=False: loaded.append(layer.name) or
+        load_layer_image(self, layer, mask))
+
+    cache_dir = str(tmpdir.join('fragments'))
+    svg = PSD2SVG(fragment_cache_dir=cache_dir).convert(create_psd('blue'))
+    assert sorted(set(loaded)) == ['0', '1', '2', 'edit']
+    del loaded[:]
+    edited = PSD2SVG(fragment_cache_dir=cache_dir).convert(
+        create_psd('green'))
+    assert set(loaded) == {'edit'}
+    assert edited != svg
+    assert edited == PSD2SVG(
+        fragment_cache_dir=str(tmpdir.join('other'))).convert(
+            create_psd('green'))
+
+
+def test_result_cache(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    psd = PSDImage.new('RGB', (40, 40))
+    psd.append(PixelLayer.frompil(
+        Image.new('RGBA', (10, 10), 'red'), psd, 'red', 3, 3))
+    input_url = str(tmpdir.join('input.psd'))
+    psd.save(input_url)
+
+    rendered = []
+    render = PSD2SVG._render
+    monkeypatch.setattr(PSD2SVG, '_render',
+                        lambda self: rendered.append(1) or render(self))
+    options = dict(result_cache_dir=str(tmpdir.join('results')),
+                   resource_path='images')
+    first = str(tmpdir.join('first', 'output.svg'))
+    second = str(tmpdir.join('second', 'output.svg'))
+    PSD2SVG(**options).convert(input_url, first)
+    with open(input_url, 'rb') as f:
+        converter = PSD2SVG(**options)
+        converter.convert(f, second)
+    assert len(rendered) == 1
+    assert tmpdir.join('first', 'output.svg').read() == tmpdir.join(
+        'second', 'output.svg').read()
+    assert len(converter.resources) == len(
+        tmpdir.join('second', 'images').listdir()) > 0
+
+    # Without an output, resources are written relative to the current
+    # directory.
+    monkeypatch.chdir(tmpdir)
+    PSD2SVG(compact=True, **options).convert(input_url)
+    assert len(rendered) == 2
+
+
+def test_result_cache_coalesce(tmpdir):
+    import threading
+    from psd2svg.cache import ResultCache
+    cache = ResultCache(str(tmpdir))
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'value'
+
+    threads = [threading.Thread(
+        target=lambda: results.append(cache.get('key', compute)))
+        for _ in range(4)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert calls == [1]
+    assert results == ['value'] * 4
+    assert cache.get('key', None) == 'value'
+
+
+def test_profile(tmpdir):
+    from PIL import Image
+    from psd_tools.api.layers import PixelLayer
+    from psd2svg import PSD2SVG
+    from psd2svg.profiler import format_report
+    psd = PSDImage.new('RGB', (40, 40))
+    psd.append(PixelLayer.frompil(
+        Image.new('RGBA', (10, 10), 'red'), psd, 'red', 3, 3))
+    input_url = str(tmpdir.join('input.psd'))
+    psd.save(input_url)
+
+    assert PSD2SVG().timings is None
+    calls = []
+    converter = PSD2SVG(
+        timing_hooks=[lambda *args: calls.append(args[:2])])
+    converter.convert(input_url)
+    timings = converter.timings
+    assert set(timings['stages']) >= {
+        'parse', 'decode', 'encode', 'effects', 'serialize', 'write'}
+    assert timings['stages']['decode']['calls'] == 2
+    assert [layer['name'] for layer in timings['layers']] == ['red']
+    assert ('layer', converter._psd[0]) in calls
+    assert 'red' in format_report(timings)
@@ -0,0 +1,62 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from psd2svg.encoder import ENCODERS, get_encoder, is_opaque, psnr
+
+
+def _gradient(mode='RGBA'):
+    x, y = np.meshgrid(np.arange(64), np.arange(64))
+    pixels = np.stack([x * 4, y * 4, (x + y) * 2, 255 - x], axis=2)
+    return Image.fromarray(pixels.astype(np.uint8), 'RGBA').convert(mode)
+
+
+def _flat():
+    image = Image.new('RGBA', (64, 64), (255, 0, 0, 255))
+    image.paste((0, 0, 255, 128), (0, 0, 32, 32))
+    return image
+
+
+@pytest.mark.parametrize('name', ENCODERS)
+@pytest.mark.parametrize('image', [_gradient(), _gradient('RGB'), _flat(),
+                                   _gradient('L')])
+def test_encode(name, image):
+    fmt, data = get_encoder(name).encode(image)
+    decoded = Image.open(io.BytesIO(data))
+    assert decoded.format.lower() == fmt
+    assert decoded.size == image.size
+
+
+def test_png_default():
+    image = _gradient()
+    with io.BytesIO() as f:
+        image.save(f, format='png')
+        assert get_encoder('png').encode(image) == ('png', f.getvalue())
+
+
+@pytest.mark.parametrize('image', [_flat(), _flat().convert('RGB')])
+def test_png8_lossless(image):
+    fmt, data = get_encoder('png8').encode(image)
+    decoded = Image.open(io.BytesIO(data))
+    assert decoded.mode == 'P'
+    assert psnr(image, decoded) == float('inf')
+    assert len(data) < len(get_encoder('png').encode(image)[1])
+
+
+def test_jpeg_fallback():
+    assert get_encoder('jpeg').encode(_gradient())[0] == 'png'
+    assert get_encoder('jpeg').encode(_gradient('RGB'))[0] == 'jpeg'
+    assert is_opaque(_gradient('RGB'))
+    assert not is_opaque(_gradient())
+
+
+def test_auto():
+    image = _gradient('RGB')
+    fmt, data = get_encoder('auto').encode(image)
+    assert len(data) <= min(
+        len(get_encoder(name).encode(image)[1])
+        for name in ('png', 'png8', 'webp'))
+    fmt, data = get_encoder('auto', threshold=1000).encode(image)
+    assert psnr(image, Image.open(io.BytesIO(data))) == float('inf')
@@ -0,0 +1,113 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import json
+import os
+import pytest
+import threading
+from PIL import Image
+from psd_tools import PSDImage
+from psd2svg.server import ConversionService, create_server, parse_options
+from future.standard_library import install_aliases
+
+install_aliases()
+
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+
+@pytest.fixture(scope='module')
+def server():
+    service = ConversionService(workers=1, queue_size=1)
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.terminate()
+
+
+def _url(server, path):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def _psd_data():
+    psd = PSDImage.frompil(Image.new('RGBA', (8, 8), (255, 0, 0, 255)))
+    with io.BytesIO() as f:
+        psd.save(f)
+        return f.getvalue()
+
+
+def test_convert(server):
+    response = urlopen(Request(
+        _url(server, '/convert?compact=1'), data=_psd_data()))
+    assert response.headers['Content-Type'].startswith('image/svg+xml')
+    assert response.read().decode('utf-8').startswith('<?xml')
+
+
+def test_convert_manifest(server, tmpdir):
+    input_url = str(tmpdir.join('input.psd'))
+    with open(input_url, 'wb') as f:
+        f.write(_psd_data())
+    response = urlopen(Request(_url(
+        server, '/convert?format=json&resource_path={}&input={}'.format(
+            str(tmpdir.join('resources')), input_url)), data=b''))
+    result = json.loads(response.read().decode('utf-8'))
+    assert result['svg'].startswith('<?xml')
+    assert len(result['resources']) == 1
+
+
+def test_bad_request(server):
+    with pytest.raises(HTTPError) as e:
+        urlopen(Request(_url(server, '/convert?scale=x'), data=b'x'))
+    assert e.value.code == 400
+
+
+def test_busy(server):
+    slots = server.service._slots
+    while slots.acquire(False):
+        pass
+    try:
+        with pytest.raises(HTTPError) as e:
+            urlopen(Request(_url(server, '/convert'), data=_psd_data()))
+        assert e.value.code == 503
+        assert e.value.headers['Retry-After'] == '1'
+    finally:
+        for _ in range(server.service.workers + server.service.queue_size):
+            slots.release()
+
+
+def test_health_and_metrics(server):
+    health = json.loads(urlopen(_url(server, '/health')).read().decode(
+        'utf-8'))
+    assert health['status'] == 'ok'
+    metrics = urlopen(_url(server, '/metrics')).read().decode('utf-8')
+    assert 'psd2svg_requests_total' in metrics
+
+
+def test_parse_options():
+    options = parse_options({'padding': '1,2,3,4', 'encoder': 'webp',
+                             'compact': 'true'})
+    assert options['padding'] == [1, 2, 3, 4]
+    assert options['compact'] is True
+    with pytest.raises(ValueError):
+        parse_options({'unknown': '1'})
+
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason='Needs named pipes')
+def test_timeout_releases_slot(tmpdir):
+    import multiprocessing
+    # Reading a pipe without a writer blocks the worker.
+    fifo = str(tmpdir.join('input.psd'))
+    os.mkfifo(fifo)
+    service = ConversionService(workers=1, queue_size=0, timeout=1.0)
+    try:
+        with pytest.raises(multiprocessing.TimeoutError):
+            service.convert(fifo)
+        result = service.convert(_psd_data())
+        assert result['svg'].startswith('<?xml')
+        assert 'psd2svg_pool_restarts_total 1' in service.metrics()
+    finally:
+        service.terminate()
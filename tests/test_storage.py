@@ -1,7 +1,18 @@
 from __future__ import absolute_import, unicode_literals
 
+import asyncio
+import functools
+import hashlib
+import io
+import os
 import pytest
-from psd2svg.storage import get_storage
+import threading
+import time
+from http.server import (
+    BaseHTTPRequestHandler, SimpleHTTPRequestHandler, ThreadingHTTPServer)
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlparse
+from psd2svg.storage import ResourceManifest, get_storage, run_sync
 
 
 @pytest.mark.parametrize("url, key", [
@@ -27,3 +38,399 @@ def test_file_readwrite(tmpdir, key, value):
         assert f.read() == value
     storage.delete(key)
     assert not storage.exists(key)
+
+
+def test_resource_manifest(tmpdir):
+    storage = get_storage(str(tmpdir))
+    storage.put('foo.png', b'foo')
+    manifest = ResourceManifest(storage)
+    assert 'foo.png' in manifest
+    assert 'bar.png' not in manifest
+    storage.put('bar.png', b'bar')
+    assert 'bar.png' not in manifest
+    manifest.refresh()
+    assert 'bar.png' in manifest
+
+
+def test_file_digest(tmpdir):
+    storage = get_storage(str(tmpdir))
+    assert storage.digest('foo') is None
+    storage.put('foo', b'bar')
+    assert storage.digest('foo') == hashlib.md5(b'bar').hexdigest()
+
+
+def test_file_async(tmpdir):
+    storage = get_storage(str(tmpdir), max_concurrency=2)
+
+    async def run():
+        await asyncio.gather(*[
+            storage.aput('{}.txt'.format(index), b'x' * index)
+            for index in range(8)])
+        assert await storage.aexists('3.txt')
+        assert not await storage.aexists('foo.txt')
+        assert await storage.aget('5.txt') == b'xxxxx'
+        return await storage.alist()
+
+    assert len(run_sync(run())) == 8
+    assert storage._executor._max_workers == 2
+
+
+class _Handler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        SimpleHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_request(self, code='-', size='-'):
+        self.server.requests.append((self.command, int(code)))
+        self.server.paths.append(self.path)
+
+    def translate_path(self, path):
+        if path.startswith('/slow'):
+            time.sleep(1)
+        # Proxied requests carry the whole url.
+        return SimpleHTTPRequestHandler.translate_path(
+            self, urlparse(path).path)
+
+
+@pytest.fixture
+def http_server(tmpdir):
+    tmpdir.join('foo.txt').write_binary(b'bar')
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(
+        _Handler, directory=str(tmpdir)))
+    server.connections = 0
+    server.requests = []
+    server.paths = []
+    server.url = 'http://127.0.0.1:{}/'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_url_async(http_server):
+    storage = get_storage(http_server.url)
+
+    async def run():
+        return await asyncio.gather(
+            storage.aget('foo.txt'), storage.aexists('foo.txt'),
+            storage.aexists('missing.txt'))
+
+    assert run_sync(run()) == [b'bar', True, False]
+
+
+def test_url_keep_alive(http_server, tmpdir):
+    storage = get_storage(http_server.url)
+    assert storage.get('foo.txt') == b'bar'
+    assert storage.get('foo.txt') == b'bar'
+    assert http_server.requests == [('GET', 200), ('GET', 200)]
+
+    storage = get_storage(http_server.url, cache_responses=True)
+    assert storage.get('foo.txt') == b'bar'
+    assert storage.exists('foo.txt')
+    assert storage.get('foo.txt') == b'bar'
+    assert http_server.connections == 1
+    assert http_server.requests[2:] == [
+        ('GET', 200), ('HEAD', 200), ('GET', 304)]
+
+    # Modified content is downloaded again.
+    tmpdir.join('foo.txt').write_binary(b'baz')
+    mtime = os.path.getmtime(str(tmpdir.join('foo.txt')))
+    os.utime(str(tmpdir.join('foo.txt')), (mtime + 10, mtime + 10))
+    assert storage.get('foo.txt') == b'baz'
+    assert http_server.requests[-1] == ('GET', 200)
+
+
+def test_url_timeout(http_server):
+    storage = get_storage(http_server.url, timeout=0.2)
+    with pytest.raises(OSError):
+        storage.get('slow.txt')
+    assert storage.get('foo.txt') == b'bar'
+    with pytest.raises(OSError):
+        get_storage(http_server.url).get('slow.txt', timeout=0.2)
+
+
+def test_url_proxy(http_server, monkeypatch):
+    monkeypatch.setenv('http_proxy', http_server.url)
+    monkeypatch.delenv('no_proxy', raising=False)
+    storage = get_storage('http://psd2svg.invalid/')
+    assert storage.get('foo.txt') == b'bar'
+    assert storage.exists('foo.txt')
+    assert not storage.exists('missing.txt')
+    assert http_server.paths == [
+        'http://psd2svg.invalid/foo.txt',
+        'http://psd2svg.invalid/foo.txt',
+        'http://psd2svg.invalid/missing.txt']
+
+
+def test_url_stream(http_server, tmpdir):
+    data = os.urandom(1024 * 1024)
+    tmpdir.join('large.bin').write_binary(data)
+    storage = get_storage(http_server.url)
+    storage.chunk_size = 1000
+    buffer = io.BytesIO()
+    with storage.open('large.bin', buffer=buffer) as f:
+        assert f is buffer
+        assert f.read() == data
+    with pytest.raises(HTTPError):
+        storage.get('missing.txt')
+    assert http_server.connections == 1
+
+
+class _FakeS3Client(object):
+    """Stand-in of the boto3 S3 client keeping objects in a dict."""
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.calls.append('put_object')
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def download_fileobj(self, Bucket, Key, Fileobj, **kwargs):
+        Fileobj.write(self.objects[(Bucket, Key)])
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            from botocore.exceptions import ClientError
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ETag': '"{}"'.format(
+            hashlib.md5(self.objects[(Bucket, Key)]).hexdigest())}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.uploads[UploadId][PartNumber] = Body
+        return {'ETag': str(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId,
+                                  MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b''.join(
+            parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        del self.uploads[UploadId]
+
+
+@pytest.mark.parametrize('size, calls', [
+    (9, ['put_object']),
+    (25, ['upload_part'] * 3),
+])
+def test_s3_multipart_writer(size, calls):
+    from psd2svg.storage import _S3MultipartWriter
+    client = _FakeS3Client()
+    writer = _S3MultipartWriter(client, 'bucket', 'key', 10, 2, {})
+    for index in range(size):
+        writer.write(bytes(bytearray([index])))
+    writer.close()
+    assert client.objects[('bucket', 'key')] == bytes(bytearray(range(size)))
+    assert client.calls == calls
+
+
+def test_s3_multipart_abort():
+    from psd2svg.storage import _S3MultipartWriter
+    client = _FakeS3Client()
+    writer = _S3MultipartWriter(client, 'bucket', 'key', 10, 2, {})
+    writer.write(b'x' * 15)
+    writer.abort()
+    assert client.uploads == {} and client.objects == {}
+
+
+def test_s3_storage(monkeypatch):
+    pytest.importorskip('boto3')
+    from psd2svg.storage import S3Storage
+    client = _FakeS3Client()
+    monkeypatch.setattr('psd2svg.storage._get_s3_client', lambda *_: client)
+    storage = S3Storage('bucket', 'prefix')
+    with storage.open('foo.psd', 'wb') as f:
+        f.write(b'foo')
+    assert storage.get('foo.psd') == b'foo'
+    buffer = io.BytesIO()
+    with storage.open('foo.psd', buffer=buffer) as f:
+        assert f is buffer
+    assert storage.digest('foo.psd') == hashlib.md5(b'foo').hexdigest()
+
+    async def run():
+        await storage.aput('foo.png', b'bar')
+        return await asyncio.gather(
+            storage.aget('foo.png'), storage.aexists('foo.png'),
+            storage.aexists('bar.png'))
+
+    assert run_sync(run()) == [b'bar', True, False]
+    assert ('bucket', 'prefix/foo.png') in client.objects
+
+
+class _LocalHdfsClient(object):
+    """Stand-in of a HDFS client on the local file system."""
+    def __init__(self, root):
+        self.root = root
+        self.chunks = []
+
+    def read(self, path, chunk_size):
+        with open(self.root + path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                self.chunks.append(len(chunk))
+                yield chunk
+
+    def write(self, path):
+        if not os.path.isdir(os.path.dirname(self.root + path)):
+            os.makedirs(os.path.dirname(self.root + path))
+        return open(self.root + path, 'wb')
+
+    def exists(self, path):
+        return os.path.exists(self.root + path)
+
+    def list(self, path):
+        return os.listdir(self.root + path)
+
+    def delete(self, path):
+        os.remove(self.root + path)
+
+
+def test_hdfs_storage(tmpdir):
+    from psd2svg.storage import HdfsStorage
+    client = _LocalHdfsClient(str(tmpdir))
+    storage = HdfsStorage('namenode:8020', '/user/psd2svg/', client=client)
+    storage.chunk_size = 4
+    assert storage.url('foo.svg') == 'hdfs://namenode:8020/user/psd2svg/foo.svg'
+    storage.put('foo.svg', b'\x00\xffbinary')
+    assert storage.exists('foo.svg')
+    assert not storage.exists('bar.svg')
+    assert storage.get('foo.svg') == b'\x00\xffbinary'
+    assert client.chunks == [4, 4]
+    assert list(storage.list()) == ['foo.svg']
+    storage.delete('foo.svg')
+    assert not storage.exists('foo.svg')
+
+
+class _WebHdfsHandler(BaseHTTPRequestHandler):
+    """Namenode redirecting uploads to the datanode under /datanode."""
+    protocol_version = 'HTTP/1.1'
+
+    def do_PUT(self):
+        parsed = urlparse(self.path)
+        if not parsed.path.startswith('/datanode/'):
+            self.server.queries.append(parse_qs(parsed.query))
+            self.send_response(307)
+            self.send_header('Location', '/datanode{}?{}'.format(
+                parsed.path, parsed.query))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        chunks = []
+        while True:
+            line = self.rfile.readline()
+            if not line.strip():
+                # Aborted upload.
+                return
+            size = int(line, 16)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            if not size:
+                break
+        path = parsed.path[len('/datanode/webhdfs/v1'):]
+        self.server.files[path] = b''.join(chunks)
+        self.send_response(201)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def webhdfs_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _WebHdfsHandler)
+    server.queries = []
+    server.files = {}
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_hdfs_write(webhdfs_server):
+    storage = get_storage(
+        'hdfs://127.0.0.1:8020/data/', effective_user='psd2svg',
+        webhdfs_port=webhdfs_server.server_address[1])
+    with storage.open('output.svg', 'wb') as f:
+        f.write(b'<svg>')
+        f.write(b'</svg>')
+    storage.put('image.png', b'\x89PNG')
+    with pytest.raises(RuntimeError):
+        with storage.open('broken.svg', 'wb') as f:
+            f.write(b'<svg>')
+            raise RuntimeError('Conversion failed')
+    assert webhdfs_server.files == {
+        '/data/output.svg': b'<svg></svg>', '/data/image.png': b'\x89PNG'}
+    assert webhdfs_server.queries[0] == {
+        'op': ['CREATE'], 'overwrite': ['true'], 'user.name': ['psd2svg']}
+
+
+def test_hdfs_missing_directory(tmpdir):
+    from psd2svg.storage import HdfsStorage
+
+    class Client(_LocalHdfsClient):
+        def list(self, path):
+            if not self.exists(path):
+                raise LookupError('File not found: {}'.format(path))
+            return _LocalHdfsClient.list(self, path)
+
+    storage = HdfsStorage('namenode', '/resources', client=Client(
+        str(tmpdir)))
+    assert list(storage.list()) == []
+    assert 'image.png' not in ResourceManifest(storage)
+    storage.put('image.png', b'\x89PNG')
+    assert list(storage.list()) == ['image.png']
+
+
+def test_hdfs_convert(tmpdir, monkeypatch):
+    from PIL import Image
+    from psd_tools import PSDImage
+    from psd2svg import PSD2SVG
+    from psd2svg.storage import HdfsStorage
+    storage = HdfsStorage('namenode', '/data', client=_LocalHdfsClient(
+        str(tmpdir)))
+    psd = PSDImage.frompil(Image.new('RGBA', (8, 8), (255, 0, 0, 255)))
+    with storage.open('input.psd', 'wb') as f:
+        psd.save(f)
+
+    monkeypatch.setattr(
+        'psd2svg.storage.SnakebiteClient',
+        lambda namenode, **kwargs: _LocalHdfsClient(str(tmpdir)))
+    converter = PSD2SVG(resource_path='resources/')
+    url = converter.convert(
+        'hdfs://namenode/data/input.psd', 'hdfs://namenode/data/output/')
+    assert url == 'hdfs://namenode/data/output/input.svg'
+    assert storage.get('output/input.svg').startswith(b'<?xml')
+    assert len(converter.resources) == 1
+
+
+def test_mapped_file(tmpdir):
+    data = os.urandom(1000)
+    tmpdir.join('foo.bin').write_binary(data)
+    storage = get_storage(str(tmpdir))
+    with storage.open_mapped('foo.bin') as f:
+        f.threshold = 100
+        assert f.read(10) == data[:10]
+        view = f.read(200)
+        assert isinstance(view, memoryview) and view == data[10:210]
+        assert f.seek(-10, io.SEEK_END) == 990
+        assert f.read() == data[990:]
+        assert f.read(10) == b''
+    # Data read from the map outlives the file.
+    assert view == data[10:210]
@@ -0,0 +1,52 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+from collections import Counter
+import pytest
+from psd_tools import PSDImage
+from psd2svg import PSD2SVG
+
+generate = pytest.importorskip('psd2svg.synthetic').generate
+
+
+def _depth(group):
+    return max([0] + [_depth(layer) + 1 for layer in group if layer.is_group()])
+
+
+def test_generate():
+    data = io.BytesIO()
+    groups = generate(data, layers=60, depth=2, size=(300, 200),
+                      max_layer_size=64, masks=0.5, effects=0.5)
+    other = io.BytesIO()
+    generate(other, layers=60, depth=2, size=(300, 200), max_layer_size=64,
+             masks=0.5, effects=0.5)
+    assert data.getvalue() == other.getvalue()
+
+    data.seek(0)
+    psd = PSDImage.open(data)
+    assert psd.size == (300, 200)
+    layers = list(psd.descendants())
+    kinds = Counter(layer.kind for layer in layers)
+    assert kinds['group'] == groups
+    assert sum(kinds.values()) - groups == 60
+    assert kinds['pixel'] and kinds['shape'] and kinds['type']
+    assert 0 < _depth(psd) <= 2
+    assert any(layer.has_mask() for layer in layers)
+    assert any(len(layer.effects) for layer in layers)
+    assert all(layer.text for layer in layers if layer.kind == 'type')
+    assert all(layer.vector_mask.initial_fill_rule == 0
+               for layer in layers if layer.kind == 'shape')
+
+    data.seek(0)
+    svg = PSD2SVG(shapes_only=True).convert(data)
+    assert svg.count('<path') == kinds['shape']
+
+
+def test_generate_psb(tmpdir):
+    output = str(tmpdir.join('large.psb'))
+    generate(output, layers=3, depth=0, size=(30001, 8), max_layer_size=8,
+             text=0)
+    psd = PSDImage.open(output)
+    assert psd.version == 2
+    assert psd.size == (30001, 8)
+    assert len(psd) == 3
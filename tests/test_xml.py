@@ -0,0 +1,82 @@
+from __future__ import absolute_import, unicode_literals
+
+import io
+import pytest
+import svgwrite
+import xml.dom.minidom as minidom
+from psd2svg.utils.xml import (
+    remove_default_attributes, round_numbers, serialize)
+
+
+def _create_drawing():
+    dwg = svgwrite.Drawing(size=(10, 10), viewBox='0 0 10 10')
+    mask = dwg.defs.add(dwg.mask())
+    mask.add(dwg.rect(insert=(0, 0), size=(10, 10), fill='white'))
+    dwg.defs.add(dwg.style('g > rect { fill: "red"; }'))
+    group = dwg.add(dwg.g(mask=mask.get_funciri()))
+    group.set_desc(title='Layer <1> & "quoted"\r\nline')
+    group.add(dwg.image('data:image/png;base64,AAAA', insert=(1, 2)))
+    text = group.add(dwg.text(''))
+    text.add(dwg.tspan('a b < c', style='font: "x"'))
+    text.add(dwg.tspan(''))
+    group.add(dwg.path(d='M 0 0 L 1 1\n2\t2', debug=False))
+    return dwg
+
+
+def _minidom_svg(dwg, pretty):
+    with io.StringIO() as f:
+        dwg.write(f, pretty=False)
+        xml_tree = minidom.parseString(f.getvalue().encode('utf-8'))
+    if pretty:
+        return xml_tree.toprettyxml(indent='  ')
+    return xml_tree.toxml()
+
+
+@pytest.mark.parametrize('pretty', [True, False])
+def test_serialize(pretty):
+    dwg = _create_drawing()
+    assert serialize(dwg.get_xml(), pretty=pretty) == _minidom_svg(
+        dwg, pretty)
+
+
+def test_round_numbers():
+    dwg = svgwrite.Drawing()
+    path = dwg.add(dwg.path(d='M 1.23456 -0.0001 L 2e-05 10.5'))
+    path['transform'] = 'translate(1.23456,2) scale(0.333333)'
+    path['class'] = 'layer-1.23456'
+    xml = dwg.get_xml()
+    round_numbers(xml, 2)
+    node = xml.find('path')
+    assert node.get('d') == 'M 1.23 0 L 0 10.5'
+    assert node.get('transform') == 'translate(1.23,2) scale(0.33)'
+    assert node.get('class') == 'layer-1.23456'
+
+
+def test_remove_default_attributes():
+    dwg = svgwrite.Drawing()
+    filt = dwg.defs.add(dwg.filter())
+    filt['x'], filt['y'] = '-10%', '-10%'
+    filt.feOffset('SourceAlpha', dx=0.0, dy=2)
+    dwg.add(dwg.rect(insert=(0, 0), size=(1, 1), opacity=1.0))
+    xml = dwg.get_xml()
+    remove_default_attributes(xml)
+    assert 'x' not in xml.find('defs/filter').attrib
+    assert xml.find('defs/filter/feOffset').attrib == {
+        'in': 'SourceAlpha', 'dy': '2'}
+    assert sorted(xml.find('rect').attrib) == ['height', 'width']
+
+
+def test_renumber_ids():
+    from psd2svg.utils.ids import IDNamespace
+    from psd2svg.utils.xml import renumber_ids
+    dwg = svgwrite.Drawing()
+    mask = dwg.defs.add(dwg.mask(id='x-1'))
+    image = dwg.defs.add(dwg.image('a.png', id='x-0'))
+    mask.add(dwg.use('#x-0'))
+    dwg.add(dwg.rect(mask='url(#x-1)', fill='#000'))
+    xml = dwg.get_xml()
+    renumber_ids(xml, IDNamespace())
+    assert xml.find('defs/mask').get('id') == 'id0'
+    assert xml.find('defs/mask/use').get('xlink:href') == '#id1'
+    assert xml.find('rect').get('mask') == 'url(#id0)'
+    assert xml.find('rect').get('fill') == '#000'